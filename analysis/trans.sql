@@ -1,3 +1,6 @@
+-- Full rebuild. python -m ok_bot.analytics maintains the same tables
+-- incrementally.
+
 DROP TABLE IF EXISTS finished_arbitrage_orders;
 CREATE TABLE finished_arbitrage_orders AS
 SELECT
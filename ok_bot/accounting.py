@@ -1,109 +1,223 @@
 import argparse
 import datetime
 import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+# Fees are reported with 8 decimals.
+FEE_TOLERANCE = 1e-8
+
+# (table, index name, columns), covering the lookups of _CHECKS.
+_INDEXES = (
+    ('runtime_orders', 'idx_runtime_orders__update_time',
+     '(last_update_time, order_id, transaction_id)'),
+    ('runtime_orders', 'idx_runtime_orders__transaction_id',
+     '(transaction_id, order_id)'),
+    ('runtime_transactions', 'idx_runtime_transactions__update_time',
+     '(last_update_time, transaction_id)'),
+    ('reported_orders', 'idx_reported_orders__timestamp',
+     '(timestamp, order_id)'),
+    ('reported_orders', 'idx_reported_orders__order_id', '(order_id)'),
+    ('reported_bills', 'idx_reported_bills__timestamp',
+     '(timestamp, order_id)'),
+    ('reported_bills', 'idx_reported_bills__order_id',
+     '(order_id, type, amount)'),
+)
+
+# name -> (tables it needs, SQL over [:start, :end)).
+# reported_bills is the crawled futures ledger, one row per bill with at
+# least timestamp, order_id, type ('fee', 'match', ...) and amount.
+# Days are UTC days, as OKEX timestamps are UTC ISO strings. The runtime
+# tables stamp last_update_time in local time, they are compared with the
+# same bounds in local time, :local_start and :local_end.
+_CHECKS = {
+    # Orders OKEX knows about but the bot never recorded.
+    'orphan_orders': (('reported_orders', 'runtime_orders'), '''
+        SELECT R.*
+        FROM reported_orders R
+        WHERE R.timestamp >= :start AND R.timestamp < :end
+          AND NOT EXISTS (
+            SELECT 1 FROM runtime_orders O WHERE O.order_id = R.order_id)
+    '''),
+    # Orders the bot recorded but OKEX didn't report.
+    'unreported_orders': (('reported_orders', 'runtime_orders'), '''
+        SELECT O.*
+        FROM runtime_orders O
+        WHERE O.last_update_time >= :local_start
+          AND O.last_update_time < :local_end
+          AND NOT EXISTS (
+            SELECT 1 FROM reported_orders R WHERE R.order_id = O.order_id)
+    '''),
+    'transactions_without_orders': (
+        ('runtime_transactions', 'runtime_orders'), '''
+        SELECT T.*
+        FROM runtime_transactions T
+        WHERE T.last_update_time >= :local_start
+          AND T.last_update_time < :local_end
+          AND NOT EXISTS (
+            SELECT 1 FROM runtime_orders O
+            WHERE O.transaction_id = T.transaction_id)
+    '''),
+    'fee_mismatches': (('reported_orders', 'reported_bills'), '''
+        SELECT * FROM (
+            SELECT
+                R.order_id
+                , R.fee
+                , (SELECT TOTAL(B.amount)
+                   FROM reported_bills B
+                   WHERE B.order_id = R.order_id AND B.type = 'fee'
+                  ) AS billed_fee
+            FROM reported_orders R
+            WHERE R.timestamp >= :start AND R.timestamp < :end
+        )
+        WHERE ABS(COALESCE(fee, 0) - billed_fee) > :tolerance
+    '''),
+    'bills_without_orders': (('reported_bills', 'reported_orders'), '''
+        SELECT B.*
+        FROM reported_bills B
+        WHERE B.timestamp >= :start AND B.timestamp < :end
+          AND B.order_id IS NOT NULL
+          AND NOT EXISTS (
+            SELECT 1 FROM reported_orders R WHERE R.order_id = B.order_id)
+    '''),
+}
+
+
+def parse_date(date_str, end=False):
+    """'2019-01-31', or the first day of '2019-01' or '2019', the last day
+    if it is an end bound."""
+    parts = [int(part) for part in date_str.split('-')]
+    if len(parts) == 3:
+        return datetime.date(*parts)
+    if len(parts) == 1:
+        return datetime.date(parts[0], 12, 31) if end else \
+            datetime.date(parts[0], 1, 1)
+    first = datetime.date(parts[0], parts[1], 1)
+    if not end:
+        return first
+    next_month = (first + datetime.timedelta(days=31)).replace(day=1)
+    return next_month - datetime.timedelta(days=1)
+
+
+def _local_time(day):
+    """UTC midnight of day as a local time string, the format of
+    DATETIME('now', 'localtime')."""
+    midnight = datetime.datetime.combine(
+        day, datetime.time(), tzinfo=datetime.timezone.utc)
+    return midnight.astimezone().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _existing_tables(conn):
+    return {row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+
+def create_indexes(db_file):
+    conn = sqlite3.connect(db_file)
+    try:
+        tables = _existing_tables(conn)
+        for table, name, columns in _INDEXES:
+            if table in tables:
+                conn.execute(
+                    f'CREATE INDEX IF NOT EXISTS {name} ON {table} {columns}')
+        conn.execute('ANALYZE')
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def reconcile_day(db_file, day, max_examples=10):
+    """Runs every check on one day.
+
+    Rows are streamed from the cursor, only the count and the first
+    max_examples rows of each check are kept, so memory does not grow with
+    the size of the day. max_examples=None keeps all rows.
+    :return: (day, {check: (count, [example row as dict])})
+    """
+    conn = sqlite3.connect(f'file:{db_file}?mode=ro', uri=True)
+    conn.row_factory = sqlite3.Row
+    try:
+        tables = _existing_tables(conn)
+        next_day = day + datetime.timedelta(days=1)
+        params = {
+            'start': day.isoformat(),
+            'end': next_day.isoformat(),
+            'local_start': _local_time(day),
+            'local_end': _local_time(next_day),
+            'tolerance': FEE_TOLERANCE,
+        }
+        results = {}
+        for check, (required_tables, sql) in _CHECKS.items():
+            if not tables.issuperset(required_tables):
+                continue
+            count = 0
+            examples = []
+            for row in conn.execute(sql, params):
+                count += 1
+                if max_examples is None or len(examples) < max_examples:
+                    examples.append(dict(row))
+            results[check] = (count, examples)
+        return day, results
+    finally:
+        conn.close()
 
 
 class Accounting:
     def __init__(self, db_file, start_date_str, end_date_str):
-        self.db_conn = sqlite3.connect(db_file)
-        self.db_conn.row_factory = sqlite3.Row
-        self.start_date_str = start_date_str
-        self.end_date_str = end_date_str + ' 23:59:59'
-        self.orders = self.fetch_orders()
-        self.transactions = self.fetch_transactions()
-        self.trans_order = {}
-        self.order_trans = {}
-        self.orphan_orders = []
-        self.transaction_and_order_match()
-
-    def check(self):
-        pass
+        self.db_file = db_file
+        self.start_date = parse_date(start_date_str)
+        self.end_date = parse_date(end_date_str, end=True)
+
+    def days(self):
+        day = self.start_date
+        while day <= self.end_date:
+            yield day
+            day += datetime.timedelta(days=1)
+
+    def reconcile(self, jobs=1, max_examples=10):
+        """Yields reconcile_day() of every day in order, jobs days at once."""
+        fn = partial(reconcile_day, self.db_file, max_examples=max_examples)
+        if jobs <= 1:
+            yield from map(fn, self.days())
+            return
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            yield from executor.map(fn, self.days())
+
+    def check(self, jobs=1, max_examples=10):
+        totals = {}
+        for day, results in self.reconcile(jobs, max_examples):
+            for check, (count, examples) in results.items():
+                totals[check] = totals.get(check, 0) + count
+                if count:
+                    print(f'{day} {check}: {count} found')
+                for row in examples:
+                    print('=' * 50)
+                    for col, value in row.items():
+                        print(f'{col}: {value}')
+                    print('=' * 50)
+                    print()
+        for check, count in totals.items():
+            print(f'{check}: {count} found in total')
+        return totals
+
+    @property
+    def orphan_orders(self):
+        """Reported orders of the date range the bot never recorded."""
+        return [row
+                for _, results in self.reconcile(max_examples=None)
+                for row in results.get('orphan_orders', (0, []))[1]]
 
     def check_orphan_orders(self):
-        print(f'{len(self.orphan_orders)} found')
-        for order in self.orphan_orders:
+        """Prints orphan_orders, check() covers it among other checks."""
+        orders = self.orphan_orders
+        print(f'{len(orders)} found')
+        for order in orders:
             print('=' * 50)
             for col in order.keys():
                 print(f'{col}: {order[col]}')
             print('=' * 50)
             print()
 
-    def transaction_and_order_match(self):
-        SQL = '''
-            SELECT
-                order_id
-                , transaction_id
-            FROM runtime_orders
-            WHERE
-                last_update_time >= :start_date
-                AND last_update_time <= :end_date
-        '''
-        cursor = self.db_conn.cursor()
-        cursor.execute(SQL, {
-            'start_date': self.start_date_str,
-            'end_date': self.end_date_str,
-        })
-        matches = cursor.fetchall()
-        self.trans_order = {}
-        self.order_trans = {}
-        for m in matches:
-            order_id = int(m['order_id'])
-            trans_id = m['transaction_id']
-            assert order_id not in self.order_trans or \
-                self.order_trans[order_id] == trans_id, \
-                f'Order({order_id}) ownership inconsistent, claimed by ' \
-                f'{trans_id} and {self.order_trans[order_id]}'
-            self.order_trans[order_id] = trans_id
-            order_set = self.trans_order.setdefault(trans_id, set())
-            order_set.add(order_id)
-
-        for order in self.orders:
-            if order['order_id'] not in self.order_trans:
-                self.orphan_orders.append(order)
-
-    def fetch_transactions(self):
-        SQL = '''
-            SELECT *
-            FROM runtime_transactions
-            WHERE last_update_time >= :start_date
-              AND last_update_time <= :end_date
-        '''
-        cursor = self.db_conn.cursor()
-        cursor.execute(SQL, {
-            'start_date': self.start_date_str,
-            'end_date': self.end_date_str,
-        })
-        return cursor.fetchall()
-
-    def fetch_orders(self):
-        """
-        :return: Orders crawled from OKEX. Columns:
-            ['order_id',
-             'instrument_id',
-             'size',
-             'timestamp',
-             'filled_qty',
-             'fee',
-             'price',
-             'price_avg',
-             'status',
-             'type',
-             'contract_val',
-             'leverage']
-        """
-        SQL = '''
-            SELECT *
-            FROM reported_orders
-            WHERE timestamp >= :start_date
-              AND timestamp <= :end_date
-        '''
-        cursor = self.db_conn.cursor()
-        cursor.execute(SQL, {
-            'start_date': self.start_date_str,
-            'end_date': self.end_date_str,
-        })
-        return cursor.fetchall()
-
 
 if __name__ == '__main__':
     args = argparse.ArgumentParser(description='Offline account checking')
@@ -113,10 +227,15 @@ if __name__ == '__main__':
                       default='2018-09-01', required=True)
     args.add_argument('--end', help='End date string, e.x. 2018-12-01',
                       default=datetime.datetime.now().strftime('%Y-%m-%d'))
+    args.add_argument('--jobs', type=int, default=1,
+                      help='Number of days reconciled in parallel')
+    args.add_argument('--max-examples', type=int, default=10,
+                      help='Problem rows printed per check and day')
+    args.add_argument('--no-create-indexes', action='store_true',
+                      help="Don't create the indexes the checks rely on")
     args = args.parse_args()
 
-    accounting = Accounting(args.db, args.start, args.end)
-    accounting.check_orphan_orders()
-
-
-
+    if not args.no_create_indexes:
+        create_indexes(args.db)
+    Accounting(args.db, args.start, args.end).check(args.jobs,
+                                                    args.max_examples)
@@ -0,0 +1,181 @@
+"""Keeps the tables of analysis/trans.sql up to date incrementally.
+
+Only transactions with an order or transaction row updated since the last
+run are recomputed, so refreshing is cheap no matter how much history the
+database has.
+
+python -m ok_bot.analytics --db prod.db --interval 60
+"""
+import argparse
+import logging
+import sqlite3
+import time
+
+from .accounting import create_indexes
+
+_WATERMARK = 'arbitrage_gains'
+
+_CREATE_TABLES_SQL = '''
+    CREATE TABLE IF NOT EXISTS analytics_watermarks (
+        name                TEXT PRIMARY KEY,
+        last_update_time    TEXT
+    );
+    CREATE TABLE IF NOT EXISTS finished_arbitrage_orders (
+        transaction_id      TEXT,
+        last_update_time    TEXT,
+        order_type          INTEGER,
+        status              INTEGER,
+        filled_qty          INTEGER,
+        price_avg           NUMERIC,
+        fee                 NUMERIC
+    );
+    CREATE INDEX IF NOT EXISTS idx_finished_arbitrage_orders__transaction_id
+        ON finished_arbitrage_orders (transaction_id);
+    CREATE TABLE IF NOT EXISTS arbitrage_gains (
+        transaction_id      TEXT,
+        start_time          TEXT,
+        pre_fee_gain        TEXT,
+        gain                TEXT,
+        fee                 TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_arbitrage_gains__transaction_id
+        ON arbitrage_gains (transaction_id);
+'''
+
+# Same as analysis/trans.sql, limited to the transactions in affected.
+_REFRESH_SQL = '''
+    DELETE FROM finished_arbitrage_orders
+    WHERE transaction_id IN (SELECT transaction_id FROM affected);
+
+    INSERT INTO finished_arbitrage_orders
+    SELECT
+      T.transaction_id
+      , T.last_update_time
+      , O.type as order_type
+      , O.status
+      , O.filled_qty
+      , O.price_avg
+      , O.fee
+    FROM affected A
+    JOIN runtime_transactions T
+    ON
+      T.transaction_id = A.transaction_id
+    JOIN runtime_orders O
+    ON
+      O.transaction_id = T.transaction_id
+    WHERE
+      T.status = 'ended_normally'
+      AND O.fee < 0
+    ;
+
+    DELETE FROM arbitrage_gains
+    WHERE transaction_id IN (SELECT transaction_id FROM affected);
+
+    INSERT INTO arbitrage_gains
+    SELECT
+      transaction_id
+      , min(last_update_time) as start_time
+      , printf("%.6f", sum(10.0 * filled_qty / price_avg *
+          (CASE order_type
+            WHEN 2 THEN -1
+            WHEN 3 THEN -1
+            ELSE 1
+           END)
+        ))AS pre_fee_gain
+      , printf("%.6f", sum(10.0 * filled_qty / price_avg *
+          (CASE order_type
+            WHEN 2 THEN -1
+            WHEN 3 THEN -1
+            ELSE 1
+           END)
+           + fee
+        )) AS gain
+      , printf("%.6f", sum(fee)) AS fee
+    FROM
+      finished_arbitrage_orders
+    WHERE
+      transaction_id IN (SELECT transaction_id FROM affected)
+    GROUP BY
+      transaction_id
+    ;
+'''
+
+
+def _last_update_time(conn):
+    row = conn.execute(
+        'SELECT last_update_time FROM analytics_watermarks WHERE name = ?',
+        (_WATERMARK,)).fetchone()
+    return row[0] if row else ''
+
+
+def refresh(conn, rebuild=False):
+    """Recomputes the transactions updated since the last refresh.
+
+    Rows of the second the watermark points to are processed again, they
+    may have been written after the previous refresh read them. Returns the
+    number of recomputed transactions.
+    """
+    conn.executescript(_CREATE_TABLES_SQL)
+    since = '' if rebuild else _last_update_time(conn)
+    # The watermark is read before the affected rows, anything written
+    # meanwhile is picked up by the next refresh.
+    until = conn.execute('''
+        SELECT MAX(t) FROM (
+            SELECT MAX(last_update_time) AS t FROM runtime_transactions
+            UNION ALL
+            SELECT MAX(last_update_time) FROM runtime_orders)
+    ''').fetchone()[0]
+    if until is None:
+        return 0
+
+    with conn:
+        conn.execute('DROP TABLE IF EXISTS temp.affected')
+        conn.execute('''
+            CREATE TEMP TABLE affected AS
+            SELECT transaction_id FROM runtime_transactions
+            WHERE last_update_time >= :since
+            UNION
+            SELECT transaction_id FROM runtime_orders
+            WHERE last_update_time >= :since
+              AND transaction_id IS NOT NULL
+        ''', {'since': since})
+        num_affected = conn.execute(
+            'SELECT COUNT(*) FROM affected').fetchone()[0]
+        for statement in _REFRESH_SQL.split(';'):
+            if statement.strip():
+                conn.execute(statement)
+        conn.execute(
+            'INSERT OR REPLACE INTO analytics_watermarks VALUES (?, ?)',
+            (_WATERMARK, until))
+    conn.execute('DROP TABLE temp.affected')
+    return num_affected
+
+
+def main():
+    args = argparse.ArgumentParser(
+        description='Incrementally refresh the arbitrage analytics tables')
+    args.add_argument('--db', default='prod.db', help='Sqlite3 DB file')
+    args.add_argument('--interval', type=float, default=0,
+                      help='Refresh every this many seconds, 0 to run once')
+    args.add_argument('--rebuild', action='store_true',
+                      help='Recompute all transactions on the first refresh')
+    args = args.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    create_indexes(args.db)
+    conn = sqlite3.connect(args.db)
+    rebuild = args.rebuild
+    while True:
+        start = time.time()
+        num_affected = refresh(conn, rebuild=rebuild)
+        rebuild = False
+        logging.info('refreshed %d transactions in %.3f sec',
+                     num_affected, time.time() - start)
+        if args.interval <= 0:
+            break
+        time.sleep(max(0.0, args.interval - (time.time() - start)))
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -56,10 +56,13 @@ class FutureAPI(Client):
         return self._request_with_params(POST, FUTURE_DELETE_POSITION, params)
 
     # take order
-    def take_order(self, client_oid, instrument_id, otype, price, size, match_price, leverage):
+    def take_order(self, client_oid, instrument_id, otype, price, size, match_price, leverage, order_type=None):
         # params = {'instrument_id': instrument_id, 'otype': otype, 'price': price, 'order': order_Qty, 'match_price': match_price, 'client_id': client_id}
         #import pdb; pdb.set_trace()
         params = {'client_oid': client_oid, 'instrument_id': instrument_id, 'type': otype, 'price': price, 'size': size, 'match_price':match_price, 'leverage': leverage}
+        # order_type: 0 normal limit order, 1 post only, 2 FOK, 3 IOC
+        if order_type is not None:
+            params['order_type'] = order_type
         return self._request_with_params(POST, FUTURE_ORDER, params)
 
     #take orders
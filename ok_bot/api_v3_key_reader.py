@@ -1,14 +1,18 @@
+import functools
 import os
 
 _ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
-API_KEY = None
-KEY_SECRET = None
-PASS_PHRASE = None
 
-with open(os.path.join(_ROOT_DIR, 'api_key_v3')) as key_file:
-    API_KEY = key_file.read().strip()
-with open(os.path.join(_ROOT_DIR, 'secret_key_v3')) as secret_file:
-    KEY_SECRET = secret_file.read().strip()
-with open(os.path.join(_ROOT_DIR, 'pass_phrase_v3')) as secret_file:
-    PASS_PHRASE = secret_file.read().strip()
+def _read(name):
+    with open(os.path.join(_ROOT_DIR, name)) as key_file:
+        return key_file.read().strip()
+
+
+@functools.lru_cache(maxsize=None)
+def read_keys():
+    """(API key, secret key, pass phrase), read on first use so that
+    modules using them import without the key files."""
+    return (_read('api_key_v3'),
+            _read('secret_key_v3'),
+            _read('pass_phrase_v3'))
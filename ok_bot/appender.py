@@ -0,0 +1,179 @@
+"""Background appender of binary files partitioned by UTC day.
+
+Shared by the tick store and the journal: callers only enqueue, a thread
+converts batches of items to bytes and appends them to
+<root>/<YYYY-MM-DD>/<name> files.
+"""
+import atexit
+import datetime
+import logging
+import os
+import queue
+import threading
+import time
+import weakref
+
+
+def utc_day(timestamp_sec):
+    return datetime.datetime.utcfromtimestamp(timestamp_sec).strftime(
+        '%Y-%m-%d')
+
+
+class DailyAppender:
+    """Appends items from a background thread.
+
+    Subclasses enqueue items (tuples) with _put() and implement
+    _partition(), which splits a batch into {(day, ...): items}, and
+    _encode(), which converts the items of one partition into
+    (num_records, [(name within the day, bytes)]).
+
+    A partition is written all or nothing. Items that fail to convert are
+    dropped one by one, a partition that fails to write is dropped without
+    the rest of the batch.
+    """
+    _FLUSH = object()
+    _SHUTDOWN = object()
+
+    def __init__(self, root, name):
+        self.root = root
+        self.num_records = 0
+        self._files = {}  # (day, name) -> file
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run,
+                                        name=name,
+                                        daemon=True)
+        self._thread.start()
+        _appenders.add(self)
+
+    def _put(self, item):
+        self._queue.put(item)
+
+    def flush(self, timeout=None):
+        """Blocks until every item put so far is written."""
+        done = threading.Event()
+        self._queue.put((self._FLUSH, done))
+        return done.wait(timeout)
+
+    def shutdown(self, wait=True):
+        if self._thread.is_alive():
+            self._queue.put((self._SHUTDOWN, None))
+        if wait:
+            self._thread.join()
+            _appenders.discard(self)
+
+    def _flush_interval(self):
+        raise NotImplementedError
+
+    def _partition(self, items):
+        raise NotImplementedError
+
+    def _encode(self, partition, items):
+        raise NotImplementedError
+
+    def _run(self):
+        running = True
+        while running:
+            batch = [self._queue.get()]
+            deadline = time.time() + self._flush_interval()
+            while batch[-1][0] not in (self._FLUSH, self._SHUTDOWN):
+                try:
+                    batch.append(self._queue.get(
+                        timeout=max(0.0, deadline - time.time())))
+                except queue.Empty:
+                    break
+
+            running = all(item[0] is not self._SHUTDOWN for item in batch)
+            try:
+                self._append([item for item in batch
+                              if item[0] not in (self._FLUSH,
+                                                 self._SHUTDOWN)])
+            except Exception:
+                logging.error('exception in %s', type(self).__name__,
+                              exc_info=True)
+            finally:
+                for item in batch:
+                    if item[0] is self._FLUSH:
+                        item[1].set()
+        for f in self._files.values():
+            f.close()
+        self._files.clear()
+
+    def _append(self, items):
+        partitions = self._partition(items)
+        for partition, part_items in partitions.items():
+            try:
+                num, data = self._encode(partition, part_items)
+            except Exception:
+                num, data = self._encode_each(partition, part_items)
+            try:
+                self._write(partition[0], data)
+            except OSError:
+                logging.error('dropped %d records of %s', num, partition,
+                              exc_info=True)
+                continue
+            self.num_records += num
+        if partitions:
+            self._close_other_days(max(p[0] for p in partitions))
+
+    def _encode_each(self, partition, items):
+        """_encode() of the items that convert on their own."""
+        num = 0
+        chunks = {}  # name -> [bytes]
+        for item in items:
+            try:
+                item_num, data = self._encode(partition, [item])
+            except Exception:
+                logging.error('dropped an item of %s: %r', partition, item,
+                              exc_info=True)
+                continue
+            num += item_num
+            for name, chunk in data:
+                chunks.setdefault(name, []).append(chunk)
+        return num, [(name, b''.join(c)) for name, c in chunks.items()]
+
+    def _write(self, day, data):
+        """Appends to all files of a partition or to none of them."""
+        files = [self._file(day, name) for name, _ in data]
+        sizes = [f.tell() for f in files]
+        try:
+            for f, (_, chunk) in zip(files, data):
+                f.write(chunk)
+            for f in files:
+                f.flush()
+        except OSError:
+            # Files written together (e.g. columns) would be misaligned
+            # with every later batch, cut them back to where this one
+            # started.
+            for (name, _), size in zip(data, sizes):
+                f = self._files.pop((day, name))
+                try:
+                    f.close()
+                except OSError:
+                    pass
+                os.truncate(os.path.join(self.root, day, name), size)
+            raise
+
+    def _file(self, day, name):
+        key = (day, name)
+        if key not in self._files:
+            path = os.path.join(self.root, day, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._files[key] = open(path, 'ab')
+        return self._files[key]
+
+    def _close_other_days(self, day):
+        for key in [k for k in self._files if k[0] != day]:
+            self._files.pop(key).close()
+
+
+# Appenders still running, shut down at exit. One atexit hook for all of
+# them, each appender is dropped once it has shut down.
+_appenders = weakref.WeakSet()
+
+
+def _shutdown_appenders():
+    for appender in list(_appenders):
+        appender.shutdown()
+
+
+atexit.register(_shutdown_appenders)
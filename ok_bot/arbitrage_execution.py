@@ -1,4 +1,5 @@
 import asyncio
+import bisect
 import collections
 import concurrent
 import datetime
@@ -6,21 +7,167 @@ import logging
 import time
 import uuid
 
-from . import singleton
+from . import constants, singleton
 from .constants import (CLOSE_POSITION_ORDER_TIMEOUT_SECOND,
                         FAST_LEG_ORDER_FULFILLMENT_TIMEOUT_SECOND, LONG,
                         MIN_AVAILABLE_AMOUNT_FOR_CLOSING_ARBITRAGE,
                         PRICE_CONVERGE_TIMEOUT_IN_SECOND, SHORT,
                         SLOW_LEG_ORDER_FULFILLMENT_TIMEOUT_SECOND)
 from .logger import create_transaction_logger, init_global_logger
-from .order_executor import OrderExecutionResult, OrderExecutor
+from .order_executor import (ChaseExecutor, OrderExecutionResult,
+                             OrderExecutor)
 from .report import Report
+from .stats import Stats
 from .trigger_strategy import calculate_amount_margin
 
 ArbitrageLeg = collections.namedtuple(
     'ArbitrageLeg',
     ['instrument_id', 'side', 'volume', 'price'])
 
+# Seconds from a slow leg fill being observed until the fast leg hedge for it
+# is resolved, one sample per hedged contract.
+hedge_latency_stats = Stats(constants.EXECUTION_LATENCY_STATS_WINDOW_SECOND)
+
+
+class ConvergenceMonitor:
+    """Resolves every WaitingPriceConverge of an instrument pair on ticks.
+
+    The amount margin only grows with the gap threshold, so the smallest
+    threshold that has enough margin is computed once per tick and all the
+    waiters above it are resolved from a sorted threshold index.
+
+    The monitor is subscribed to the book from the first add() until every
+    added waiter, resolved or not, has been removed.
+    """
+    _LOG_INTERVAL_SECOND = 30
+
+    def __init__(self, ask_stack_instrument, bid_stack_instrument):
+        self._ask_stack_instrument = ask_stack_instrument
+        self._bid_stack_instrument = bid_stack_instrument
+        # Sorted by threshold, _waiters is parallel to _thresholds. Only the
+        # waiters not resolved yet.
+        self._thresholds = []
+        self._waiters = []
+        # Every waiter added and not removed yet.
+        self._members = set()
+        self._last_log_time_sec = 0
+
+    @property
+    def key(self):
+        return self._ask_stack_instrument, self._bid_stack_instrument
+
+    def __len__(self):
+        return len(self._members)
+
+    def add(self, waiter):
+        if waiter in self._members:
+            return
+        if len(self._members) == 0:
+            singleton.book_listener.subscribe(self._ask_stack_instrument, self)
+            singleton.book_listener.subscribe(self._bid_stack_instrument, self)
+        self._members.add(waiter)
+        i = bisect.bisect_right(self._thresholds, waiter.threshold)
+        self._thresholds.insert(i, waiter.threshold)
+        self._waiters.insert(i, waiter)
+
+    def remove(self, waiter):
+        if waiter not in self._members:
+            return
+        self._members.remove(waiter)
+        lo = bisect.bisect_left(self._thresholds, waiter.threshold)
+        hi = bisect.bisect_right(self._thresholds, waiter.threshold)
+        for i in range(lo, hi):
+            if self._waiters[i] is waiter:
+                del self._thresholds[i]
+                del self._waiters[i]
+                break
+        if len(self._members) == 0:
+            singleton.book_listener.unsubscribe(
+                self._ask_stack_instrument, self)
+            singleton.book_listener.unsubscribe(
+                self._bid_stack_instrument, self)
+
+    def amount_margin(self, threshold):
+        return calculate_amount_margin(
+            singleton.order_book.market_depth(
+                self._ask_stack_instrument).ask(),
+            singleton.order_book.market_depth(
+                self._bid_stack_instrument).bid(),
+            max_gap=threshold
+        )
+
+    def min_converged_gap(self):
+        """Returns the smallest threshold with enough margin, or None."""
+        ask_stack = singleton.order_book.market_depth(
+            self._ask_stack_instrument).ask()
+        bid_stack = singleton.order_book.market_depth(
+            self._bid_stack_instrument).bid()
+        # Margin only changes at these gaps.
+        gaps = sorted(set(ask.price - bid.price
+                          for ask in ask_stack for bid in bid_stack))
+        lo, hi = 0, len(gaps)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.amount_margin(gaps[mid]) >= \
+                    MIN_AVAILABLE_AMOUNT_FOR_CLOSING_ARBITRAGE:
+                hi = mid
+            else:
+                lo = mid + 1
+        return gaps[lo] if lo < len(gaps) else None
+
+    def tick_received(self, instrument_id,
+                      ask_prices, ask_vols, bid_prices, bid_vols,
+                      timestamp):
+        assert instrument_id in [self._ask_stack_instrument,
+                                 self._bid_stack_instrument]
+        if len(self._waiters) == 0:
+            return
+
+        current_gap = (
+            singleton.order_book.market_depth(
+                self._ask_stack_instrument).best_ask_price() -
+            singleton.order_book.market_depth(
+                self._bid_stack_instrument).best_bid_price())
+        now = time.time()
+        if now - self._last_log_time_sec >= self._LOG_INTERVAL_SECOND:
+            self._last_log_time_sec = now
+            for waiter in self._waiters:
+                waiter.waiting(current_gap,
+                               self.amount_margin(waiter.threshold))
+
+        # Nothing to do when even the loosest waiter hasn't converged.
+        if self.amount_margin(self._thresholds[-1]) < \
+                MIN_AVAILABLE_AMOUNT_FOR_CLOSING_ARBITRAGE:
+            return
+
+        min_gap = self.min_converged_gap()
+        i = bisect.bisect_left(self._thresholds, min_gap)
+        resolved = self._waiters[i:]
+        del self._thresholds[i:]
+        del self._waiters[i:]
+        for waiter in resolved:
+            waiter.converged(current_gap, self.amount_margin(waiter.threshold))
+
+
+_convergence_monitors = {}
+
+
+def _add_to_convergence_monitor(waiter, ask_stack_instrument,
+                                bid_stack_instrument):
+    key = ask_stack_instrument, bid_stack_instrument
+    if key not in _convergence_monitors:
+        _convergence_monitors[key] = ConvergenceMonitor(*key)
+    monitor = _convergence_monitors[key]
+    monitor.add(waiter)
+    return monitor
+
+
+def _remove_from_convergence_monitor(waiter, monitor):
+    """Drops the pair's monitor along with its last waiter."""
+    monitor.remove(waiter)
+    if len(monitor) == 0 and _convergence_monitors.get(monitor.key) is monitor:
+        del _convergence_monitors[monitor.key]
+
 
 class WaitingPriceConverge:
     def __init__(self, transaction, timeout_sec):
@@ -39,15 +186,18 @@ class WaitingPriceConverge:
                             f'fast leg: {self.fast_leg.side}')
         self.logger = transaction.logger
         self._future = singleton.loop.create_future()
+        self._monitor = None
+
+    @property
+    def threshold(self):
+        return self._transaction.close_price_gap_threshold
 
     async def __aenter__(self):
         if self._timeout_sec <= 0:
             return None  # None means timeout
 
-        singleton.book_listener.subscribe(
-            self._transaction.slow_leg.instrument_id, self)
-        singleton.book_listener.subscribe(
-            self._transaction.fast_leg.instrument_id, self)
+        self._monitor = _add_to_convergence_monitor(
+            self, self._ask_stack_instrument, self._bid_stack_instrument)
 
         try:
             res = await asyncio.wait_for(
@@ -58,58 +208,34 @@ class WaitingPriceConverge:
             return res
 
     async def __aexit__(self, exc_type, exc_value, traceback):
-        singleton.book_listener.unsubscribe(
-            self._transaction.slow_leg.instrument_id, self)
-        singleton.book_listener.unsubscribe(
-            self._transaction.fast_leg.instrument_id, self)
+        if self._monitor is not None:
+            _remove_from_convergence_monitor(self, self._monitor)
+            self._monitor = None
 
         if exc_type is not None:
             self.logger.critical(
                 'exception within WaitingPriceConverge', exc_info=True)
 
-    def tick_received(self, instrument_id,
-                      ask_prices, ask_vols, bid_prices, bid_vols,
-                      timestamp):
-        assert instrument_id in [self._ask_stack_instrument,
-                                 self._bid_stack_instrument]
-
-        if self._future.done():
-            return
-
-        cur_amount_margin = calculate_amount_margin(
-            singleton.order_book.market_depth(
-                self._ask_stack_instrument).ask(),
-            singleton.order_book.market_depth(
-                self._bid_stack_instrument).bid(),
-            lambda ask_price, bid_price:
-            ask_price - bid_price <= self._transaction.close_price_gap_threshold
-        )
-
-        self.logger.log_every_n_seconds(
-            logging.INFO,
+    def waiting(self, current_gap, amount_margin):
+        self.logger.info(
             '[WAITING PRICE CONVERGE] current_gap:%.3f, max_gap: %.3f, '
             'available_amount: %d',
-            30,
-            singleton.order_book.market_depth(
-                self._ask_stack_instrument).best_ask_price() -
-            singleton.order_book.market_depth(
-                self._bid_stack_instrument).best_bid_price(),
-            self._transaction.close_price_gap_threshold,
-            cur_amount_margin
+            current_gap,
+            self.threshold,
+            amount_margin
         )
 
-        if cur_amount_margin >= MIN_AVAILABLE_AMOUNT_FOR_CLOSING_ARBITRAGE:
-            self.logger.info(
-                '[WAITING PRICE SUCCEEDED] current_gap:%.3f,'
-                ' max_gap: %.3f, available_amount: %d',
-                singleton.order_book.market_depth(
-                    self._ask_stack_instrument).best_ask_price() -
-                singleton.order_book.market_depth(
-                    self._bid_stack_instrument).best_bid_price(),
-                self._transaction.close_price_gap_threshold,
-                cur_amount_margin
-            )
-            self._future.set_result(cur_amount_margin)
+    def converged(self, current_gap, amount_margin):
+        if self._future.done():
+            return
+        self.logger.info(
+            '[WAITING PRICE SUCCEEDED] current_gap:%.3f,'
+            ' max_gap: %.3f, available_amount: %d',
+            current_gap,
+            self.threshold,
+            amount_margin
+        )
+        self._future.set_result(amount_margin)
 
 
 class ArbitrageTransaction:
@@ -118,7 +244,8 @@ class ArbitrageTransaction:
                  fast_leg,
                  close_price_gap_threshold,
                  estimate_net_profit=None,
-                 z_score=None):
+                 z_score=None,
+                 strategy=None):
         assert slow_leg.volume == fast_leg.volume
         self.id = str(uuid.uuid4())
         self.slow_leg = slow_leg
@@ -143,10 +270,15 @@ class ArbitrageTransaction:
                     start_time_sec=self._start_time_sec,
                     end_time_sec=time.time(),
                     estimate_net_profit=estimate_net_profit,
-                    status=status)
+                    status=status,
+                    slow_instrument_id=self.slow_leg.instrument_id,
+                    fast_instrument_id=self.fast_leg.instrument_id,
+                    strategy=strategy)
         )
 
-    def open_position(self, leg: ArbitrageLeg, timeout_in_sec: int, safe_price) -> OrderExecutionResult:
+    def open_position(self, leg: ArbitrageLeg, timeout_in_sec: int, safe_price,
+                      execution_type=constants.ORDER_EXECUTION_TYPE__NORMAL,
+                      fill_callback=None) -> OrderExecutionResult:
         assert leg.side in [LONG, SHORT]
         order_executor = OrderExecutor(
             instrument_id=leg.instrument_id,
@@ -156,7 +288,9 @@ class ArbitrageTransaction:
             is_market_order=False,
             logger=self.logger,
             transaction_id=self.id,
-            safe_price=safe_price)
+            safe_price=safe_price,
+            execution_type=execution_type,
+            fill_callback=fill_callback)
         if leg.side == LONG:
             return order_executor.open_long_position()
         else:
@@ -192,14 +326,34 @@ class ArbitrageTransaction:
                              price)
             return order_executor.close_short_order()
 
+    def chase_close_position(self, leg: ArbitrageLeg, prices,
+                             amount) -> OrderExecutionResult:
+        assert leg.side in [LONG, SHORT]
+        chase_executor = ChaseExecutor(
+            instrument_id=leg.instrument_id,
+            amount=amount,
+            logger=self.logger,
+            transaction_id=self.id,
+            prices=prices)
+        self.logger.info('[CLOSE CHASE] closing %s position', leg.side)
+        if leg.side == LONG:
+            return chase_executor.close_long_order()
+        else:
+            return chase_executor.close_short_order()
+
     async def close_position_guaranteed(self, leg, prices, amount):
         while amount > 0:
-            close_status = await self.close_position(
-                leg,
-                CLOSE_POSITION_ORDER_TIMEOUT_SECOND,
-                prices=prices,
-                amount=amount
-            )
+            if constants.CHASE_CLOSE_ORDERS:
+                # Backs off by itself when orders fail to be placed.
+                close_status = await self.chase_close_position(
+                    leg, prices=prices, amount=amount)
+            else:
+                close_status = await self.close_position(
+                    leg,
+                    CLOSE_POSITION_ORDER_TIMEOUT_SECOND,
+                    prices=prices,
+                    amount=amount
+                )
             if close_status.succeeded:
                 self.logger.info(
                     '[CLOSE POSITION GUARANTEED] succeeded: %s', leg)
@@ -219,29 +373,35 @@ class ArbitrageTransaction:
             '\nslow leg: %s\n%s\n'
             'fast leg: %s\n%s',
             self.slow_leg,
-            singleton.order_book.market_depth(self.slow_leg.instrument_id),
+            singleton.order_book.market_depth(
+                self.slow_leg.instrument_id).snapshot(),
             self.fast_leg,
-            singleton.order_book.market_depth(self.fast_leg.instrument_id))
-
-        result = await self._process()
-
-        # We don't want to block new arbitrage spawned during report generating.
-        singleton.trader.on_going_arbitrage_count -= 1
-        net_profit = await self.report.report_profit()
-
-        self.logger.critical(
-            '[SUMMARY %s]\n'
-            'net_profit: %.8f %s (estimate=%.8f)\n'
-            'z-score: %.2f\n'
-            '%s',
-            self.id,
-            net_profit,
-            singleton.coin_currency,
-            self.estimate_net_profit,
-            self.z_score,
-            self.report)
-        self.logger.info(f'=== arbitrage transaction ended === {self.id}')
-        return result
+            singleton.order_book.market_depth(
+                self.fast_leg.instrument_id).snapshot())
+
+        try:
+            result = await self._process()
+
+            # We don't want to block new arbitrage spawned during report
+            # generating.
+            singleton.trader.on_going_arbitrage_count -= 1
+            net_profit = await self.report.report_profit()
+
+            self.logger.critical(
+                '[SUMMARY %s]\n'
+                'net_profit: %.8f %s (estimate=%.8f)\n'
+                'z-score: %.2f\n'
+                '%s',
+                self.id,
+                net_profit,
+                singleton.coin_currency,
+                self.estimate_net_profit,
+                self.z_score,
+                self.report.snapshot())
+            self.logger.info(f'=== arbitrage transaction ended === {self.id}')
+            return result
+        finally:
+            self.logger.close()
 
     async def _process(self):
         async def await_close_extra_slow_position(close_order):
@@ -254,11 +414,17 @@ class ArbitrageTransaction:
 
         self._db_transaction_status_updater('opening_slow_leg')
         self.logger.info('[OPENING SLOW]')
-        slow_open_order = await self.open_position(
-            self.slow_leg,
-            SLOW_LEG_ORDER_FULFILLMENT_TIMEOUT_SECOND,
-            safe_price=False
-        )
+        if constants.INCREMENTAL_FAST_LEG_HEDGING:
+            slow_open_order, fast_open_orders = \
+                await self.open_slow_leg_with_incremental_hedging()
+        else:
+            slow_open_order = await self.open_position(
+                self.slow_leg,
+                SLOW_LEG_ORDER_FULFILLMENT_TIMEOUT_SECOND,
+                safe_price=False,
+                execution_type=constants.SLOW_LEG_ORDER_EXECUTION_TYPE
+            )
+            fast_open_orders = None
 
         slow_fulfilled_amount = slow_open_order.fulfilled_quantity
         if slow_fulfilled_amount == 0:
@@ -273,19 +439,23 @@ class ArbitrageTransaction:
         self._db_transaction_status_updater('opening_fast_leg')
         self.adjust_fast_leg(slow_fulfilled_amount)
 
-        self.logger.info('[OPENING FAST]')
-        fast_open_order = await self.open_position(
-            self.fast_leg,
-            FAST_LEG_ORDER_FULFILLMENT_TIMEOUT_SECOND,
-            safe_price=True
-        )
-
-        fast_fulfilled_amount = fast_open_order.fulfilled_quantity
+        if fast_open_orders is None:
+            self.logger.info('[OPENING FAST]')
+            fast_open_orders = [await self.open_position(
+                self.fast_leg,
+                FAST_LEG_ORDER_FULFILLMENT_TIMEOUT_SECOND,
+                safe_price=True,
+                execution_type=constants.FAST_LEG_ORDER_EXECUTION_TYPE
+            )]
+
+        fast_fulfilled_amount = sum(
+            order.fulfilled_quantity for order in fast_open_orders)
         assert fast_fulfilled_amount <= slow_fulfilled_amount,\
             f'fast_fulfilled({fast_fulfilled_amount}) > ' \
             f'slow_fulfilled{slow_fulfilled_amount}'
 
-        self.logger.info(f'[FAST STATUS] {fast_open_order}')
+        for fast_open_order in fast_open_orders:
+            self.logger.info(f'[FAST STATUS] {fast_open_order}')
         extra_slow_close_order = None
         if fast_fulfilled_amount < slow_fulfilled_amount:
             extra_slow_close_order = singleton.loop.create_task(
@@ -305,7 +475,11 @@ class ArbitrageTransaction:
             await await_close_extra_slow_position(extra_slow_close_order)
             return False
 
-        self.report.fast_open_order_id = fast_open_order.order_id
+        fast_open_orders = [order for order in fast_open_orders
+                            if order.fulfilled_quantity > 0]
+        self.report.fast_open_order_id = fast_open_orders[0].order_id
+        self.report.fast_open_hedge_order_ids = [
+            order.order_id for order in fast_open_orders[1:]]
         self.report.fast_open_prices.append(self.fast_leg.price)
 
         self.logger.info(
@@ -342,6 +516,51 @@ class ArbitrageTransaction:
         self.report.slow_close_order_id = slow_close_order_status.order_id
         return True
 
+    async def open_slow_leg_with_incremental_hedging(self):
+        """Hedges every slow leg fill on the fast leg as soon as it's seen.
+
+        Returns (slow_open_order, [fast_open_order, ...])
+        """
+        hedges = []
+        hedged_amount = 0
+
+        def hedge(slow_filled_qty):
+            nonlocal hedged_amount
+            amount = slow_filled_qty - hedged_amount
+            if amount <= 0:
+                return
+            hedged_amount = slow_filled_qty
+            self.logger.info('[HEDGING] %d, slow leg filled %d so far',
+                             amount, slow_filled_qty)
+            hedges.append(singleton.loop.create_task(
+                self._hedge_on_fast_leg(amount, time.time())))
+
+        slow_open_order = await self.open_position(
+            self.slow_leg,
+            SLOW_LEG_ORDER_FULFILLMENT_TIMEOUT_SECOND,
+            safe_price=False,
+            execution_type=constants.SLOW_LEG_ORDER_EXECUTION_TYPE,
+            fill_callback=hedge
+        )
+        # Fills only discovered by revoking are hedged here.
+        hedge(slow_open_order.fulfilled_quantity)
+        fast_open_orders = await asyncio.gather(*hedges)
+        return slow_open_order, list(fast_open_orders)
+
+    async def _hedge_on_fast_leg(self, amount, slow_fill_time):
+        fast_open_order = await self.open_position(
+            self.fast_leg._replace(volume=amount),
+            FAST_LEG_ORDER_FULFILLMENT_TIMEOUT_SECOND,
+            safe_price=True,
+            execution_type=constants.FAST_LEG_ORDER_EXECUTION_TYPE
+        )
+        latency = time.time() - slow_fill_time
+        for _ in range(fast_open_order.fulfilled_quantity):
+            hedge_latency_stats.add(latency)
+        self.logger.info('[HEDGE LATENCY] %.3f sec for %d/%d',
+                         latency, fast_open_order.fulfilled_quantity, amount)
+        return fast_open_order
+
     def adjust_fast_leg(self, slow_leg_volume):
         self.fast_leg = ArbitrageLeg(
             instrument_id=self.fast_leg.instrument_id,
@@ -1,7 +1,8 @@
 import logging
 from collections import defaultdict
 
-from .quant import Quant
+from . import singleton
+from .price import Price
 
 
 class BookListener:
@@ -36,11 +37,12 @@ class BookListener:
                                 bids,
                                 instrument_id,
                                 timestamp):
+        tick_size = singleton.schema.tick_size(instrument_id)
         asks = sorted(asks)
         bids = sorted(bids, reverse=True)
-        ask_prices = [Quant(i[0]) for i in asks]
+        ask_prices = [Price.from_real(i[0], tick_size) for i in asks]
         ask_vols = [int(i[1]) for i in asks]
-        bid_prices = [Quant(i[0]) for i in bids]
+        bid_prices = [Price.from_real(i[0], tick_size) for i in bids]
         bid_vols = [int(i[1]) for i in bids]
         for responder in self.subscribers[instrument_id]:
             responder.tick_received(instrument_id,
@@ -9,6 +9,21 @@ SINGLE_UNIT_IN_USD = {
 # Strategy
 MIN_TIME_WINDOW_IN_SECOND = 60 * 1  # 1 minutes
 MIN_ESTIMATE_PROFIT = 1e-5
+# Profit estimation assumes end prices deviate this rate (one standard
+# deviation) from where the arbitrage is opened.
+ESTIMATE_PROFIT_PRICE_STD_RATE = 0.01
+# 'monte_carlo' takes the worst of ESTIMATE_PROFIT_SAMPLES scenarios per side,
+# a worst-of-N bound: more samples make it more pessimistic (and less noisy),
+# it does not converge to an expected profit. 'closed_form' takes the exact
+# worst case within ESTIMATE_PROFIT_CLOSED_FORM_SIGMAS standard deviations,
+# deterministic (3 is about the worst of 1000 samples).
+# MIN_ESTIMATE_PROFIT is tuned for the default 10 samples.
+ESTIMATE_PROFIT_METHOD = 'monte_carlo'
+ESTIMATE_PROFIT_SAMPLES = 10
+ESTIMATE_PROFIT_CLOSED_FORM_SIGMAS = 3.0
+# A pair whose best prices and volumes are unchanged within the same epoch of
+# this many seconds reuses the last strategy decision. 0 disables the memo.
+STRATEGY_MEMO_STATS_EPOCH_SECOND = 1.0
 INSUFFICIENT_MARGIN_COOL_DOWN_SECOND = 60 * 10  # 10 minutes
 AMOUNT_SHRINK = 0.33
 
@@ -27,6 +42,10 @@ SIMPLE_STRATEGY_ZSCORE_THRESHOLD = 1.0
 # Bounds back distance.
 SIMPLE_STRATEGY_RESILIANCE = 0.65
 
+# Where the spread is expected to revert to, 'mean' or 'median' of the window.
+# The median is robust to a few bad ticks.
+SPREAD_CENTER = 'mean'
+
 # Arbitrage
 # According to https://www.okex.com/pages/products/fees.html, for Lv1
 # the fee is either 0.02% or 0.03%. We use 0.03% as estimate.
@@ -39,6 +58,63 @@ FEE_RATE = 0.0003
 SLOW_LEG_ORDER_FULFILLMENT_TIMEOUT_SECOND = 5
 FAST_LEG_ORDER_FULFILLMENT_TIMEOUT_SECOND = 10
 CLOSE_POSITION_ORDER_TIMEOUT_SECOND = 10
+# Keep closing orders at the touch by re-quoting as soon as the market moves,
+# but never more than this rate away from the touch when closing started.
+CHASE_CLOSE_ORDERS = False
+CHASE_MAX_SLIPPAGE_RATE = 0.002
+# A chase gives up after this many orders in a row failed to be placed,
+# backing off from the first to the max interval between them.
+CHASE_MAX_FAILED_ORDERS = 5
+CHASE_RETRY_INTERVAL_SECOND = 0.5
+CHASE_MAX_RETRY_INTERVAL_SECOND = 8
+# Execution latency distributions are kept for this long.
+EXECUTION_LATENCY_STATS_WINDOW_SECOND = 60 * 60  # 1 hour
+# Placement requests carry client_oid so they are safe to retry.
+ORDER_PLACEMENT_MAX_ATTEMPTS = 3
+# Whether a failed placement landed is looked up by client_oid until OKEX
+# answers, backing off from the first to the max interval.
+ORDER_LOOKUP_RETRY_INTERVAL_SECOND = 0.5
+ORDER_LOOKUP_MAX_RETRY_INTERVAL_SECOND = 10
+# The lookup gives up after this long, the order state is then unknown.
+ORDER_LOOKUP_MAX_WAIT_SECOND = 30
+# Database updates are committed in batches of at most this many writes or
+# this long after the first pending write.
+DB_FLUSH_INTERVAL_SECOND = 0.5
+DB_MAX_BATCH_SIZE = 500
+# Also keep every order update in the append-only runtime_order_history.
+DB_KEEP_ORDER_HISTORY = False
+# Directory of the columnar tick store (see tick_store.py), None to disable.
+TICK_STORE_DIR = None
+# Also record the full depth5 instead of only the best bid/ask.
+TICK_STORE_DEPTH = False
+TICK_STORE_FLUSH_INTERVAL_SECOND = 1.0
+# Directory of the event journal (see journal.py), None to disable.
+JOURNAL_DIR = None
+JOURNAL_FLUSH_INTERVAL_SECOND = 1.0
+# Number of ended orders whose last websocket update is kept for reports.
+ORDER_INFO_CACHE_SIZE = 1000
+# Per transaction log files, see logger.TransactionLogWriter.
+TRANSACTION_LOG_QUEUE_SIZE = 100000
+TRANSACTION_LOG_MAX_OPEN_FILES = 64
+TRANSACTION_LOG_COMPRESS = False
+# Slack Web API root, the tests point it at a local server.
+SLACK_API_URL = 'https://slack.com/api/'
+# Messages within this window are posted together.
+SLACK_BATCH_WINDOW_SECOND = 2.0
+# Slack allows about one post per second per channel.
+SLACK_MIN_POST_INTERVAL_SECOND = 1.0
+SLACK_MAX_POST_CHARS = 4000
+SLACK_QUEUE_SIZE = 1000
+SLACK_REQUEST_TIMEOUT_SECOND = 10
+# Log streaming of the webserver, see log_stream.py.
+LOG_STREAM_POLL_INTERVAL_SECOND = 0.2
+# Recent lines sent to clients when they subscribe.
+LOG_STREAM_BACKLOG_LINES = 5000
+# Lines a slow client may fall behind before the oldest are dropped.
+LOG_STREAM_CLIENT_BUFFER_LINES = 2000
+LOG_STREAM_MAX_READ_BYTES = 1 << 20
+# A batch not acked by then is taken as lost and the next one is sent.
+LOG_STREAM_ACK_TIMEOUT_SECOND = 30
 
 CLOSE_THRESHOLDS = {
     ('this_week', 'next_week'): 0.1,
@@ -56,6 +132,9 @@ SHORT = 'SHORT'
 # API code
 REST_API_ERROR_CODE__MARGIN_NOT_ENOUGH = 32016
 REST_API_ERROR_CODE__PENDING_ORDER_NOT_EXIST = 32004
+# Not an OKEX code: the placement request failed and whether the order
+# exists couldn't be looked up, it is resolved by client_oid later.
+REST_API_ERROR_CODE__ORDER_STATE_UNKNOWN = -2
 REST_API_ERROR_CODE__NOT_ENOUGH_POSITION_TO_CLOSE = 32014
 
 # 订单状态(-1.撤单成功；0:等待成交 1:部分成交 2:全部成交
@@ -70,3 +149,16 @@ ORDER_TYPE_CODE__OPEN_LONG = 1
 ORDER_TYPE_CODE__OPEN_SHORT = 2
 ORDER_TYPE_CODE__CLOSE_LONG = 3
 ORDER_TYPE_CODE__CLOSE_SHORT = 4
+
+# 下单方式(0:普通委托 1:只做Maker 2:全部成交或立即取消 3:立即成交并取消剩余)
+ORDER_EXECUTION_TYPE__NORMAL = 0
+ORDER_EXECUTION_TYPE__POST_ONLY = 1
+ORDER_EXECUTION_TYPE__FOK = 2
+ORDER_EXECUTION_TYPE__IOC = 3
+
+# FOK/IOC are resolved by the exchange right away, no timeout-revoke cycle.
+SLOW_LEG_ORDER_EXECUTION_TYPE = ORDER_EXECUTION_TYPE__NORMAL
+FAST_LEG_ORDER_EXECUTION_TYPE = ORDER_EXECUTION_TYPE__NORMAL
+# Hedge each slow leg partial fill on the fast leg right away instead of
+# waiting for the slow leg order to be resolved.
+INCREMENTAL_FAST_LEG_HEDGING = False
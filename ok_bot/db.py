@@ -1,12 +1,18 @@
 # TODO: convert _testing to unittest
 
+import atexit
 import logging
+import queue
 import sqlite3
+import threading
 import time
-from concurrent.futures import ProcessPoolExecutor
+import weakref
 from functools import partial
 
+from . import constants, logger
+from .price import Price
 from .quant import Quant
+from .stats import Stats
 
 DEV_DB = 'dev.db'
 PROD_DB = 'prod.db'
@@ -15,81 +21,114 @@ PROD_DB = 'prod.db'
 def _sql_type_safe_filter(kwargs):
     ret = {}
     for k, v in kwargs.items():
-        if isinstance(v, Quant):
+        if isinstance(v, (Quant, Price)):
             ret[k] = str(v)
         else:
             ret[k] = v
     return ret
 
 
-def _update_transaction(cursor_creator, **kwargs):
+# Columns of tables that may predate them, with their types.
+_TRANSACTION_COLUMNS_ADDED_LATER = (
+    ('slow_instrument_id', 'TEXT'),
+    ('fast_instrument_id', 'TEXT'),
+    ('strategy', 'TEXT'),
+)
+
+
+def _add_missing_columns(cursor, table, columns):
+    existing = {row[1]
+                for row in cursor.execute(f'PRAGMA table_info({table})')}
+    for name, type in columns:
+        if name not in existing:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {name} {type}')
+
+
+def _update_transaction(cursor, **kwargs):
     kwargs = _sql_type_safe_filter(kwargs)
     try:
-        with cursor_creator() as c:
-            c.execute('''
-                INSERT OR REPLACE INTO runtime_transactions(
-                    transaction_id,
-                    vol,
-                    slow_price,
-                    fast_price,
-                    close_price_gap,
-                    start_time_sec,
-                    end_time_sec,
-                    estimate_net_profit,
-                    status
-                )
-                VALUES (
-                    :transaction_id,
-                    :vol,
-                    :slow_price,
-                    :fast_price,
-                    :close_price_gap,
-                    :start_time_sec,
-                    :end_time_sec,
-                    :estimate_net_profit,
-                    :status
-                );
-            ''', kwargs)
-    except sqlite3.OperationalError:
+        cursor.execute('''
+            INSERT OR REPLACE INTO runtime_transactions(
+                transaction_id,
+                vol,
+                slow_price,
+                fast_price,
+                close_price_gap,
+                start_time_sec,
+                end_time_sec,
+                estimate_net_profit,
+                status,
+                slow_instrument_id,
+                fast_instrument_id,
+                strategy
+            )
+            VALUES (
+                :transaction_id,
+                :vol,
+                :slow_price,
+                :fast_price,
+                :close_price_gap,
+                :start_time_sec,
+                :end_time_sec,
+                :estimate_net_profit,
+                :status,
+                :slow_instrument_id,
+                :fast_instrument_id,
+                :strategy
+            );
+        ''', kwargs)
+    except sqlite3.Error:
         logging.error('exception in _update_transaction', exc_info=True)
 
 
-def _update_order(cursor_creator, **kwargs):
-    kwargs = _sql_type_safe_filter(kwargs)
+_ORDER_COLUMNS = ('order_id', 'transaction_id', 'comment', 'status', 'size',
+                  'filled_qty', 'price', 'price_avg', 'fee', 'type',
+                  'timestamp')
+
+# Updates only overwrite the fields they know, so that e.g. a fill without
+# price does not erase the price of the request.
+_UPSERT_ORDER_SQL = \
+    'INSERT INTO runtime_orders({}) VALUES ({}) ' \
+    'ON CONFLICT(order_id) DO UPDATE SET {}, ' \
+    "last_update_time=DATETIME('now','localtime');".format(
+        ', '.join(_ORDER_COLUMNS),
+        ', '.join(f':{c}' for c in _ORDER_COLUMNS),
+        ', '.join(f'{c}=COALESCE(excluded.{c}, {c})'
+                  for c in _ORDER_COLUMNS[1:]))
+
+_APPEND_ORDER_HISTORY_SQL = \
+    'INSERT INTO runtime_order_history({}) VALUES ({});'.format(
+        ', '.join(_ORDER_COLUMNS),
+        ', '.join(f':{c}' for c in _ORDER_COLUMNS))
+
+
+def _order_row(kwargs):
+    row = dict.fromkeys(_ORDER_COLUMNS)
+    row.update(_sql_type_safe_filter(kwargs))
+    return row
+
+
+def _merge_update(pending, update):
+    """Newer non-null fields win, the rest are kept from pending."""
+    merged = dict(pending)
+    merged.update((k, v) for k, v in update.items() if v is not None)
+    return merged
+
+
+def _update_order(cursor, **kwargs):
     try:
-        with cursor_creator() as c:
-            c.execute('''
-                INSERT OR REPLACE INTO runtime_orders(
-                    order_id,
-                    transaction_id,
-                    comment,
-                    status,
-                    size,
-                    filled_qty,
-                    price,
-                    price_avg,
-                    fee,
-                    type,
-                    timestamp
-                )
-                VALUES (
-                    :order_id,
-                    :transaction_id,
-                    :comment,
-                    :status,
-                    :size,
-                    :filled_qty,
-                    :price,
-                    :price_avg,
-                    :fee,
-                    :type,
-                    :timestamp
-                );
-            ''', kwargs)
-    except sqlite3.OperationalError:
+        cursor.execute(_UPSERT_ORDER_SQL, _order_row(kwargs))
+    except sqlite3.Error:
         logging.error('exception in _update_order', exc_info=True)
 
 
+def _append_order_history(cursor, **kwargs):
+    try:
+        cursor.execute(_APPEND_ORDER_HISTORY_SQL, _order_row(kwargs))
+    except sqlite3.Error:
+        logging.error('exception in _append_order_history', exc_info=True)
+
+
 class _DbCursor:
     def __init__(self, db_path):
         self._db_path = db_path
@@ -104,11 +143,187 @@ class _DbCursor:
         self.conn.close()
 
 
+class _DbWriter:
+    """Applies queued writes on one WAL connection, a transaction per batch.
+
+    A batch is committed once constants.DB_FLUSH_INTERVAL_SECOND has passed
+    since its first write or it reaches constants.DB_MAX_BATCH_SIZE writes,
+    so a burst of updates costs a single fsync. Writes submitted with the
+    same coalesce_key within a batch are merged and executed once.
+    """
+    _FLUSH = object()
+    _SHUTDOWN = object()
+
+    def __init__(self, db_path):
+        self._db_path = db_path
+        self._queue = queue.Queue()
+        self.commit_latency_stats = Stats(
+            constants.EXECUTION_LATENCY_STATS_WINDOW_SECOND)
+        self.batch_size_stats = Stats(
+            constants.EXECUTION_LATENCY_STATS_WINDOW_SECOND)
+        self.num_submitted = 0
+        self.num_writes = 0
+        # Writes submitted by callers, num_submitted once applied.
+        self._num_queued = 0
+        self.num_commits = 0
+        # Switched to WAL before the thread starts so that it never races
+        # with the DDL connections for the lock the switch takes.
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL;')
+        # Safe with WAL, the last commits may only roll back on power loss.
+        self._conn.execute('PRAGMA synchronous=NORMAL;')
+        self._thread = threading.Thread(target=self._run,
+                                        name=f'db-writer-{db_path}',
+                                        daemon=True)
+        self._thread.start()
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def __str__(self):
+        return (f'queue depth: {self.queue_depth}, '
+                f'submitted: {self.num_submitted}, '
+                f'writes: {self.num_writes}, commits: {self.num_commits}, '
+                f'batch size: {self.batch_size_stats}, '
+                f'commit latency: {self.commit_latency_stats}')
+
+    def submit(self, fn, kwargs, coalesce_key=None):
+        """Queues fn(cursor, **kwargs).
+
+        A pending write with the same coalesce_key absorbs this one, see
+        _merge_update, fn of the last one is executed.
+        """
+        self._num_queued += 1
+        self._queue.put((fn, kwargs, coalesce_key))
+
+    def flush(self, timeout=None):
+        """Blocks until everything submitted before is committed."""
+        done = threading.Event()
+        self._queue.put((self._FLUSH, done, None))
+        return done.wait(timeout)
+
+    def shutdown(self, wait=True, timeout=5):
+        """Commits what is queued, gives up after timeout seconds if the
+        writes don't drain.
+
+        :return: False if the writer is still running
+        """
+        if self._thread.is_alive():
+            self._queue.put((self._SHUTDOWN, None, None))
+        if not wait:
+            return True
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logging.error('[db writer] not done after %s seconds, '
+                          '%d writes dropped',
+                          timeout, self._num_queued - self.num_submitted)
+            return False
+        _writers.discard(self)
+        return True
+
+    def _apply(self, conn, cursor, batch):
+        """Executes and commits the writes of one batch.
+
+        A coalesced write runs where the last write it absorbed was
+        submitted, so writes to each table keep their submit order.
+        """
+        writes = []  # [fn, kwargs] or None for writes absorbed later
+        coalesced = {}  # coalesce_key -> index in writes
+        num_submitted = 0
+        for fn, arg, key in batch:
+            if fn in (self._FLUSH, self._SHUTDOWN):
+                continue
+            num_submitted += 1
+            if key in coalesced:
+                index = coalesced[key]
+                try:
+                    arg = _merge_update(writes[index][1], arg)
+                except Exception:
+                    logging.error('exception merging db writes',
+                                  exc_info=True)
+                    continue
+                writes[index] = None
+            if key is not None:
+                coalesced[key] = len(writes)
+            writes.append([fn, arg])
+
+        num_writes = 0
+        for write in writes:
+            if write is None:
+                continue
+            fn, arg = write
+            try:
+                fn(cursor, **arg)
+            except Exception:
+                # Write functions handle sqlite3.Error themselves, anything
+                # else (e.g. a value of an unexpected type) must not stop
+                # the writer.
+                logging.error('exception in db write %s', fn.__name__,
+                              exc_info=True)
+            num_writes += 1
+        if num_writes:
+            start = time.time()
+            try:
+                conn.commit()
+            except sqlite3.Error:
+                logging.error('exception committing %d db writes',
+                              num_writes, exc_info=True)
+            self.commit_latency_stats.add(time.time() - start)
+            self.batch_size_stats.add(num_writes)
+            self.num_writes += num_writes
+            self.num_commits += 1
+            logging.log_every_n_seconds(logging.INFO, '[db writer] %s',
+                                        60 * 10, self)
+        self.num_submitted += num_submitted
+
+    def _run(self):
+        conn = self._conn
+        cursor = conn.cursor()
+        running = True
+        while running:
+            batch = [self._queue.get()]
+            deadline = time.time() + constants.DB_FLUSH_INTERVAL_SECOND
+            while batch[-1][0] not in (self._FLUSH, self._SHUTDOWN) and \
+                    len(batch) < constants.DB_MAX_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get(
+                        timeout=max(0.0, deadline - time.time())))
+                except queue.Empty:
+                    break
+
+            running = all(fn is not self._SHUTDOWN for fn, _, _ in batch)
+            try:
+                self._apply(conn, cursor, batch)
+            except Exception:
+                logging.error('exception in db writer', exc_info=True)
+            finally:
+                for fn, arg, _ in batch:
+                    if fn is self._FLUSH:
+                        arg.set()
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE);')
+        conn.close()
+
+
+# Writers still running, shut down at exit. One atexit hook for all of them,
+# each writer is dropped once it has shut down.
+_writers = weakref.WeakSet()
+
+
+def _shutdown_writers():
+    for writer in list(_writers):
+        writer.shutdown()
+
+
+atexit.register(_shutdown_writers)
+
+
 class _BaseDb:
     def __init__(self, db_path=PROD_DB):
         self._db_path = db_path
-        self._executor = ProcessPoolExecutor(max_workers=1)
+        self._writer = _DbWriter(self._db_path)
         self._cursor_creator = partial(_DbCursor, self._db_path)
+        _writers.add(self._writer)
 
     def create_tables_if_not_exist(self):
         try:
@@ -124,9 +339,14 @@ class _BaseDb:
                     end_time_sec        NUMERIC,
                     estimate_net_profit NUMERIC,
                     status              TEXT,
-                    last_update_time    TEXT DEFAULT (DATETIME('now','localtime'))
+                    last_update_time    TEXT DEFAULT (DATETIME('now','localtime')),
+                    slow_instrument_id  TEXT,
+                    fast_instrument_id  TEXT,
+                    strategy            TEXT
                 );
                 ''')
+                _add_missing_columns(c, 'runtime_transactions',
+                                     _TRANSACTION_COLUMNS_ADDED_LATER)
                 c.execute('''
                 CREATE TABLE IF NOT EXISTS runtime_orders (
                     order_id            INTEGER PRIMARY KEY,
@@ -143,25 +363,55 @@ class _BaseDb:
                     last_update_time    TEXT DEFAULT (DATETIME('now','localtime'))
                 );
                 ''')
+                c.execute('''
+                CREATE TABLE IF NOT EXISTS runtime_order_history (
+                    order_id            INTEGER,
+                    transaction_id      TEXT,
+                    comment             TEXT,
+                    status              INTEGER,
+                    size                INTEGER,
+                    filled_qty          INTEGER,
+                    price               NUMERIC,
+                    price_avg           NUMERIC,
+                    fee                 NUMERIC,
+                    type                INTEGER,
+                    timestamp           TEXT,
+                    insert_time         TEXT DEFAULT (DATETIME('now','localtime'))
+                );
+                ''')
         except sqlite3.OperationalError:
             logging.error('exception in _update_order', exc_info=True)
 
     def async_update_transaction(self, **kwargs):
         """Force to use kwargs explicitly."""
-        self._executor.submit(
-            _update_transaction,
-            self._cursor_creator,
-            **kwargs)
+        self._writer.submit(_update_transaction, kwargs)
 
     def async_update_order(self, **kwargs):
-        """Force to use kwargs explicitly."""
-        self._executor.submit(
-            _update_order,
-            self._cursor_creator,
-            **kwargs)
+        """Force to use kwargs explicitly.
+
+        Updates of one order within a flush window are merged into a single
+        row write. Every update is also appended to runtime_order_history
+        if constants.DB_KEEP_ORDER_HISTORY.
+        """
+        if constants.DB_KEEP_ORDER_HISTORY:
+            self._writer.submit(_append_order_history, kwargs)
+        self._writer.submit(_update_order, kwargs,
+                            coalesce_key=('runtime_orders',
+                                          str(kwargs.get('order_id'))))
+
+    @property
+    def writer(self):
+        """Queue depth, commit latency etc. of the background writer."""
+        return self._writer
+
+    def flush(self, timeout=None):
+        """Blocks until all updates so far are committed."""
+        return self._writer.flush(timeout)
 
-    def shutdown(self, wait=True):
-        return self._executor.shutdown(wait=True)
+    def shutdown(self, wait=True, timeout=5):
+        """Commits all pending updates and stops the writer, see
+        _DbWriter.shutdown."""
+        return self._writer.shutdown(wait=wait, timeout=timeout)
 
 
 class ProdDb(_BaseDb):
@@ -181,6 +431,7 @@ class DevDb(_BaseDb):
         with self._cursor_creator() as c:
             c.execute('DROP TABLE IF EXISTS runtime_transactions;')
             c.execute('DROP TABLE IF EXISTS runtime_orders;')
+            c.execute('DROP TABLE IF EXISTS runtime_order_history;')
         self.create_tables_if_not_exist()
 
 
@@ -194,7 +445,10 @@ def _testing():
                                 start_time_sec=time.time(),
                                 end_time_sec=None,
                                 estimate_net_profit=None,
-                                status='ended')
+                                status='ended',
+                                slow_instrument_id='ETH-USD-190329',
+                                fast_instrument_id='ETH-USD-190301',
+                                strategy='PercentageTriggerStrategy')
     db.async_update_order(order_id='2217655012660224',
                           transaction_id=None,
                           comment='comment',
@@ -206,7 +460,8 @@ def _testing():
                           fee=0.01,
                           type=None,
                           timestamp=None)
-    db._executor.shutdown(wait=True)
+    db.shutdown(wait=True)
+    logging.info('%s', db.writer)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,301 @@
+"""Structured journal of what the bot saw, decided and did.
+
+Every event is a fixed-width binary record of a numpy structured dtype,
+appended to <root>/<YYYY-MM-DD>/<event>.bin where the day is the UTC day of
+the wall clock time. All records start with the wall clock time, a
+monotonic time (only comparable within one run) and the transaction id,
+empty before a transaction exists.
+
+python -m ok_bot.journal --root journal --transaction <id>
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+
+from . import constants, singleton
+from .appender import DailyAppender, utc_day
+
+_ID = 'S36'  # uuid4 strings
+_INSTRUMENT = 'S24'
+_COMMON = [
+    ('timestamp', '<f8'),
+    ('monotonic', '<f8'),
+    ('transaction_id', _ID),
+]
+
+EVENTS = {
+    # Best levels of a depth5 tick.
+    'tick': _COMMON + [
+        ('instrument_id', _INSTRUMENT),
+        ('timestamp_server', '<f8'),
+        ('best_ask_price', '<f8'),
+        ('best_ask_vol', '<i8'),
+        ('best_bid_price', '<f8'),
+        ('best_bid_vol', '<i8'),
+    ],
+    # Strategy inputs of one pair and whether it made a plan.
+    'evaluation': _COMMON + [
+        ('long_instrument_id', _INSTRUMENT),
+        ('short_instrument_id', _INSTRUMENT),
+        ('long_ask_price', '<f8'),
+        ('short_bid_price', '<f8'),
+        ('current_spread', '<f8'),
+        ('historical_mean_spread', '<f8'),
+        ('median_spread', '<f8'),
+        ('zscore', '<f8'),
+        ('triggered', '?'),
+    ],
+    # An ArbitragePlan that kicked off a transaction.
+    'plan': _COMMON + [
+        ('strategy', 'S32'),
+        ('slow_instrument_id', _INSTRUMENT),
+        ('fast_instrument_id', _INSTRUMENT),
+        ('slow_side', 'S5'),
+        ('fast_side', 'S5'),
+        ('volume', '<i8'),
+        ('slow_price', '<f8'),
+        ('fast_price', '<f8'),
+        ('close_price_gap', '<f8'),
+        ('estimate_net_profit', '<f8'),
+        ('z_score', '<f8'),
+    ],
+    'order_sent': _COMMON + [
+        ('instrument_id', _INSTRUMENT),
+        ('client_oid', 'S32'),
+        ('type', 'i1'),
+        ('execution_type', 'i1'),
+        ('size', '<i8'),
+        ('price', '<f8'),
+    ],
+    # REST response of an order_sent, order_id -1 when it was rejected.
+    'order_ack': _COMMON + [
+        ('instrument_id', _INSTRUMENT),
+        ('client_oid', 'S32'),
+        ('order_id', '<i8'),
+        ('error_code', '<i8'),
+        ('latency_sec', '<f8'),
+    ],
+    # Websocket order updates with a fill or a final status.
+    'order_fill': _COMMON + [
+        ('order_id', '<i8'),
+        ('status', 'i1'),
+        ('filled_qty', '<i8'),
+        ('price_avg', '<f8'),
+        ('fee', '<f8'),
+    ],
+    # Timed out order revoked, filled_qty as confirmed by the REST API.
+    'order_revoke': _COMMON + [
+        ('instrument_id', _INSTRUMENT),
+        ('order_id', '<i8'),
+        ('filled_qty', '<i8'),
+    ],
+}
+DTYPES = {event: np.dtype(fields) for event, fields in EVENTS.items()}
+_FILL_VALUES = {'f': np.nan, 'i': -1, 'b': False, 'S': b''}
+
+
+def _server_time(timestamp):
+    """'2019-03-01T12:14:50.085Z' to seconds since epoch."""
+    return np.datetime64(timestamp.rstrip('Z'), 'ms').astype('int64') / 1e3
+
+
+# Values converted by the writer thread rather than the caller.
+_CONVERTERS = {'timestamp_server': _server_time}
+
+
+def _file_name(event):
+    return f'{event}.bin'
+
+
+def _path(root, day, event):
+    return os.path.join(root, day, _file_name(event))
+
+
+def _fill_values(dtype):
+    return [_FILL_VALUES[dtype[name].kind] for name in dtype.names]
+
+
+class Journal(DailyAppender):
+    """Appends events from a background thread.
+
+    record() and record_many() only enqueue, records are converted and
+    written in batches at most every constants.JOURNAL_FLUSH_INTERVAL_SECOND.
+    It is also a book listener responder recording tick events.
+    """
+
+    def __init__(self, root):
+        super().__init__(root, 'journal')
+
+    @property
+    def num_events(self):
+        return self.num_records
+
+    def record(self, event, transaction_id=None, **fields):
+        """Fields missing or None are NaN, -1, False or empty."""
+        self._put((event, time.time(), time.monotonic(), transaction_id,
+                   fields))
+
+    def record_many(self, event, columns, transaction_id=None):
+        """Several events at once from a dict of equally long columns."""
+        self._put((event, time.time(), time.monotonic(), transaction_id,
+                   columns, True))
+
+    def tick_received(self,
+                      instrument_id,
+                      ask_prices,
+                      ask_vols,
+                      bid_prices,
+                      bid_vols,
+                      timestamp):
+        self.record('tick',
+                    instrument_id=instrument_id,
+                    timestamp_server=timestamp,
+                    best_ask_price=ask_prices[0] if ask_prices else None,
+                    best_ask_vol=ask_vols[0] if ask_vols else None,
+                    best_bid_price=bid_prices[0] if bid_prices else None,
+                    best_bid_vol=bid_vols[0] if bid_vols else None)
+
+    def _flush_interval(self):
+        return constants.JOURNAL_FLUSH_INTERVAL_SECOND
+
+    def _partition(self, events):
+        partitions = {}
+        for item in events:
+            partitions.setdefault((utc_day(item[1]), item[0]),
+                                  []).append(item)
+        return partitions
+
+    def _encode(self, partition, items):
+        _, event = partition
+        records = self._to_records(event, items)
+        return len(records), [(_file_name(event), records.tobytes())]
+
+    @staticmethod
+    def _to_records(event, items):
+        dtype = DTYPES[event]
+        names = dtype.names
+        fill_values = _fill_values(dtype)
+        rows = []
+        parts = []
+        for item in items:
+            timestamp, monotonic, transaction_id, fields = item[1:5]
+            if len(item) == 6:
+                # record_many() columns.
+                num = len(next(iter(fields.values())))
+                part = np.zeros(num, dtype=dtype)
+                for name, fill in zip(names, fill_values):
+                    part[name] = fill
+                part['timestamp'] = timestamp
+                part['monotonic'] = monotonic
+                part['transaction_id'] = transaction_id or b''
+                for name, values in fields.items():
+                    part[name] = values
+                parts.append(part)
+                continue
+            fields['timestamp'] = timestamp
+            fields['monotonic'] = monotonic
+            fields['transaction_id'] = transaction_id
+            row = []
+            for name, fill in zip(names, fill_values):
+                value = fields.get(name)
+                if value is None:
+                    value = fill
+                elif name in _CONVERTERS:
+                    value = _CONVERTERS[name](value)
+                row.append(value)
+            rows.append(tuple(row))
+        if rows:
+            parts.append(np.array(rows, dtype=dtype))
+        return np.concatenate(parts) if len(parts) > 1 else parts[0]
+
+
+def record(event, transaction_id=None, **fields):
+    """Journal.record() on the singleton, nothing if there is no journal."""
+    if singleton.journal is not None:
+        singleton.journal.record(event, transaction_id, **fields)
+
+
+def read_events(root, event, start_sec, end_sec):
+    """Records of event with a timestamp within [start_sec, end_sec), as a
+    structured numpy array in the order they were recorded."""
+    dtype = DTYPES[event]
+    parts = []
+    day_start = start_sec - start_sec % (24 * 60 * 60)
+    while day_start < end_sec:
+        path = _path(root, utc_day(day_start), event)
+        day_start += 24 * 60 * 60
+        if not os.path.exists(path):
+            continue
+        # A crash may leave the last record partially written.
+        num = os.path.getsize(path) // dtype.itemsize
+        if num == 0:
+            continue
+        records = np.memmap(path, dtype=dtype, mode='r', shape=(num,))
+        timestamps = records['timestamp']
+        parts.append(np.array(
+            records[(timestamps >= start_sec) & (timestamps < end_sec)]))
+    if not parts:
+        return np.empty(0, dtype=dtype)
+    return np.concatenate(parts)
+
+
+def to_frame(records):
+    """pandas.DataFrame of read_events() records, strings decoded."""
+    import pandas as pd
+    frame = pd.DataFrame({name: records[name]
+                          for name in records.dtype.names})
+    for name in records.dtype.names:
+        if records.dtype[name].kind == 'S':
+            frame[name] = frame[name].str.decode('ascii')
+    return frame
+
+
+def read_transaction(root, transaction_id, start_sec, end_sec):
+    """Every event of one transaction in order, as one pandas.DataFrame
+    with an 'event' column and the union of the event columns."""
+    import pandas as pd
+    frames = []
+    transaction_id = transaction_id.encode('ascii')
+    for event in EVENTS:
+        records = read_events(root, event, start_sec, end_sec)
+        records = records[records['transaction_id'] == transaction_id]
+        if len(records):
+            frame = to_frame(records)
+            frame.insert(0, 'event', event)
+            frames.append(frame)
+    if not frames:
+        return pd.DataFrame(columns=['event'] + [name for name, _ in _COMMON])
+    return pd.concat(frames, ignore_index=True, sort=False).sort_values(
+        'monotonic', kind='mergesort').reset_index(drop=True)
+
+
+def main():
+    args = argparse.ArgumentParser(description='Print a journal')
+    args.add_argument('--root', default='journal', help='Journal directory')
+    args.add_argument('--start', type=float, default=None,
+                      help='Start time in seconds since epoch, '
+                           'default a day before the end')
+    args.add_argument('--end', type=float, default=None,
+                      help='End time in seconds since epoch, default now')
+    group = args.add_mutually_exclusive_group(required=True)
+    group.add_argument('--transaction', help='All events of a transaction')
+    group.add_argument('--event', choices=list(EVENTS))
+    args = args.parse_args()
+
+    import pandas as pd
+    end = time.time() + 1 if args.end is None else args.end
+    start = end - 24 * 60 * 60 if args.start is None else args.start
+    if args.transaction:
+        frame = read_transaction(args.root, args.transaction, start, end)
+    else:
+        frame = to_frame(read_events(args.root, args.event, start, end))
+    with pd.option_context('display.max_rows', None,
+                           'display.max_columns', None,
+                           'display.width', 200):
+        print(frame.to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
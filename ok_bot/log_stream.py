@@ -0,0 +1,217 @@
+"""Streams a log file to many slow readers without blocking the writer.
+
+LogFollower reads new lines of a file like `tail -F`, LogStream batches them
+and fans them out to per-client bounded buffers (oldest lines are dropped
+for clients that can't keep up), with a ring buffer of recent lines for
+clients that just connected.
+"""
+import asyncio
+import collections
+import logging
+import os
+import re
+
+from . import constants
+
+LEVELS = {
+    'DEBUG': logging.DEBUG,
+    'INFO': logging.INFO,
+    'WARNING': logging.WARNING,
+    'ERROR': logging.ERROR,
+    'CRITICAL': logging.CRITICAL,
+}
+
+# First line of a record formatted by logger._RootFormatter.
+_HEADER = re.compile(
+    r'(DEBUG|INFO|WARNING|ERROR|CRITICAL) +\S+ \S+ \S+: *\d+\] '
+    r'(?:([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}) )?')
+
+# A line with the level and transaction id of the record it belongs to.
+LogLine = collections.namedtuple('LogLine',
+                                 ['text', 'level', 'transaction_id'])
+
+
+class LogFollower:
+    """New complete lines of a file, following rotation and truncation.
+
+    The file is reopened when the path points to a new file or when it
+    shrinks. Lines are decoded as UTF-8, invalid bytes are replaced.
+    """
+
+    def __init__(self, path, from_start=False):
+        self.path = path
+        self._file = None
+        self._inode = None
+        self._partial = b''
+        self._open(seek_end=not from_start)
+
+    def _open(self, seek_end):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._partial = b''
+        try:
+            self._file = open(self.path, 'rb')
+        except FileNotFoundError:
+            return
+        self._inode = os.fstat(self._file.fileno()).st_ino
+        if seek_end:
+            self._file.seek(0, os.SEEK_END)
+
+    def _rotated(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        return (stat.st_ino != self._inode or
+                stat.st_size < self._file.tell())
+
+    def read(self, max_bytes=None):
+        """Lines completed since the last call, at most about max_bytes."""
+        max_bytes = max_bytes or constants.LOG_STREAM_MAX_READ_BYTES
+        if self._file is None:
+            self._open(seek_end=False)
+            if self._file is None:
+                return []
+        data = self._file.read(max_bytes)
+        if not data and self._rotated():
+            # Whatever was left in the old file has been read above.
+            self._open(seek_end=False)
+            data = self._file.read(max_bytes) if self._file else b''
+        if not data:
+            return []
+        lines = (self._partial + data).split(b'\n')
+        self._partial = lines.pop()
+        return [line.decode('utf-8', errors='replace').rstrip('\r')
+                for line in lines]
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class LogParser:
+    """Tags lines with the level and transaction id of their record,
+    continuation lines of multi-line records included."""
+
+    def __init__(self):
+        self._level = logging.INFO
+        self._transaction_id = None
+
+    def parse(self, lines):
+        result = []
+        for line in lines:
+            match = _HEADER.match(line)
+            if match is not None:
+                self._level = LEVELS[match.group(1)]
+                self._transaction_id = match.group(2)
+            result.append(LogLine(line, self._level, self._transaction_id))
+        return result
+
+
+class LogClient:
+    """What one reader wants and the lines it hasn't been sent yet."""
+
+    def __init__(self, level=logging.DEBUG, transaction_id=None):
+        self.level = level
+        self.transaction_id = transaction_id or None
+        self.buffer = collections.deque(
+            maxlen=constants.LOG_STREAM_CLIENT_BUFFER_LINES)
+        self.dropped = 0
+        self.has_lines = asyncio.Event()
+        self.task = None
+
+    def wants(self, line):
+        if line.level < self.level:
+            return False
+        if self.transaction_id is None:
+            return True
+        return (line.transaction_id is not None and
+                line.transaction_id.startswith(self.transaction_id))
+
+    def add(self, lines):
+        lines = [line.text for line in lines if self.wants(line)]
+        if not lines:
+            return
+        overflow = len(self.buffer) + len(lines) - self.buffer.maxlen
+        if overflow > 0:
+            self.dropped += overflow
+        self.buffer.extend(lines)
+        self.has_lines.set()
+
+    def take(self):
+        """Buffered lines and the number dropped since the last take()."""
+        lines = list(self.buffer)
+        self.buffer.clear()
+        self.has_lines.clear()
+        dropped, self.dropped = self.dropped, 0
+        return lines, dropped
+
+
+class LogStream:
+    """Follows path and sends batches of lines to every subscriber.
+
+    send(client_id, {'lines': [...], 'dropped': n}) is awaited by one task
+    per client and must only return once the client has taken the batch
+    (e.g. acked it), so that at most one batch per client is in flight and
+    a slow client only fills (and overflows) its own buffer.
+    """
+
+    def __init__(self, path, send, from_start=False):
+        self.follower = LogFollower(path, from_start=from_start)
+        self.parser = LogParser()
+        self.backlog = collections.deque(
+            maxlen=constants.LOG_STREAM_BACKLOG_LINES)
+        self.clients = {}
+        self._send = send
+
+    def subscribe(self, client_id, level=logging.DEBUG, transaction_id=None):
+        """(Re)subscribes a client, returns the matching backlog lines."""
+        self.unsubscribe(client_id)
+        client = LogClient(level, transaction_id)
+        client.task = asyncio.ensure_future(self._send_loop(client_id,
+                                                            client))
+        self.clients[client_id] = client
+        return [line.text for line in self.backlog if client.wants(line)]
+
+    def unsubscribe(self, client_id):
+        client = self.clients.pop(client_id, None)
+        if client is not None:
+            client.task.cancel()
+
+    async def poll(self):
+        """Reads and dispatches new lines, returns how many."""
+        # File reads may block, keep them off the event loop.
+        lines = await asyncio.get_event_loop().run_in_executor(
+            None, self.follower.read)
+        lines = self.parser.parse(lines)
+        if lines:
+            self.backlog.extend(lines)
+            for client in self.clients.values():
+                client.add(lines)
+        return len(lines)
+
+    async def run(self, interval=None):
+        interval = interval or constants.LOG_STREAM_POLL_INTERVAL_SECOND
+        try:
+            while True:
+                await self.poll()
+                await asyncio.sleep(interval)
+        finally:
+            for client_id in list(self.clients):
+                self.unsubscribe(client_id)
+            self.follower.close()
+
+    async def _send_loop(self, client_id, client):
+        while True:
+            await client.has_lines.wait()
+            lines, dropped = client.take()
+            try:
+                await self._send(client_id,
+                                 {'lines': lines, 'dropped': dropped})
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.warning('failed to send log lines to %s', client_id,
+                                exc_info=True)
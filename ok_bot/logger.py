@@ -1,12 +1,20 @@
+import atexit
 import getpass
+import gzip
 import importlib
 import logging
 import os
+import queue
+import shutil
 import socket
+import sys
+import threading
 import time
 import timeit
+from collections import OrderedDict
+from logging.handlers import QueueHandler, QueueListener
 
-from . import slack
+from . import constants, slack
 
 LOG_FORMAT = '%(levelname)-7s %(asctime)s %(filename)s:%(lineno)4d] %(message)s'
 _logging_transaction_to_slack = False
@@ -43,10 +51,18 @@ def _seconds_have_elapsed(token, num_seconds):
         return False
 
 
-def log_every_n_seconds(level, msg, n_seconds, *args):
-    should_log = _seconds_have_elapsed(
-        logging.getLogger().findCaller(), n_seconds)
-    if should_log:
+def log_every_n_seconds(level, msg, n_seconds, *args, token=None):
+    """Logs at most once every n_seconds per call site.
+
+    The call site is the caller's code object and line, read straight from
+    its frame instead of walking the stack through findCaller(). Pass token
+    to share one rate limit between call sites, or to keep several for the
+    same one. Suppressed calls don't look at msg or args.
+    """
+    if token is None:
+        frame = sys._getframe(1)
+        token = (frame.f_code, frame.f_lasti)
+    if _seconds_have_elapsed(token, n_seconds):
         logging.log(level, msg, *args)
 
 
@@ -63,15 +79,85 @@ class TransactionAdapter(logging.LoggerAdapter):
 
     def process(self, msg, kwargs):
         relative_time = time.time() - self._created_time
+        kwargs['extra'] = self.extra
         return f'[+{relative_time:6.2f}s] {msg}', kwargs
 
-    def log_every_n_seconds(self, level, msg, n_seconds, *args):
-        should_log = _seconds_have_elapsed(
-            logging.getLogger().findCaller(), n_seconds)
-        if should_log:
+    def close(self):
+        """No more logs, releases (and compresses) the transaction log."""
+        writer = _transaction_log_writer()
+        writer.close(self.extra['transaction_id'])
+        log_every_n_seconds(logging.INFO, '[transaction log writer] %s',
+                            60 * 30, writer)
+
+    def log_every_n_seconds(self, level, msg, n_seconds, *args, token=None):
+        """Same as the module level log_every_n_seconds, the rate limit is
+        per call site and shared by all transactions."""
+        if token is None:
+            frame = sys._getframe(1)
+            token = (frame.f_code, frame.f_lasti)
+        if _seconds_have_elapsed(token, n_seconds):
             self.log(level, msg, *args)
 
 
+class _RootFormatter(logging.Formatter):
+    """LOG_FORMAT with the transaction id after the location, for records
+    of a transaction, so that log readers such as log_stream can tell them
+    apart."""
+
+    def __init__(self):
+        super().__init__(LOG_FORMAT)
+        self._transaction_formatter = logging.Formatter(
+            LOG_FORMAT.replace('] ', '] %(transaction_id)s ', 1))
+
+    def format(self, record):
+        if getattr(record, 'transaction_id', None) is not None:
+            return self._transaction_formatter.format(record)
+        return super().format(record)
+
+
+class Deferred:
+    """Log argument rendered by a logging thread instead of the caller.
+
+    Subclasses capture what they show in __init__, which must be cheap and
+    must not keep references to anything modified later, and build the text
+    in render(). It is rendered at most once, records of a transaction are
+    formatted by both the transaction log writer and the root handlers. If
+    render() raises, the text is a placeholder naming the exception, so a
+    bad snapshot costs one log line rather than a logging thread.
+    """
+    _text = None
+    # Shared by all instances, only the logging threads ever wait on it.
+    _render_lock = threading.Lock()
+
+    def render(self):
+        raise NotImplementedError
+
+    def __str__(self):
+        if self._text is None:
+            with self._render_lock:
+                if self._text is None:
+                    try:
+                        self._text = self.render()
+                    except Exception as ex:
+                        self._text = (f'<{type(self).__name__} failed to '
+                                      f'render: {ex!r}>')
+        return self._text
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """Leaves records with Deferred arguments to the queue's consumer.
+
+    Other records are formatted right away as usual, their arguments may
+    change once the log call returns. The other arguments of a call with a
+    Deferred one are formatted late as well.
+    """
+    def prepare(self, record):
+        if isinstance(record.args, tuple) and any(
+                isinstance(arg, Deferred) for arg in record.args):
+            return record
+        return super().prepare(record)
+
+
 class SlackHandler(logging.Handler):
     def format(self, record):
         prefix = '{}@{} '.format(_USER_NAME, _HOST_NAME)
@@ -81,20 +167,219 @@ class SlackHandler(logging.Handler):
         slack.send_unblock(self.format(record))
 
 
+class _TransactionQueueHandler(_DeferredQueueHandler):
+    def __init__(self, writer):
+        super().__init__(writer.queue)
+        self._writer = writer
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self._writer.dropped += 1
+
+
+class TransactionLogWriter:
+    """Writes transaction/<id>.log of all transactions from one thread.
+
+    Log calls only format the message and enqueue it, records are dropped
+    (and counted) if the queue is full rather than blocking the event loop.
+    At most constants.TRANSACTION_LOG_MAX_OPEN_FILES files are open, the
+    least recently written one is closed to open another.
+    """
+    _CLOSE = object()
+    _FLUSH = object()
+    _STOP = object()
+
+    def __init__(self, directory='transaction'):
+        self.directory = directory
+        self.queue = queue.Queue(constants.TRANSACTION_LOG_QUEUE_SIZE)
+        self.handler = _TransactionQueueHandler(self)
+        self.dropped = 0
+        self.num_records = 0
+        self._formatter = logging.Formatter(LOG_FORMAT)
+        self._files = OrderedDict()  # transaction id -> file, LRU first
+        self._thread = threading.Thread(target=self._run,
+                                        name='transaction-log-writer',
+                                        daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    @property
+    def queue_depth(self):
+        return self.queue.qsize()
+
+    @property
+    def num_open_files(self):
+        return len(self._files)
+
+    def __str__(self):
+        return (f'queue depth: {self.queue_depth}, '
+                f'records: {self.num_records}, dropped: {self.dropped}, '
+                f'open files: {self.num_open_files}')
+
+    def close(self, transaction_id):
+        try:
+            self.queue.put_nowait((self._CLOSE, transaction_id))
+        except queue.Full:
+            # The file is closed anyway once it is the least recently used.
+            self.dropped += 1
+
+    def flush(self, timeout=None):
+        """Blocks until all records enqueued so far are written."""
+        done = threading.Event()
+        try:
+            self.queue.put((self._FLUSH, done), timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def stop(self, timeout=5):
+        """Closes all files, gives up after timeout seconds if the queue
+        doesn't drain."""
+        if self._thread.is_alive():
+            try:
+                self.queue.put((self._STOP, None), timeout=timeout)
+            except queue.Full:
+                return
+            self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if isinstance(item, logging.LogRecord):
+                    self._write(item)
+                elif item[0] is self._CLOSE:
+                    self._close(item[1], compress=(
+                        constants.TRANSACTION_LOG_COMPRESS))
+                elif item[0] is self._FLUSH:
+                    self._flush_files()
+                elif item[0] is self._STOP:
+                    for transaction_id in list(self._files):
+                        self._close(transaction_id, compress=False)
+                    return
+            except Exception:
+                # Like logging.Handler.handleError, a bad record (e.g. args
+                # not matching the format string) must not stop the writer.
+                logging.error('exception in TransactionLogWriter',
+                              exc_info=True)
+            finally:
+                if isinstance(item, tuple) and item[0] is self._FLUSH:
+                    item[1].set()
+            if self.queue.empty():
+                try:
+                    self._flush_files()
+                except OSError:
+                    logging.error('exception in TransactionLogWriter',
+                                  exc_info=True)
+
+    def _path(self, transaction_id):
+        return os.path.join(self.directory, f'{transaction_id}.log')
+
+    def _write(self, record):
+        transaction_id = record.transaction_id
+        f = self._files.get(transaction_id)
+        if f is None:
+            if len(self._files) >= constants.TRANSACTION_LOG_MAX_OPEN_FILES:
+                _, oldest = self._files.popitem(last=False)
+                oldest.close()
+            f = open(self._path(transaction_id), 'a')
+            self._files[transaction_id] = f
+        else:
+            self._files.move_to_end(transaction_id)
+        f.write(self._formatter.format(record) + '\n')
+        self.num_records += 1
+
+    def _flush_files(self):
+        for f in self._files.values():
+            f.flush()
+
+    def _close(self, transaction_id, compress):
+        f = self._files.pop(transaction_id, None)
+        if f is not None:
+            f.close()
+        path = self._path(transaction_id)
+        if compress and os.path.exists(path):
+            with open(path, 'rb') as src, gzip.open(path + '.gz', 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(path)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def _transaction_log_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = TransactionLogWriter()
+        return _writer
+
+
+def transaction_log_metrics():
+    """Queue depth, records written and dropped, open files."""
+    writer = _transaction_log_writer()
+    return {'queue_depth': writer.queue_depth,
+            'num_records': writer.num_records,
+            'dropped': writer.dropped,
+            'num_open_files': writer.num_open_files}
+
+
 def create_transaction_logger(id):
-    logger = logging.getLogger().getChild(str(id))
-    fh = logging.FileHandler(f'transaction/{id}.log')
-    fh.setFormatter(logging.getLogger().handlers[0].formatter)
-    logger.addHandler(fh)
-    return TransactionAdapter(logger, {})
+    """Logger of one transaction, call close() on it when it is done.
+
+    All transactions share one logger, records also go to the root
+    handlers and to transaction/<id>.log through TransactionLogWriter.
+    """
+    writer = _transaction_log_writer()
+    # init_global_logger reloads logging, so look the logger up every time.
+    logger = logging.getLogger().getChild('transaction')
+    if writer.handler not in logger.handlers:
+        logger.addHandler(writer.handler)
+    return TransactionAdapter(logger, {'transaction_id': str(id)})
+
+
+_listener = None
+
+
+def _stop_background_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _log_in_background():
+    """Moves the root handlers to a QueueListener thread.
+
+    Log calls then only enqueue the record, files, stderr and slack are
+    written by the listener, which is also where Deferred arguments are
+    rendered.
+    """
+    global _listener
+    root = logging.getLogger()
+    handlers = list(root.handlers)
+    for handler in handlers:
+        root.removeHandler(handler)
+    records = queue.Queue()
+    _listener = QueueListener(records, *handlers, respect_handler_level=True)
+    _listener.start()
+    root.addHandler(_DeferredQueueHandler(records))
+
+
+atexit.register(_stop_background_logging)
 
 
 def init_global_logger(
         log_to_slack=False,
         log_level=logging.INFO,
-        log_to_stderr=False):
+        log_to_stderr=False,
+        log_in_background=True):
     global _logging_transaction_to_slack
 
+    _stop_background_logging()
     # basicConfig won't work if logging module is imported
     # already, so reload it.
     importlib.reload(logging)
@@ -103,13 +388,17 @@ def init_global_logger(
         format=LOG_FORMAT,
         filename='log/ok_bot.log'
     )
+    for handler in logging.getLogger().handlers:
+        handler.setFormatter(_RootFormatter())
     if log_to_stderr:
         sh = logging.StreamHandler()  # STDERR
-        sh.setFormatter(logging.Formatter(LOG_FORMAT))
+        sh.setFormatter(_RootFormatter())
         logging.getLogger().addHandler(sh)
     if log_to_slack:
         logging.getLogger().addHandler(SlackHandler('CRITICAL'))
         _logging_transaction_to_slack = True
+    if log_in_background:
+        _log_in_background()
 
 
 def _testing():
@@ -121,6 +410,7 @@ def _testing():
     logger_1.info('3333')
     time.sleep(1)
     logger_1.warning('4444')
+    logger_1.close()
 
     for i in range(12):
         logger_0.log_every_n_seconds(logging.INFO, '[A] %s seconds', 2, i)
@@ -128,7 +418,33 @@ def _testing():
         time.sleep(1)
 
 
+def _benchmark():
+    """python -m ok_bot.logger benchmark"""
+    number = 1000000
+
+    def find_caller_token():
+        # What log_every_n_seconds used to key the rate limit on.
+        if _seconds_have_elapsed(logging.getLogger().findCaller(), 3600):
+            logging.info('%s', 'benchmark')
+
+    def call_site_token():
+        log_every_n_seconds(logging.INFO, '%s', 3600, 'benchmark')
+
+    def explicit_token():
+        log_every_n_seconds(logging.INFO, '%s', 3600, 'benchmark',
+                            token='benchmark')
+
+    for name, fn in [('findCaller', find_caller_token),
+                     ('call site', call_site_token),
+                     ('explicit token', explicit_token)]:
+        sec = timeit.timeit(fn, number=number)
+        print(f'{name:>14}: {sec / number * 1e9:7.0f} ns per suppressed call')
+
+
 if __name__ == '__main__':
     init_global_logger(log_to_stderr=True, log_level=logging.DEBUG)
-    logging.debug('Testing transaction logging')
-    _testing()
+    if sys.argv[1:] == ['benchmark']:
+        _benchmark()
+    else:
+        logging.debug('Testing transaction logging')
+        _testing()
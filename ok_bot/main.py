@@ -4,9 +4,15 @@ import sys
 
 import git
 
-from . import singleton
+from . import constants, singleton
 from .logger import init_global_logger
 
+_EXECUTION_TYPES = {
+    'normal': constants.ORDER_EXECUTION_TYPE__NORMAL,
+    'fok': constants.ORDER_EXECUTION_TYPE__FOK,
+    'ioc': constants.ORDER_EXECUTION_TYPE__IOC,
+}
+
 
 def main():
     args = argparse.ArgumentParser(description='Automatic arbitrage trading')
@@ -33,12 +39,83 @@ def main():
                       type=int,
                       default=int(1e9),
                       help='Max number of concurrent transactions')
+    args.add_argument('--slow-leg-execution-type',
+                      choices=sorted(_EXECUTION_TYPES),
+                      default='normal',
+                      help='Order type of the slow leg when opening')
+    args.add_argument('--fast-leg-execution-type',
+                      choices=sorted(_EXECUTION_TYPES),
+                      default='normal',
+                      help='Order type of the fast leg when opening')
+    args.add_argument('--incremental-hedging',
+                      help='Hedge slow leg partial fills immediately',
+                      action='store_true')
+    args.add_argument('--chase-close-orders',
+                      help='Re-quote closing orders as soon as the touch moves',
+                      action='store_true')
+    args.add_argument('--profit-estimate-method',
+                      choices=['monte_carlo', 'closed_form'],
+                      default=constants.ESTIMATE_PROFIT_METHOD,
+                      help='How to estimate the profit of an arbitrage')
+    args.add_argument('--profit-estimate-samples',
+                      type=int,
+                      default=constants.ESTIMATE_PROFIT_SAMPLES,
+                      help='Scenarios per side for monte carlo estimation, '
+                           'the estimate is the worst of them so more '
+                           'samples are more conservative')
+    args.add_argument('--spread-center',
+                      choices=['mean', 'median'],
+                      default=constants.SPREAD_CENTER,
+                      help='Statistic the spread is expected to revert to')
+    args.add_argument('--strategy-memo-epoch-second',
+                      type=float,
+                      default=constants.STRATEGY_MEMO_STATS_EPOCH_SECOND,
+                      help='Reuse strategy decisions on unchanged top of book '
+                           'within this many seconds, 0 to disable')
+    args.add_argument('--db-flush-interval-second',
+                      type=float,
+                      default=constants.DB_FLUSH_INTERVAL_SECOND,
+                      help='Order updates within this window are merged '
+                           'into one database write')
+    args.add_argument('--db-keep-order-history',
+                      help='Record every order update in the history table',
+                      action='store_true')
+    args.add_argument('--tick-store-dir',
+                      default=constants.TICK_STORE_DIR,
+                      help='Record ticks to this columnar tick store')
+    args.add_argument('--tick-store-depth',
+                      help='Record the full depth5 into the tick store',
+                      action='store_true')
+    args.add_argument('--journal-dir',
+                      default=constants.JOURNAL_DIR,
+                      help='Record ticks, decisions and orders to this '
+                           'event journal')
+    args.add_argument('--compress-transaction-logs',
+                      help='Gzip transaction logs once a transaction ends',
+                      action='store_true')
 
     args = args.parse_args()
     init_global_logger(log_to_slack=args.log_to_slack,
                        log_level=args.log_level,
                        log_to_stderr=args.log_to_stderr)
     symbol = args.symbol
+    constants.SLOW_LEG_ORDER_EXECUTION_TYPE = \
+        _EXECUTION_TYPES[args.slow_leg_execution_type]
+    constants.FAST_LEG_ORDER_EXECUTION_TYPE = \
+        _EXECUTION_TYPES[args.fast_leg_execution_type]
+    constants.INCREMENTAL_FAST_LEG_HEDGING = args.incremental_hedging
+    constants.CHASE_CLOSE_ORDERS = args.chase_close_orders
+    constants.ESTIMATE_PROFIT_METHOD = args.profit_estimate_method
+    constants.ESTIMATE_PROFIT_SAMPLES = args.profit_estimate_samples
+    constants.SPREAD_CENTER = args.spread_center
+    constants.STRATEGY_MEMO_STATS_EPOCH_SECOND = \
+        args.strategy_memo_epoch_second
+    constants.DB_FLUSH_INTERVAL_SECOND = args.db_flush_interval_second
+    constants.DB_KEEP_ORDER_HISTORY = args.db_keep_order_history
+    constants.TICK_STORE_DIR = args.tick_store_dir
+    constants.TICK_STORE_DEPTH = args.tick_store_depth
+    constants.TRANSACTION_LOG_COMPRESS = args.compress_transaction_logs
+    constants.JOURNAL_DIR = args.journal_dir
     last_ci = git.Repo(search_parent_directories=True).head.commit
     logging.critical('Starting program @%s (%s) with %s, args: %s, ',
                      str(last_ci)[:6], last_ci.summary,
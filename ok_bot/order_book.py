@@ -12,13 +12,50 @@ from scipy import stats
 from . import singleton
 from .constants import (MOVING_AVERAGE_TIME_WINDOW_IN_SECOND,
                         PRICE_PREDICTION_WINDOW_SECOND)
-from .quant import Quant
+from .logger import Deferred
+from .order_statistics import RollingOrderStatistics
 from .schema import Schema
 
 _TIME_WINDOW = np.timedelta64(
     MOVING_AVERAGE_TIME_WINDOW_IN_SECOND, 's')
 
 
+# Best prices and rolling spread statistics of many products at once, as
+# parallel lists/arrays indexed by product.
+SpreadSnapshot = namedtuple('SpreadSnapshot',
+                            [
+                                'long_instruments',
+                                'short_instruments',
+                                'products',
+                                'long_ask_prices',
+                                'short_bid_prices',
+                                'current_spreads',
+                                'historical_mean_spreads',
+                                'median_spreads',
+                                'zscores',
+                            ])
+
+
+def _window(series, window_sec=None):
+    if window_sec is None:
+        return series
+    assert window_sec > 0
+    return series.loc[
+        series.index >= series.index[-1] - np.timedelta64(window_sec, 's')]
+
+
+def _linear_fit(series, window_sec=None):
+    w = _window(series, window_sec)
+    if len(w) <= 1:
+        return 0.0
+
+    left = w.index[0].timestamp()
+    x = [i.timestamp() - left for i in w.index]
+    y = w.values.astype('float64')
+    p = np.polynomial.polynomial.Polynomial.fit(x=x, y=y, deg=1)
+    return p.coef[1]
+
+
 class AvailableOrder:
     def __init__(self, price, volume):
         self.price = price
@@ -57,34 +94,60 @@ class MarketDepth:
     def bid(self):
         return self.bid_stack_
 
+    def snapshot(self):
+        """Log argument showing this depth as of now, rendered later."""
+        return MarketDepthSnapshot(self)
+
     def __str__(self):
-        now_local = time.time()
-        now_server = now_local + singleton.schema.time_diff_sec
-        ask_slope = singleton.order_book.price_linear_fit(
-            self.instrument_id, 'ask', PRICE_PREDICTION_WINDOW_SECOND)
-        bid_slope = singleton.order_book.price_linear_fit(
-            self.instrument_id, 'bid', PRICE_PREDICTION_WINDOW_SECOND)
+        return str(self.snapshot())
+
+    def update(self, ask_prices, ask_vols, bid_prices, bid_vols):
+        self.bid_stack_ = [AvailableOrder(price=price, volume=volume)
+                           for price, volume in list(zip(bid_prices, bid_vols))]
+        self.ask_stack_ = [AvailableOrder(price=price, volume=volume)
+                           for price, volume in list(zip(ask_prices, ask_vols))]
+
+
+class MarketDepthSnapshot(Deferred):
+    """MarketDepth.__str__ with everything captured at log time.
+
+    Stacks and price tables are replaced rather than modified on every tick,
+    so keeping references is enough. The regressions and pprint run when a
+    logging thread renders it.
+    """
+    def __init__(self, market_depth):
+        self.instrument_id = market_depth.instrument_id
+        self.timestamp_local = market_depth.timestamp_local
+        self.timestamp_server = market_depth.timestamp_server
+        self.ask_stack = market_depth.ask_stack_
+        self.bid_stack = market_depth.bid_stack_
+        self.now_local = time.time()
+        self.now_server = self.now_local + singleton.schema.time_diff_sec
+        self.ask_prices = singleton.order_book.price_series(
+            self.instrument_id, 'ask')
+        self.bid_prices = singleton.order_book.price_series(
+            self.instrument_id, 'bid')
+
+    def render(self):
+        ask_slope = _linear_fit(self.ask_prices,
+                                PRICE_PREDICTION_WINDOW_SECOND)
+        bid_slope = _linear_fit(self.bid_prices,
+                                PRICE_PREDICTION_WINDOW_SECOND)
         ret = '------ market_depth ------\n'
         ret += 'ask_slope: {:.6f}, bid_slope: {:.6f}\n'.format(
             ask_slope, bid_slope)
         ret += 'local_delay: {:.2f} sec\n'.format(
-            now_local - self.timestamp_local)
+            self.now_local - self.timestamp_local)
         ret += 'server_delay: {:.2f} sec\n'.format(
-            now_server - self.timestamp_server)
+            self.now_server - self.timestamp_server)
         ret += 'local_server_diff: {:.2f} sec\n'.format(
             self.timestamp_local - self.timestamp_server)
-        ret += pprint.pformat(list(reversed(self.ask_stack_)))
+        ret += pprint.pformat(list(reversed(self.ask_stack)))
         ret += '\n'
-        ret += pprint.pformat(self.bid_stack_)
+        ret += pprint.pformat(self.bid_stack)
         ret += '\n--------------------------'
         return ret
 
-    def update(self, ask_prices, ask_vols, bid_prices, bid_vols):
-        self.bid_stack_ = [AvailableOrder(price=price, volume=volume)
-                           for price, volume in list(zip(bid_prices, bid_vols))]
-        self.ask_stack_ = [AvailableOrder(price=price, volume=volume)
-                           for price, volume in list(zip(ask_prices, ask_vols))]
-
 
 class OrderBook:
     def __init__(self):
@@ -93,6 +156,9 @@ class OrderBook:
 
         # order book data
         self.table = defaultdict(pd.Series)
+        # Median, quantiles and range of each spread over the same window.
+        self.spread_order_statistics = defaultdict(
+            lambda: RollingOrderStatistics(MOVING_AVERAGE_TIME_WINDOW_IN_SECOND))
         self.last_record = {}
         self._market_depth = {}
 
@@ -102,22 +168,69 @@ class OrderBook:
         self.ready = singleton.loop.create_future()
 
     def window(self, column, window_sec=None):
-        if window_sec is None:
-            return self.table[column]
-        else:
-            assert window_sec > 0
-            return self.table[column].loc[
-                self.table[column].index >= self.table[column].index[-1] - np.timedelta64(window_sec, 's')]
+        return _window(self.table[column], window_sec)
 
     def zscore(self, cross_product):
         zscores = stats.zscore(self.table[cross_product].astype('float64'))
-        return Quant(zscores[-1])
+        return zscores[-1]
 
     def historical_mean_spread(self, cross_product):
-        return Quant(self.table[cross_product].values[:-1].mean())
+        return self.table[cross_product].values[:-1].mean()
 
     def current_spread(self, cross_product):
-        return Quant(self.table[cross_product].values[-1])
+        return self.table[cross_product].values[-1]
+
+    def median_spread(self, cross_product):
+        return self.spread_order_statistics[cross_product].median()
+
+    def spread_quantile(self, cross_product, q):
+        return self.spread_order_statistics[cross_product].quantile(q)
+
+    def spread_rank(self, cross_product):
+        """Fraction of the window below the current spread, a robust zscore."""
+        return self.spread_order_statistics[cross_product].rank(
+            self.current_spread(cross_product))
+
+    def spread_range(self, cross_product):
+        order_statistics = self.spread_order_statistics[cross_product]
+        return order_statistics.min(), order_statistics.max()
+
+    def spread_snapshot(self, pairs=None) -> SpreadSnapshot:
+        """zscore, historical_mean_spread and current_spread of all pairs.
+
+        pairs defaults to every (long, short, product) of the schema. Product
+        columns are all appended on every tick in _update_derived_data, so
+        they have the same length and are stacked into one matrix.
+        """
+        if pairs is None:
+            pairs = self._schema.markets_cartesian_product
+        long_instruments = [long for long, _, _ in pairs]
+        short_instruments = [short for _, short, _ in pairs]
+        products = [product for _, _, product in pairs]
+        spreads = np.vstack([self.table[product].values
+                             for product in products]).astype('float64')
+        current_spreads = spreads[:, -1]
+        # Same as scipy.stats.zscore(...)[-1] for each row.
+        zscores = ((current_spreads - spreads.mean(axis=1))
+                   / spreads.std(axis=1))
+        return SpreadSnapshot(
+            long_instruments=long_instruments,
+            short_instruments=short_instruments,
+            products=products,
+            long_ask_prices=np.array(
+                [self.last_record[Schema.make_column_name(
+                    instrument_id, 'ask', 'price')]
+                 for instrument_id in long_instruments], dtype='float64'),
+            short_bid_prices=np.array(
+                [self.last_record[Schema.make_column_name(
+                    instrument_id, 'bid', 'price')]
+                 for instrument_id in short_instruments], dtype='float64'),
+            current_spreads=current_spreads,
+            historical_mean_spreads=spreads[:, :-1].mean(axis=1),
+            median_spreads=np.array([self.median_spread(product)
+                                     for product in products]),
+            zscores=zscores,
+        )
 
     def current_price_average(self, cross_product):
         for long_instrument, short_instrument, product in self._schema.markets_cartesian_product:
@@ -131,36 +244,32 @@ class OrderBook:
             instrument_id, ask_or_bid, 'price')
         w = self.window(column, window_sec)
         if len(w) <= 1:
-            return Quant(0)
+            return 0.0
         history = w.values[:-1].mean()
         current = w.values[-1]
-        return Quant((current - history) / history)
+        return (current - history) / history
 
-    def price_linear_fit(self, instrument_id, ask_or_bid, window_sec=None):
+    def price_series(self, instrument_id, ask_or_bid):
+        """Best price history, replaced (never modified) on every tick."""
         assert ask_or_bid in ['ask', 'bid']
-        column = Schema.make_column_name(
-            instrument_id, ask_or_bid, 'price')
-        w = self.window(column, window_sec)
-        if len(w) <= 1:
-            return Quant(0)
+        return self.table[Schema.make_column_name(
+            instrument_id, ask_or_bid, 'price')]
 
-        left = w.index[0].timestamp()
-        x = [i.timestamp() - left for i in w.index]
-        y = w.values.astype('float64')
-        p = np.polynomial.polynomial.Polynomial.fit(x=x, y=y, deg=1)
-        return p.coef[1]
+    def price_linear_fit(self, instrument_id, ask_or_bid, window_sec=None):
+        return _linear_fit(self.price_series(instrument_id, ask_or_bid),
+                           window_sec)
 
     def ask_price(self, instrument_id):
-        return Quant(self.last_record[Schema.make_column_name(instrument_id, 'ask', 'price')])
+        return self.last_record[Schema.make_column_name(instrument_id, 'ask', 'price')]
 
     def bid_price(self, instrument_id):
-        return Quant(self.last_record[Schema.make_column_name(instrument_id, 'bid', 'price')])
+        return self.last_record[Schema.make_column_name(instrument_id, 'bid', 'price')]
 
     def ask_volume(self, instrument_id):
-        return Quant(self.last_record[Schema.make_column_name(instrument_id, 'ask', 'vol')])
+        return self.last_record[Schema.make_column_name(instrument_id, 'ask', 'vol')]
 
     def bid_volume(self, instrument_id):
-        return Quant(self.last_record[Schema.make_column_name(instrument_id, 'bid', 'vol')])
+        return self.last_record[Schema.make_column_name(instrument_id, 'bid', 'vol')]
 
     @property
     def time_window(self):
@@ -256,6 +365,8 @@ class OrderBook:
             instrument_id, 'bid', 'vol'), bid_vols[0])
 
     def _update_derived_data(self):
+        timestamp_sec = self.last_record['timestamp'].astype(
+            'datetime64[ns]').astype('int64') / 1e9
         for long_instrument, short_instrument, product in self._schema.markets_cartesian_product:
             ask_price_name = Schema.make_column_name(
                 long_instrument, 'ask', 'price')
@@ -264,9 +375,14 @@ class OrderBook:
             new_point = self.last_record[bid_price_name] - \
                 self.last_record[ask_price_name]
             self._update_table(product, new_point)
+            self.spread_order_statistics[product].add(timestamp_sec,
+                                                      float(new_point))
 
     def _update_table(self, column, value):
-        new_point = pd.Series(value, index=[self.last_record['timestamp']])
+        # Prices are exact Price ticks in last_record and the market depth,
+        # tables hold plain floats for the rolling statistics.
+        new_point = pd.Series(float(value),
+                              index=[self.last_record['timestamp']])
         this_table = self.table[column]
         this_table = this_table.append(new_point)
         self.table[column] = this_table.loc[
@@ -2,15 +2,54 @@ import asyncio
 import concurrent
 import logging
 import pprint
+import time
+import uuid
+from collections import defaultdict
 
-from . import constants, singleton
+from . import constants, journal, singleton
+from .api_v3.okex_sdk.exceptions import OkexAPIException
+from .rest_api_v3 import _order_not_found
+from .stats import Stats
+
+ORDER_EXECUTION_TYPE_TO_STRING = {
+    constants.ORDER_EXECUTION_TYPE__NORMAL: 'normal',
+    constants.ORDER_EXECUTION_TYPE__POST_ONLY: 'post_only',
+    constants.ORDER_EXECUTION_TYPE__FOK: 'fok',
+    constants.ORDER_EXECUTION_TYPE__IOC: 'ioc',
+}
+
+# Order type of each RestApiV3 order request.
+_ORDER_TYPE_OF_REQUEST = {
+    'open_long_order': constants.ORDER_TYPE_CODE__OPEN_LONG,
+    'open_short_order': constants.ORDER_TYPE_CODE__OPEN_SHORT,
+    'close_long_order': constants.ORDER_TYPE_CODE__CLOSE_LONG,
+    'close_short_order': constants.ORDER_TYPE_CODE__CLOSE_SHORT,
+}
+
+# Seconds from sending the order request until it's resolved with fills,
+# keyed by execution type.
+fill_latency_stats = defaultdict(
+    lambda: Stats(constants.EXECUTION_LATENCY_STATS_WINDOW_SECOND))
+
+# Seconds ChaseExecutor takes to close the whole amount.
+time_to_close_stats = Stats(constants.EXECUTION_LATENCY_STATS_WINDOW_SECOND)
+
+
+def generate_client_oid():
+    """OKEX accepts 1-32 alphanumeric characters starting with a letter."""
+    return f'okb{uuid.uuid4().hex[:29]}'
 
 
 class OrderExecutionResult:
-    def __init__(self, order_id, amount, fulfilled_quantity):
+    def __init__(self, order_id, amount, fulfilled_quantity, order_ids=None):
+        """order_ids: every order placed for the result, order_id is the
+        last one. Defaults to [order_id]."""
         self.order_id = order_id
         self.amount = amount
         self.fulfilled_quantity = fulfilled_quantity
+        if order_ids is None:
+            order_ids = [] if order_id is None else [order_id]
+        self.order_ids = order_ids
 
     @property
     def succeeded(self):
@@ -75,16 +114,45 @@ class OrderRevoker:
 
 
 class OrderAwaiter:
-    def __init__(self, order_id, logger, timeout_sec, transaction_id=None):
-        """Returns None if timeout otherwise fulfilled quantity."""
+    def __init__(self, order_id, logger, timeout_sec, transaction_id=None,
+                 client_oid=None, fill_callback=None):
+        """Returns None if timeout otherwise fulfilled quantity.
+
+        order_id can be None when pre-registering by client_oid, call
+        bind_order_id once the REST API response comes back.
+        fill_callback(filled_qty) is called with the accumulated filled
+        quantity whenever websocket reports new fills.
+        """
         self._order_id = order_id
+        self._client_oid = client_oid
+        self._fill_callback = fill_callback
         self._future = singleton.loop.create_future()
         self._logger = logger
         self._timeout_sec = timeout_sec
         self._transaction_id = transaction_id
+        self._registered = False
+
+    def register(self):
+        singleton.order_listener.subscribe(
+            self._order_id, self, client_oid=self._client_oid)
+        self._registered = True
+
+    def unregister(self):
+        singleton.order_listener.unsubscribe(
+            self._order_id, self, client_oid=self._client_oid)
+        self._registered = False
+
+    @property
+    def order_id(self):
+        return self._order_id
+
+    def bind_order_id(self, order_id):
+        self._order_id = int(order_id)
+        self.register()
 
     async def __aenter__(self):
-        singleton.order_listener.subscribe(self._order_id, self)
+        if not self._registered:
+            self.register()
         try:
             res = await asyncio.wait_for(
                 self._future, timeout=self._timeout_sec)
@@ -94,22 +162,44 @@ class OrderAwaiter:
             return res
 
     async def __aexit__(self, type, value, traceback):
-        singleton.order_listener.unsubscribe(self._order_id, self)
+        self.unregister()
 
         if type is not None:
             self._logger.critical(
                 'exception within OrderAwaiter', exc_info=True)
 
-    def order_pending(self, order_id):
+    def expire(self):
+        """Stops waiting, the order is then treated as timeout."""
+        if not self._future.done():
+            self._future.set_result(None)
+
+    def _notify_fill(self, filled_qty):
+        if self._fill_callback is not None and filled_qty > 0:
+            self._fill_callback(int(filled_qty))
+
+    def _check_order_id(self, order_id):
+        # Updates routed by client_oid may arrive before the REST response.
+        if self._order_id is None:
+            self._order_id = order_id
         assert self._order_id == order_id
+
+    def order_pending(self, order_id):
+        self._check_order_id(order_id)
         self._logger.info('[WEBSOCKET] %s order_pending', order_id)
 
-    def order_cancelled(self, order_id):
-        assert self._order_id == order_id
+    def order_cancelled(self, order_id, filled_qty=0):
+        self._check_order_id(order_id)
         if self._future.done():
             return
-        self._future.set_result(0)
-        self._logger.info('[WEBSOCKET] %s order_cancelled', order_id)
+        # Partially filled orders (e.g. IOC) are also reported as cancelled.
+        self._future.set_result(int(filled_qty))
+        journal.record('order_fill', self._transaction_id,
+                       order_id=order_id,
+                       status=constants.ORDER_STATUS_CODE__CANCELLED,
+                       filled_qty=filled_qty)
+        self._logger.info('[WEBSOCKET] %s order_cancelled, filled_qty: %s',
+                          order_id, filled_qty)
+        self._notify_fill(filled_qty)
 
     def order_fulfilled(self,
                         order_id,
@@ -118,14 +208,21 @@ class OrderAwaiter:
                         fee,
                         price,
                         price_avg):
-        assert self._order_id == order_id
+        self._check_order_id(order_id)
         if self._future.done():
             return
         self._future.set_result(filled_qty)
+        journal.record('order_fill', self._transaction_id,
+                       order_id=order_id,
+                       status=constants.ORDER_STATUS_CODE__FULFILLED,
+                       filled_qty=int(filled_qty),
+                       price_avg=price_avg,
+                       fee=fee)
         self._logger.info(
             '[WEBSOCKET] %s order_fulfilled, '
             'price: %s, price_avg: %s, size: %s, filled_qty: %s, fee: %s',
             order_id, price, price_avg, size, filled_qty, fee)
+        self._notify_fill(filled_qty)
         singleton.db.async_update_order(
             order_id=order_id,
             transaction_id=self._transaction_id,
@@ -145,11 +242,17 @@ class OrderAwaiter:
                                size,
                                filled_qty,
                                price_avg):
-        assert self._order_id == order_id
+        self._check_order_id(order_id)
         self._logger.info(
             '[WEBSOCKET] %s order_partially_filled\n'
             'price_avg: %s, size: %s, filled_qty: %s',
             order_id, price_avg, size, filled_qty)
+        journal.record('order_fill', self._transaction_id,
+                       order_id=order_id,
+                       status=constants.ORDER_STATUS_CODE__PARTIALLY_FILLED,
+                       filled_qty=int(filled_qty),
+                       price_avg=price_avg)
+        self._notify_fill(filled_qty)
         singleton.db.async_update_order(
             order_id=order_id,
             transaction_id=self._transaction_id,
@@ -172,7 +275,11 @@ class OrderExecutor:
                  is_market_order,
                  logger,
                  transaction_id=None,
-                 safe_price=False):
+                 safe_price=False,
+                 execution_type=constants.ORDER_EXECUTION_TYPE__NORMAL,
+                 fill_callback=None):
+        """fill_callback(filled_qty) is called on every websocket fill."""
+        assert execution_type in ORDER_EXECUTION_TYPE_TO_STRING
         self._instrument_id = instrument_id
         self._side = None
         self._amount = int(amount)
@@ -184,6 +291,14 @@ class OrderExecutor:
         self._transaction_id = transaction_id
         self._order_id = None
         self._safe_price = safe_price
+        self._execution_type = execution_type
+        self._fill_callback = fill_callback
+        self._order_awaiter = None
+
+    def expire(self):
+        """Gives up waiting for the order and revokes it right away."""
+        if self._order_awaiter is not None:
+            self._order_awaiter.expire()
 
     def open_long_position(self) -> OrderExecutionResult:
         """Returns Future[OrderExecutionResult]"""
@@ -218,28 +333,68 @@ class OrderExecutor:
         return self._place_order(singleton.rest_api.close_short_order)
 
     async def _place_order(self, rest_request_functor) -> OrderExecutionResult:
+        client_oid = generate_client_oid()
         self._logger.info(
-            '[SENDING ORDER REQUEST] %s, %s, %s\n'
-            'price: %s (%s), amount: %s\n'
+            '[SENDING ORDER REQUEST] %s, %s, %s (%s)\n'
+            'price: %s (%s), amount: %s, execution_type: %s\n'
             '%s',
             rest_request_functor.__name__,
             self._side,
             self._instrument_id,
+            client_oid,
             self._price,
             self._original_price,
             self._amount,
-            singleton.order_book.market_depth(self._instrument_id)
+            ORDER_EXECUTION_TYPE_TO_STRING[self._execution_type],
+            singleton.order_book.market_depth(self._instrument_id).snapshot()
         )
 
+        # Register interest before sending so that websocket updates are
+        # routed by client_oid even if they beat the REST response.
+        order_awaiter = OrderAwaiter(
+            order_id=None,
+            logger=self._logger,
+            timeout_sec=self._timeout_sec,
+            transaction_id=self._transaction_id,
+            client_oid=client_oid,
+            fill_callback=self._fill_callback)
+        order_awaiter.register()
+        self._order_awaiter = order_awaiter
+
+        journal.record('order_sent', self._transaction_id,
+                       instrument_id=self._instrument_id,
+                       client_oid=client_oid,
+                       type=_ORDER_TYPE_OF_REQUEST.get(
+                           rest_request_functor.__name__),
+                       execution_type=self._execution_type,
+                       size=self._amount,
+                       price=self._price)
         # TODO: add timeout_sec for rest api wait() as well.
-        self._order_id, error_code = await rest_request_functor(
-            self._instrument_id,
-            self._amount,
-            self._price,
-            is_market_order=self._is_market_order
-        )
-
-        if self._order_id is None:
+        sent_time = time.time()
+        try:
+            self._order_id, error_code = await rest_request_functor(
+                self._instrument_id,
+                self._amount,
+                self._price,
+                custom_order_id=client_oid,
+                is_market_order=self._is_market_order,
+                execution_type=self._execution_type
+            )
+        except BaseException:
+            order_awaiter.unregister()
+            raise
+        journal.record('order_ack', self._transaction_id,
+                       instrument_id=self._instrument_id,
+                       client_oid=client_oid,
+                       order_id=self._order_id,
+                       error_code=error_code or 0,
+                       latency_sec=time.time() - sent_time)
+
+        state_unknown = (
+            self._order_id is None and
+            error_code == constants.REST_API_ERROR_CODE__ORDER_STATE_UNKNOWN)
+        if self._order_id is None and not state_unknown:
+            order_awaiter.unregister()
             self._logger.error(f'Failed to place order via REST API, '
                                f'error code: {error_code}')
             if error_code == constants.REST_API_ERROR_CODE__MARGIN_NOT_ENOUGH:
@@ -251,31 +406,37 @@ class OrderExecutor:
                 fulfilled_quantity=0,
             )
 
-        self._logger.info(
-            f'{self._order_id} ({self._instrument_id}) order was created '
-            f'({rest_request_functor.__name__})')
-        singleton.db.async_update_order(
-            order_id=self._order_id,
-            transaction_id=self._transaction_id,
-            comment='request_sent',
-            status=None,
-            size=int(self._amount),
-            filled_qty=None,
-            price=str(self._price),
-            price_avg=None,
-            fee=None,
-            type=None,
-            timestamp=None
-        )
+        if state_unknown:
+            # Still routed by client_oid, the websocket may tell.
+            self._logger.warning(
+                f'[ORDER STATE UNKNOWN] {client_oid} ({self._instrument_id}) '
+                'waiting for websocket updates')
+        else:
+            self._logger.info(
+                f'{self._order_id} ({self._instrument_id}) order was created '
+                f'({rest_request_functor.__name__})')
+            singleton.db.async_update_order(
+                order_id=self._order_id,
+                transaction_id=self._transaction_id,
+                comment='request_sent',
+                status=None,
+                size=int(self._amount),
+                filled_qty=None,
+                price=str(self._price),
+                price_avg=None,
+                fee=None,
+                type=None,
+                timestamp=None
+            )
+            order_awaiter.bind_order_id(self._order_id)
 
-        order_awaiter = OrderAwaiter(
-            order_id=self._order_id,
-            logger=self._logger,
-            timeout_sec=self._timeout_sec,
-            transaction_id=self._transaction_id)
         async with order_awaiter as websocket_reported_fulfilled_quantity:
+            self._order_id = order_awaiter.order_id
             if websocket_reported_fulfilled_quantity is not None:
                 fulfilled_quantity = websocket_reported_fulfilled_quantity
+            elif self._order_id is None:
+                self._order_id, fulfilled_quantity = \
+                    await self._resolve_by_client_oid(client_oid)
             else:
                 self._logger.info(
                     f'[TIMEOUT] {self._order_id} ({self._instrument_id}) '
@@ -285,6 +446,10 @@ class OrderExecutor:
                     instrument_id=self._instrument_id,
                     logger=self._logger).revoke_guaranteed()
                 assert 0 <= fulfilled_quantity <= self._amount
+                journal.record('order_revoke', self._transaction_id,
+                               instrument_id=self._instrument_id,
+                               order_id=self._order_id,
+                               filled_qty=fulfilled_quantity)
                 if fulfilled_quantity == self._amount:
                     self._logger.info(
                         f'[TIMEOUT -> FULFILLED] {fulfilled_quantity}, '
@@ -301,11 +466,188 @@ class OrderExecutor:
                         f'[TIMEOUT -> PARTIALLY FULFILLED] {fulfilled_quantity}, '
                         f'{self._order_id} ({self._instrument_id}) ')
 
+        if fulfilled_quantity > 0:
+            latency = time.time() - sent_time
+            fill_latency_stats[self._execution_type].add(latency)
+            self._logger.info(
+                '[FILL LATENCY] %s (%s) %.3f sec',
+                self._order_id,
+                ORDER_EXECUTION_TYPE_TO_STRING[self._execution_type],
+                latency)
+
         return OrderExecutionResult(
             order_id=self._order_id,
             amount=self._amount,
             fulfilled_quantity=fulfilled_quantity)
 
+    async def _resolve_by_client_oid(self, client_oid):
+        """Revokes an order whose placement is unknown and never showed up
+        on the websocket, returns (order_id, fulfilled_quantity), order_id
+        None if OKEX has no such order."""
+        try:
+            order_info = await singleton.rest_api.get_order_info(
+                client_oid, self._instrument_id)
+        except Exception as ex:
+            if isinstance(ex, OkexAPIException) and _order_not_found(ex):
+                self._logger.info(
+                    f'[ORDER STATE RESOLVED] {client_oid} was not placed')
+            else:
+                self._logger.critical(
+                    f'[ORDER STATE UNKNOWN] {client_oid} '
+                    f'({self._instrument_id}) could not be looked up: {ex}')
+            return None, 0
+        order_id = int(order_info['order_id'])
+        self._logger.info(
+            f'[ORDER STATE RESOLVED] {client_oid} is {order_id}, revoking')
+        fulfilled_quantity = await OrderRevoker(
+            order_id=order_id,
+            instrument_id=self._instrument_id,
+            logger=self._logger).revoke_guaranteed()
+        return order_id, fulfilled_quantity
+
+
+class ChaseExecutor:
+    """Closes a position by keeping the order at the touch.
+
+    Whenever the market moves away from the resting order, the order is
+    revoked and placed again at the new touch, as long as the price stays
+    within max_slippage_rate from the touch at start. OKEX v3 futures API has
+    no order amendment, so re-quoting is revoke + place.
+
+    Orders that fail to be placed are retried with a backoff, after
+    constants.CHASE_MAX_FAILED_ORDERS failures in a row the chase returns
+    with what has been filled so far.
+    """
+
+    def __init__(self,
+                 instrument_id,
+                 amount,
+                 logger,
+                 transaction_id=None,
+                 timeout_sec=constants.CLOSE_POSITION_ORDER_TIMEOUT_SECOND,
+                 max_slippage_rate=constants.CHASE_MAX_SLIPPAGE_RATE,
+                 prices=None):
+        self._instrument_id = instrument_id
+        self._amount = int(amount)
+        self._logger = logger
+        self._transaction_id = transaction_id
+        self._timeout_sec = timeout_sec
+        self._max_slippage_rate = max_slippage_rate
+        self._prices = prices if prices is not None else []
+        self._side = None
+        self._limit_price = None
+        self._order_price = None
+        self._executor = None
+
+    def close_long_order(self) -> OrderExecutionResult:
+        """Returns Future[OrderExecutionResult]"""
+        self._side = 'bid'
+        return self._chase(OrderExecutor.close_long_order)
+
+    def close_short_order(self) -> OrderExecutionResult:
+        """Returns Future[OrderExecutionResult]"""
+        self._side = 'ask'
+        return self._chase(OrderExecutor.close_short_order)
+
+    def _quote(self, touch_price):
+        if self._side == 'bid':
+            price = touch_price * (1 - constants.ORDER_EXECUTOR_SAFE_PRICE_RATE)
+            return max(price, self._limit_price)
+        else:
+            price = touch_price * (1 + constants.ORDER_EXECUTOR_SAFE_PRICE_RATE)
+            return min(price, self._limit_price)
+
+    def _touch_price(self):
+        market_depth = singleton.order_book.market_depth(self._instrument_id)
+        if self._side == 'bid':
+            return market_depth.best_bid_price()
+        else:
+            return market_depth.best_ask_price()
+
+    def tick_received(self, instrument_id,
+                      ask_prices, ask_vols, bid_prices, bid_vols,
+                      timestamp):
+        if self._executor is None or self._order_price is None:
+            return
+        if self._side == 'bid':
+            touch_price = bid_prices[0]
+            at_touch = touch_price >= self._order_price
+        else:
+            touch_price = ask_prices[0]
+            at_touch = touch_price <= self._order_price
+        # Re-quote only when it would change the price, which is no longer
+        # the case once the slippage budget is exhausted.
+        if not at_touch and self._quote(touch_price) != self._order_price:
+            self._logger.info('[CHASE] touch moved to %s, re-quoting %s',
+                              touch_price, self._order_price)
+            self._order_price = None
+            self._executor.expire()
+
+    async def _chase(self, close_functor) -> OrderExecutionResult:
+        start_time = time.time()
+        touch_price = self._touch_price()
+        if self._side == 'bid':
+            self._limit_price = touch_price * (1 - self._max_slippage_rate)
+        else:
+            self._limit_price = touch_price * (1 + self._max_slippage_rate)
+
+        remaining = self._amount
+        order_ids = []
+        num_failed = 0
+        retry_interval = constants.CHASE_RETRY_INTERVAL_SECOND
+        singleton.book_listener.subscribe(self._instrument_id, self)
+        try:
+            while remaining > 0:
+                self._order_price = self._quote(self._touch_price())
+                self._prices.append(self._order_price)
+                self._executor = OrderExecutor(
+                    instrument_id=self._instrument_id,
+                    amount=remaining,
+                    price=self._order_price,
+                    timeout_sec=self._timeout_sec,
+                    is_market_order=False,
+                    logger=self._logger,
+                    transaction_id=self._transaction_id)
+                result = await close_functor(self._executor)
+                remaining -= result.fulfilled_quantity
+                if result.order_id is not None:
+                    order_ids.append(result.order_id)
+                    num_failed = 0
+                    retry_interval = constants.CHASE_RETRY_INTERVAL_SECOND
+                elif result.fulfilled_quantity == 0:
+                    num_failed += 1
+                    if num_failed >= constants.CHASE_MAX_FAILED_ORDERS:
+                        self._logger.error(
+                            '[CHASE] giving up after %d failed orders, '
+                            '%d remaining', num_failed, remaining)
+                        break
+                    self._logger.warning(
+                        '[CHASE] failed to place order, retrying in %.1f sec',
+                        retry_interval)
+                    await asyncio.sleep(retry_interval)
+                    retry_interval = min(
+                        retry_interval * 2,
+                        constants.CHASE_MAX_RETRY_INTERVAL_SECOND)
+                    continue
+                if remaining > 0:
+                    self._logger.info('[CHASE] %s, %d remaining',
+                                      result, remaining)
+        finally:
+            singleton.book_listener.unsubscribe(self._instrument_id, self)
+            self._executor = None
+
+        fulfilled_quantity = self._amount - remaining
+        if remaining == 0:
+            time_to_close = time.time() - start_time
+            time_to_close_stats.add(time_to_close)
+            self._logger.info('[TIME TO CLOSE] %.3f sec\n%s',
+                              time_to_close, time_to_close_stats.histogram())
+        return OrderExecutionResult(
+            order_id=order_ids[-1] if order_ids else None,
+            amount=self._amount,
+            fulfilled_quantity=fulfilled_quantity,
+            order_ids=order_ids)
+
 
 async def _testing_coroutine(instrument_id):
     await singleton.order_book.ready
@@ -1,5 +1,5 @@
 import asyncio
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
 
 import logging
 
@@ -9,19 +9,31 @@ from . import constants, singleton
 class OrderListener:
     def __init__(self):
         logging.info('OrderListener initiated')
+        # Keyed by either exchange order_id (int) or client_oid (str).
         self._subscribers = defaultdict(set)
 
-        # There is no guarantee Websocket order notification always comes
-        # after REST API http responses (for the same order). The buffer makes
-        # sure no Websocket order notification is missed for the subscriber.
+        # Subscribers that pre-register by client_oid receive updates as soon
+        # as they arrive, even before the REST response reveals the order_id.
+        # For subscribers that only know the order_id there is no guarantee
+        # Websocket order notification always comes after REST API http
+        # responses (for the same order). The buffer makes sure no Websocket
+        # order notification is missed for such subscriber.
         self._buffer = defaultdict(list)
 
-    def subscribe(self, order_id, responder):
+        self._client_oid_to_order_id = {}
+        self._order_id_to_client_oid = {}
+
+        # Last update of recently ended orders, in the format of
+        # RestApiV3.get_order_info, so reports don't need to query them.
+        self._final_order_info = OrderedDict()
+
+    def subscribe(self, order_id, responder, client_oid=None):
         """
-        :param order_id:
+        :param order_id: exchange order id, can be None if it is not known yet
+                         (i.e. pre-registration before the order is placed)
         :param responder: responder needs to implement:
                       order_pending(order_id)
-                      order_cancelled(order_id)
+                      order_cancelled(order_id, filled_qty)
                       order_fulfilled(order_id,
                                       size,
                                       filled_qty,
@@ -31,20 +43,38 @@ class OrderListener:
                       order_partially_filled(order_id,
                                              size,
                                              filled_qty)
+        :param client_oid: the order ID customized by client side
         :return: None
         """
-        order_id = int(order_id)
+        assert order_id is not None or client_oid is not None
         assert hasattr(responder, 'order_pending')
         assert hasattr(responder, 'order_cancelled')
         assert hasattr(responder, 'order_fulfilled')
         assert hasattr(responder, 'order_partially_filled')
-        self._subscribers[order_id].add(responder)
-        self._dispatch_buffer(order_id)
-
-    def unsubscribe(self, order_id, responder):
-        self._subscribers[order_id].discard(responder)
-        if len(self._subscribers[order_id]) == 0:
-            del self._subscribers[order_id]
+        if order_id is not None:
+            order_id = int(order_id)
+            self._subscribers[order_id].add(responder)
+        if client_oid is not None:
+            self._subscribers[client_oid].add(responder)
+            if order_id is not None:
+                self._bind(client_oid, order_id)
+            order_id = self._client_oid_to_order_id.get(client_oid, None)
+        if order_id is not None:
+            self._dispatch_buffer(order_id)
+
+    def unsubscribe(self, order_id, responder, client_oid=None):
+        keys = [client_oid]
+        if order_id is not None:
+            keys.append(int(order_id))
+        for key in keys:
+            if key not in self._subscribers:
+                continue
+            self._subscribers[key].discard(responder)
+            if len(self._subscribers[key]) == 0:
+                del self._subscribers[key]
+        if client_oid is not None and client_oid not in self._subscribers:
+            bound_order_id = self._client_oid_to_order_id.pop(client_oid, None)
+            self._order_id_to_client_oid.pop(bound_order_id, None)
 
     def received_futures_order(self,
                                leverage,
@@ -58,11 +88,23 @@ class OrderListener:
                                instrument_id,
                                order_id,
                                timestamp,
-                               status):
+                               status,
+                               client_oid=None):
         order_id = int(order_id)
+        # Updates after unsubscribe must not re-add a binding nobody removes.
+        if client_oid and client_oid in self._subscribers:
+            self._bind(client_oid, order_id)
+        if status in (constants.ORDER_STATUS_CODE__CANCELLED,
+                      constants.ORDER_STATUS_CODE__FULFILLED):
+            self._remember_final_order_info(
+                order_id, leverage=leverage, size=size, filled_qty=filled_qty,
+                price=price, fee=fee, contract_val=contract_val,
+                price_avg=price_avg, type=type, instrument_id=instrument_id,
+                timestamp=timestamp, status=status)
         if status == constants.ORDER_STATUS_CODE__CANCELLED:
             self._buffer[order_id].append(
-                lambda responder: responder.order_cancelled(order_id)
+                lambda responder: responder.order_cancelled(order_id,
+                                                            filled_qty)
             )
         elif status == constants.ORDER_STATUS_CODE__PENDING:
             self._buffer[order_id].append(
@@ -89,22 +131,45 @@ class OrderListener:
 
         self._dispatch_buffer(order_id)
 
+    def final_order_info(self, order_id):
+        """Order info of an ended order seen on the websocket, else None."""
+        return self._final_order_info.get(int(order_id), None)
+
+    def _remember_final_order_info(self, order_id, **order_info):
+        order_info['order_id'] = order_id
+        self._final_order_info[order_id] = order_info
+        self._final_order_info.move_to_end(order_id)
+        while len(self._final_order_info) > constants.ORDER_INFO_CACHE_SIZE:
+            self._final_order_info.popitem(last=False)
+
+    def _bind(self, client_oid, order_id):
+        self._client_oid_to_order_id[client_oid] = order_id
+        self._order_id_to_client_oid[order_id] = client_oid
+
+    def _responders(self, order_id):
+        responders = set(self._subscribers.get(order_id, ()))
+        client_oid = self._order_id_to_client_oid.get(order_id, None)
+        if client_oid is not None:
+            responders |= self._subscribers.get(client_oid, set())
+        return responders
+
     def _dispatch_buffer(self, order_id):
-        if len(self._subscribers[order_id]) == 0:
+        responders = self._responders(order_id)
+        if len(responders) == 0:
             return
 
-        for func in self._buffer[order_id]:
-            for responder in self._subscribers[order_id]:
+        for func in self._buffer.pop(order_id, []):
+            for responder in responders:
                 func(responder)
-        self._buffer[order_id].clear()
 
 
 class MockTrader:
     def order_pending(self, order_id):
         logging.info('order_pending: %s', order_id)
 
-    def order_cancelled(self, order_id):
-        logging.info('order_cancelled: %s', order_id)
+    def order_cancelled(self, order_id, filled_qty):
+        logging.info('order_cancelled: %s, filled_qty: %s',
+                     order_id, filled_qty)
 
     def order_fulfilled(self,
                         order_id,
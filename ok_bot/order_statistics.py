@@ -0,0 +1,196 @@
+import math
+import random
+from collections import deque
+
+
+class _Node:
+    __slots__ = ('value', 'next', 'width')
+
+    def __init__(self, value, levels):
+        self.value = value
+        self.next = [None] * levels
+        self.width = [1] * levels
+
+
+class IndexableSkipList:
+    """Sorted multiset with O(log n) insert, remove, index and rank.
+
+    Every link stores how many elements it skips, so the i-th smallest
+    element and the rank of a value are found by walking down the levels.
+    """
+    def __init__(self, expected_size=1 << 16):
+        self._max_levels = max(1, int(math.log2(expected_size)) + 1)
+        self._head = _Node(None, self._max_levels)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self._size
+        if not 0 <= i < self._size:
+            raise IndexError(i)
+        node = self._head
+        i += 1
+        for level in reversed(range(self._max_levels)):
+            while node.next[level] is not None and node.width[level] <= i:
+                i -= node.width[level]
+                node = node.next[level]
+        return node.value
+
+    def __iter__(self):
+        node = self._head.next[0]
+        while node is not None:
+            yield node.value
+            node = node.next[0]
+
+    def rank(self, value):
+        """Number of elements strictly smaller than value."""
+        node = self._head
+        rank = 0
+        for level in reversed(range(self._max_levels)):
+            while node.next[level] is not None and \
+                    node.next[level].value < value:
+                rank += node.width[level]
+                node = node.next[level]
+        return rank
+
+    def insert(self, value):
+        levels = min(self._max_levels,
+                     1 - int(math.log2(random.random() or 0.5)))
+        chain = [None] * self._max_levels
+        steps = [0] * self._max_levels
+        node = self._head
+        for level in reversed(range(self._max_levels)):
+            while node.next[level] is not None and \
+                    node.next[level].value <= value:
+                steps[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+
+        new_node = _Node(value, levels)
+        skipped = 0
+        for level in range(levels):
+            prev = chain[level]
+            new_node.next[level] = prev.next[level]
+            prev.next[level] = new_node
+            new_node.width[level] = prev.width[level] - skipped
+            prev.width[level] = skipped + 1
+            skipped += steps[level]
+        for level in range(levels, self._max_levels):
+            chain[level].width[level] += 1
+        self._size += 1
+
+    def remove(self, value):
+        """Removes one occurrence of value, raises ValueError if missing."""
+        chain = [None] * self._max_levels
+        node = self._head
+        for level in reversed(range(self._max_levels)):
+            while node.next[level] is not None and \
+                    node.next[level].value < value:
+                node = node.next[level]
+            chain[level] = node
+        target = chain[0].next[0]
+        if target is None or target.value != value:
+            raise ValueError(f'{value} not in list')
+
+        for level in range(len(target.next)):
+            prev = chain[level]
+            prev.width[level] += target.width[level] - 1
+            prev.next[level] = target.next[level]
+        for level in range(len(target.next), self._max_levels):
+            chain[level].width[level] -= 1
+        self._size -= 1
+
+
+class RollingOrderStatistics:
+    """Order statistics of the samples of the last time_window_sec seconds.
+
+    add() and the eviction of expired samples are O(log n), quantile() and
+    rank() are O(log n) and min()/max() are O(1) with monotonic deques.
+    Timestamps are seconds and must not decrease.
+    """
+    def __init__(self, time_window_sec):
+        self.time_window_sec = time_window_sec
+        self._samples = deque()  # (timestamp, value), oldest first
+        self._sorted = IndexableSkipList()
+        self._min = deque()  # increasing values
+        self._max = deque()  # decreasing values
+
+    def __len__(self):
+        return len(self._samples)
+
+    def add(self, timestamp, value):
+        self._samples.append((timestamp, value))
+        self._sorted.insert(value)
+        while self._min and self._min[-1][1] > value:
+            self._min.pop()
+        self._min.append((timestamp, value))
+        while self._max and self._max[-1][1] < value:
+            self._max.pop()
+        self._max.append((timestamp, value))
+        self.evict(timestamp - self.time_window_sec)
+
+    def evict(self, oldest_timestamp):
+        """Drops samples older than oldest_timestamp."""
+        while self._samples and self._samples[0][0] < oldest_timestamp:
+            _, value = self._samples.popleft()
+            self._sorted.remove(value)
+        while self._min and self._min[0][0] < oldest_timestamp:
+            self._min.popleft()
+        while self._max and self._max[0][0] < oldest_timestamp:
+            self._max.popleft()
+
+    def quantile(self, q):
+        """Linear interpolation between closest ranks, same as numpy."""
+        if not self._samples:
+            return math.nan
+        position = q * (len(self._sorted) - 1)
+        lower = int(math.floor(position))
+        lower_value = self._sorted[lower]
+        if lower == position:
+            return lower_value
+        upper_value = self._sorted[lower + 1]
+        return lower_value + (upper_value - lower_value) * (position - lower)
+
+    def median(self):
+        return self.quantile(0.5)
+
+    def rank(self, value):
+        """Fraction of samples strictly smaller than value."""
+        if not self._samples:
+            return math.nan
+        return self._sorted.rank(value) / len(self._sorted)
+
+    def min(self):
+        return self._min[0][1] if self._min else math.nan
+
+    def max(self):
+        return self._max[0][1] if self._max else math.nan
+
+
+def _benchmark():
+    import timeit
+    import numpy as np
+    window = 10000
+    stats = RollingOrderStatistics(time_window_sec=window)
+    samples = np.random.normal(0, 1, 5 * window).tolist()
+    for t, x in enumerate(samples[:window]):
+        stats.add(t, x)
+    i = [window]
+
+    def add():
+        stats.add(i[0], samples[i[0]])
+        i[0] += 1
+
+    number = 2 * window
+    print(f'add+evict: {timeit.timeit(add, number=number) / number * 1e6:.1f}'
+          f' us with {len(stats)} samples')
+    print(f'median: {timeit.timeit(stats.median, number=number) / number * 1e6:.1f} us')
+    print(f'numpy median: '
+          f'{timeit.timeit(lambda: np.median(samples[:window]), number=100) / 100 * 1e6:.1f} us')
+
+
+if __name__ == '__main__':
+    _benchmark()
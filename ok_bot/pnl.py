@@ -0,0 +1,279 @@
+"""Offline PnL and slippage of many transactions at once.
+
+Same metrics as report.get_order_gain and report.get_price_slippage, but
+computed on columns of all orders loaded from the DB instead of row by row.
+
+python -m ok_bot.pnl --db=prod.db --start=2019-03-01 --end=2019-03-31
+"""
+import argparse
+import calendar
+import datetime
+import sqlite3
+import time
+
+import numpy as np
+import pandas as pd
+
+from . import constants
+from .accounting import parse_date
+from .report import ORDER_TYPE_TO_STRING
+
+# USD value of a contract, as trans.sql assumes when the instrument is
+# unknown. OKEX BTC futures are 100 USD per contract.
+DEFAULT_CONTRACT_VAL = 10
+_CONTRACT_VAL_BY_CURRENCY = {'BTC': 100}
+
+_TRANSACTIONS_SQL = '''
+    SELECT
+        rowid
+        , transaction_id
+        , COALESCE(slow_instrument_id, '')
+        , COALESCE(fast_instrument_id, '')
+        , COALESCE(strategy, '')
+        , status
+        , start_time_sec
+        , end_time_sec
+        , COALESCE(estimate_net_profit, 'nan')
+    FROM runtime_transactions
+    WHERE start_time_sec >= :start AND start_time_sec < :end
+    ORDER BY rowid
+'''
+
+_ORDERS_SQL = '''
+    SELECT
+        T.rowid
+        , O.order_id
+        , O.type
+        , O.filled_qty
+        , O.price
+        , O.price_avg
+        , COALESCE(O.fee, 0)
+    FROM runtime_transactions T
+    JOIN runtime_orders O
+    ON O.transaction_id = T.transaction_id
+    WHERE T.start_time_sec >= :start AND T.start_time_sec < :end
+      AND O.filled_qty > 0 AND O.price_avg > 0
+'''
+
+
+def _columns(rows, dtypes):
+    """List of row tuples to a dict of name -> numpy array."""
+    values = list(zip(*rows)) or [()] * len(dtypes)
+    return {name: np.array(column, dtype=dtype)
+            for (name, dtype), column in zip(dtypes, values)}
+
+
+def _numeric_columns(rows, dtypes):
+    """Same as _columns for numbers only, converted in one go."""
+    table = np.array(rows, dtype='float64').reshape(-1, len(dtypes))
+    return {name: table[:, i].astype(dtype)
+            for i, (name, dtype) in enumerate(dtypes)}
+
+
+def load(conn, start_sec, end_sec):
+    """Transactions started within [start_sec, end_sec) and their filled
+    orders, as (transactions, orders) dicts of aligned numpy arrays."""
+    params = {'start': start_sec, 'end': end_sec}
+    transactions = _columns(conn.execute(_TRANSACTIONS_SQL, params), [
+        ('rowid', 'int64'),
+        ('transaction_id', object),
+        ('slow_instrument_id', object),
+        ('fast_instrument_id', object),
+        ('strategy', object),
+        ('status', object),
+        ('start_time_sec', 'float64'),
+        ('end_time_sec', 'float64'),
+        ('estimate_net_profit', 'float64'),
+    ])
+    # Order ids are below 2**53 so they survive the float64 round trip.
+    orders = _numeric_columns(conn.execute(_ORDERS_SQL, params).fetchall(), [
+        ('transaction_rowid', 'int64'),
+        ('order_id', 'int64'),
+        ('type', 'int64'),
+        ('filled_qty', 'int64'),
+        ('price', 'float64'),
+        ('price_avg', 'float64'),
+        ('fee', 'float64'),
+    ])
+    # Position of each order's transaction, transactions are sorted by rowid.
+    orders['transaction_index'] = np.searchsorted(
+        transactions['rowid'], orders['transaction_rowid'])
+    orders['transaction_id'] = \
+        transactions['transaction_id'][orders['transaction_index']]
+    return transactions, orders
+
+
+def contract_vals(instrument_ids):
+    currencies = np.array([i.split('-')[0] for i in instrument_ids],
+                          dtype=object)
+    vals = np.full(len(currencies), DEFAULT_CONTRACT_VAL, dtype='float64')
+    for currency, val in _CONTRACT_VAL_BY_CURRENCY.items():
+        vals[currencies == currency] = val
+    return vals
+
+
+def order_metrics(transactions, orders):
+    """Adds gain, slippage, direction and leg columns to orders.
+
+    The slow leg opens first, so the open order with the smallest id is the
+    slow open. A close belongs to the leg that opened the same side.
+    """
+    index = orders['transaction_index']
+    order_type = orders['type']
+    # Sells: negative coin delta and a higher price is a better price.
+    sign = np.where((order_type == constants.ORDER_TYPE_CODE__CLOSE_LONG) |
+                    (order_type == constants.ORDER_TYPE_CODE__OPEN_SHORT),
+                    -1.0, 1.0)
+    contract_val = contract_vals(transactions['slow_instrument_id'])[index]
+    orders['gain'] = (sign * orders['filled_qty'] * contract_val /
+                      orders['price_avg'] + orders['fee'])
+    orders['slippage'] = (sign * (orders['price_avg'] - orders['price']) /
+                          orders['price'])
+    types, type_index = np.unique(order_type, return_inverse=True)
+    orders['direction'] = np.array(
+        [ORDER_TYPE_TO_STRING.get(t, str(t)) for t in types.tolist()],
+        dtype=object)[type_index]
+
+    is_open = ((order_type == constants.ORDER_TYPE_CODE__OPEN_LONG) |
+               (order_type == constants.ORDER_TYPE_CODE__OPEN_SHORT))
+    by_first_open = np.lexsort((orders['order_id'], ~is_open, index))
+    first = np.ones(len(index), dtype=bool)
+    first[1:] = index[by_first_open][1:] != index[by_first_open][:-1]
+    slow_open_type = np.zeros(len(transactions['transaction_id']),
+                              dtype='int64')
+    slow_open_type[index[by_first_open][first]] = \
+        order_type[by_first_open][first]
+    # Close long/short is the open type + 2.
+    same_side = (order_type - 1) % 2 == (slow_open_type[index] - 1) % 2
+    orders['leg'] = np.where(same_side, 'slow', 'fast').astype(object)
+    return orders
+
+
+def transaction_metrics(transactions, orders):
+    """Adds per transaction sums of the order metrics and hold time."""
+    num = len(transactions['transaction_id'])
+    index = orders['transaction_index']
+    transactions['num_orders'] = np.bincount(index, minlength=num)
+    for column in ('gain', 'fee', 'slippage'):
+        transactions[column] = np.bincount(index, weights=orders[column],
+                                           minlength=num)
+    transactions['estimate_error'] = (transactions['gain'] -
+                                      transactions['estimate_net_profit'])
+    transactions['hold_time_sec'] = (transactions['end_time_sec'] -
+                                     transactions['start_time_sec'])
+    transactions['pair'] = np.array(
+        [f'{slow}/{fast}' for slow, fast in zip(
+            transactions['slow_instrument_id'],
+            transactions['fast_instrument_id'])], dtype=object)
+    # UTC hour the transaction started.
+    transactions['hour'] = np.datetime_as_string(
+        (transactions['start_time_sec'] * 1e6).astype('datetime64[us]'),
+        unit='h').astype(object)
+    return transactions
+
+
+def aggregate(table, keys, metrics):
+    """Groups rows by the key columns.
+
+    metrics: {output name: (column, 'sum' | 'mean')}, the group size is
+    always added as 'count'. Returns a dict of numpy arrays.
+    """
+    if not len(table[keys[0]]):
+        return {name: np.array([])
+                for name in keys + ['count'] + list(metrics)}
+    # Combine the codes of each key into one integer code per row.
+    code = np.zeros(len(table[keys[0]]), dtype='int64')
+    for key in keys:
+        uniques, key_code = np.unique(table[key].astype(str),
+                                      return_inverse=True)
+        code = code * len(uniques) + key_code.reshape(-1)
+    groups, first, inverse = np.unique(code, return_index=True,
+                                       return_inverse=True)
+    inverse = inverse.reshape(-1)
+    counts = np.bincount(inverse)
+    result = {key: table[key][first] for key in keys}
+    result['count'] = counts
+    for name, (column, how) in metrics.items():
+        values = np.asarray(table[column], dtype='float64')
+        valid = ~np.isnan(values)
+        sums = np.bincount(inverse[valid], weights=values[valid],
+                           minlength=len(groups))
+        if how == 'mean':
+            sums = sums / np.maximum(
+                np.bincount(inverse[valid], minlength=len(groups)), 1)
+        result[name] = sums
+    return result
+
+
+_TRANSACTION_SUMMARY = {
+    'gain': ('gain', 'sum'),
+    'mean_gain': ('gain', 'mean'),
+    'win_rate': ('is_win', 'mean'),
+    'fee': ('fee', 'sum'),
+    'slippage': ('slippage', 'mean'),
+    'estimate_error': ('estimate_error', 'mean'),
+    'hold_time_sec': ('hold_time_sec', 'mean'),
+}
+
+_ORDER_SUMMARY = {
+    'slippage': ('slippage', 'mean'),
+    'fee': ('fee', 'sum'),
+    'filled_qty': ('filled_qty', 'sum'),
+}
+
+
+def summarize(conn, start_sec, end_sec, group_by=('pair', 'hour',
+                                                   'strategy')):
+    """Summary tables as {title: pandas.DataFrame}."""
+    transactions, orders = load(conn, start_sec, end_sec)
+    orders = order_metrics(transactions, orders)
+    transactions = transaction_metrics(transactions, orders)
+    transactions['is_win'] = (transactions['gain'] > 0).astype('float64')
+
+    tables = {}
+    for key in group_by:
+        tables[f'by {key}'] = aggregate(transactions, [key],
+                                        _TRANSACTION_SUMMARY)
+    tables['slippage by leg and order type'] = aggregate(
+        orders, ['leg', 'direction'], _ORDER_SUMMARY)
+    return {title: pd.DataFrame(table) for title, table in tables.items()}
+
+
+def date_range_sec(start, end):
+    """[start_sec, end_sec) of the UTC days from start to end date strings,
+    the whole month or year if end is one."""
+    start_sec = calendar.timegm(parse_date(start).timetuple())
+    end_sec = calendar.timegm(
+        (parse_date(end, end=True) + datetime.timedelta(days=1)).timetuple())
+    return start_sec, end_sec
+
+
+def main():
+    args = argparse.ArgumentParser(
+        description='PnL and slippage across transactions')
+    args.add_argument('--db', default='prod.db', help='Sqlite3 DB file')
+    args.add_argument('--start', help='Start UTC date string, e.x. 2019-03-01',
+                      required=True)
+    args.add_argument('--end', help='End UTC date string, e.x. 2019-03-31',
+                      default=datetime.datetime.utcnow().strftime('%Y-%m-%d'))
+    args.add_argument('--group-by', nargs='+',
+                      choices=['pair', 'hour', 'strategy', 'status'],
+                      default=['pair', 'hour', 'strategy'])
+    args = args.parse_args()
+
+    start = time.time()
+    start_sec, end_sec = date_range_sec(args.start, args.end)
+    conn = sqlite3.connect(f'file:{args.db}?mode=ro', uri=True)
+    tables = summarize(conn, start_sec, end_sec, args.group_by)
+    conn.close()
+    with pd.option_context('display.max_rows', None,
+                           'display.width', 200):
+        for title, table in tables.items():
+            print(f'=== {title} ===')
+            print(table.to_string(index=False))
+            print()
+    print(f'{time.time() - start:.3f} sec')
+
+
+if __name__ == '__main__':
+    main()
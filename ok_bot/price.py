@@ -0,0 +1,162 @@
+import functools
+
+import numpy as np
+
+
+@functools.lru_cache(maxsize=None)
+def _scale(tick_size):
+    """Ticks per unit of price, tick_size must be 1/n for an integer n."""
+    tick_size = float(tick_size)
+    scale = round(1 / tick_size) if tick_size > 0 else 0
+    if scale < 1 or abs(scale * tick_size - 1) > 1e-9:
+        raise ValueError(f'tick size {tick_size} is not 1/n for an integer n')
+    return scale
+
+
+class Price:
+    """Exact price as an integer number of ticks.
+
+    scale is the number of ticks per unit of price (1 / tick_size). Prices of
+    the same scale add, subtract and compare as plain ints. Any other operand,
+    or multiplication and division, falls back to float arithmetic in price
+    units, so Price can be used wherever a float price is expected.
+    """
+    __slots__ = ('ticks', 'scale')
+
+    def __init__(self, ticks, scale):
+        self.ticks = ticks
+        self.scale = scale
+
+    @classmethod
+    def from_real(cls, value, tick_size):
+        """Round value (str, float, int or Decimal) to the tick grid.
+
+        Raises ValueError unless tick_size is 1/n for an integer n, as all
+        OKEX futures tick sizes are.
+        """
+        scale = _scale(tick_size)
+        return cls(round(float(value) * scale), scale)
+
+    @property
+    def tick_size(self):
+        return 1 / self.scale
+
+    @staticmethod
+    def ticks_array(prices):
+        """int64 array of ticks of prices that share the same scale."""
+        return np.fromiter((price.ticks for price in prices),
+                           dtype=np.int64, count=len(prices))
+
+    def __float__(self):
+        # Correctly rounded, so it's the same float as the decimal string.
+        return self.ticks / self.scale
+
+    def __str__(self):
+        return repr(self.ticks / self.scale)
+
+    __repr__ = __str__
+
+    def __format__(self, format_spec):
+        return format(self.ticks / self.scale, format_spec)
+
+    def to_json(self):
+        return str(self)
+
+    def __hash__(self):
+        return hash(self.ticks / self.scale)
+
+    def __bool__(self):
+        return self.ticks != 0
+
+    def __neg__(self):
+        return Price(-self.ticks, self.scale)
+
+    def __pos__(self):
+        return self
+
+    def __abs__(self):
+        return Price(abs(self.ticks), self.scale)
+
+    def __add__(self, other):
+        if type(other) is Price and other.scale == self.scale:
+            return Price(self.ticks + other.ticks, self.scale)
+        return self.ticks / self.scale + other
+
+    def __radd__(self, other):
+        return other + self.ticks / self.scale
+
+    def __sub__(self, other):
+        if type(other) is Price and other.scale == self.scale:
+            return Price(self.ticks - other.ticks, self.scale)
+        return self.ticks / self.scale - other
+
+    def __rsub__(self, other):
+        return other - self.ticks / self.scale
+
+    def __mul__(self, other):
+        return self.ticks / self.scale * other
+
+    def __rmul__(self, other):
+        return other * (self.ticks / self.scale)
+
+    def __truediv__(self, other):
+        return self.ticks / self.scale / other
+
+    def __rtruediv__(self, other):
+        return other / (self.ticks / self.scale)
+
+    def __eq__(self, other):
+        if type(other) is Price and other.scale == self.scale:
+            return self.ticks == other.ticks
+        return self.ticks / self.scale == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __lt__(self, other):
+        if type(other) is Price and other.scale == self.scale:
+            return self.ticks < other.ticks
+        return self.ticks / self.scale < other
+
+    def __le__(self, other):
+        if type(other) is Price and other.scale == self.scale:
+            return self.ticks <= other.ticks
+        return self.ticks / self.scale <= other
+
+    def __gt__(self, other):
+        if type(other) is Price and other.scale == self.scale:
+            return self.ticks > other.ticks
+        return self.ticks / self.scale > other
+
+    def __ge__(self, other):
+        if type(other) is Price and other.scale == self.scale:
+            return self.ticks >= other.ticks
+        return self.ticks / self.scale >= other
+
+
+def _benchmark():
+    import timeit
+    from .quant import Quant
+    number = 100000
+    raw = '3635.11'
+    quant_a, quant_b = Quant(raw), Quant('3634.87')
+    price_a = Price.from_real(raw, 0.01)
+    price_b = Price.from_real('3634.87', 0.01)
+    cases = [
+        ('parse', lambda: Quant(raw), lambda: Price.from_real(raw, 0.01)),
+        ('subtract', lambda: quant_a - quant_b, lambda: price_a - price_b),
+        ('compare', lambda: quant_a < quant_b, lambda: price_a < price_b),
+        ('subtract float', lambda: quant_a - 0.5, lambda: price_a - 0.5),
+        ('multiply float', lambda: quant_a * 1.0004,
+         lambda: price_a * 1.0004),
+        ('to str', lambda: str(quant_a), lambda: str(price_a)),
+    ]
+    for name, quant_case, price_case in cases:
+        quant_sec = timeit.timeit(quant_case, number=number) / number
+        price_sec = timeit.timeit(price_case, number=number) / number
+        print(f'{name:15s}: Quant {quant_sec * 1e9:7.0f} ns, '
+              f'Price {price_sec * 1e9:7.0f} ns')
+
+
+if __name__ == '__main__':
+    _benchmark()
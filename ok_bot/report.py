@@ -1,6 +1,7 @@
-import pandas as pd
+import asyncio
 
 from . import constants, singleton
+from .logger import Deferred
 
 ORDER_TYPE_TO_STRING = {
     constants.ORDER_TYPE_CODE__OPEN_LONG: 'long+',
@@ -27,6 +28,90 @@ def get_price_slippage(order):
     return val
 
 
+class OrderRecord:
+    """Final state of one order of a transaction, in plain numbers.
+
+    Supports record['column'] so get_order_gain and get_price_slippage work
+    on it as on a table row.
+    """
+    __slots__ = ('name', 'order_id', 'instrument_id', 'type', 'status',
+                 'size', 'filled_qty', 'price', 'price_avg', 'fee',
+                 'contract_val', 'leverage', 'timestamp', 'original_price',
+                 'gain', 'slippage')
+    COLUMNS = ('order_id', 'instrument_id', 'type', 'status', 'size',
+               'filled_qty', 'price', 'price_avg', 'fee', 'contract_val',
+               'leverage', 'timestamp', 'original_price', 'direction',
+               'gain', 'slippage')
+
+    def __init__(self, name, order_info, original_price):
+        """order_info: as returned by get_order_info, values may be str."""
+        self.name = name
+        self.order_id = int(order_info['order_id'])
+        self.instrument_id = order_info['instrument_id']
+        self.type = int(order_info['type'])
+        self.status = int(order_info['status'])
+        self.size = int(order_info['size'])
+        self.filled_qty = int(order_info['filled_qty'])
+        self.price = float(order_info['price'])
+        self.price_avg = float(order_info['price_avg'])
+        self.fee = float(order_info['fee'])
+        self.contract_val = int(order_info['contract_val'])
+        self.leverage = int(order_info['leverage'])
+        self.timestamp = order_info['timestamp']
+        self.original_price = float(original_price)
+        self.gain = get_order_gain(self)
+        self.slippage = get_price_slippage(self)
+
+    def __getitem__(self, column):
+        return getattr(self, column)
+
+    @property
+    def direction(self):
+        return ORDER_TYPE_TO_STRING[self.type]
+
+
+def _orders_table(records):
+    import pandas as pd
+    return pd.DataFrame(
+        [[record[column] for column in OrderRecord.COLUMNS]
+         for record in records.values()],
+        index=list(records),
+        columns=OrderRecord.COLUMNS)
+
+
+class ReportSnapshot(Deferred):
+    """Report.__str__ of the orders and prices known at log time, the
+    pandas table is only built when a logging thread renders it."""
+    def __init__(self, report):
+        self.records = dict(report.records)
+        self.prices = {
+            'slow_open': list(report.slow_open_prices),
+            'slow_close': list(report.slow_close_prices),
+            'fast_open': list(report.fast_open_prices),
+            'fast_close': list(report.fast_close_prices),
+        }
+
+    def render(self):
+        if not self.records:
+            return '[no orders]'
+        slippage = sum(record.slippage for record in self.records.values())
+        ret = ''
+        ret += f'slippage: {slippage * 100:.3f}%\n'
+        for name, label in [('slow_open', 'slow+'),
+                            ('slow_close', 'slow-'),
+                            ('fast_open', 'fast+'),
+                            ('fast_close', 'fast-')]:
+            prices = self.prices[name]
+            if prices and name in self.records:
+                ret += '{} {:6} {} -> {}\n'.format(
+                    label,
+                    self.records[name].direction,
+                    prices,
+                    self.records[name].price_avg)
+        ret += _orders_table(self.records).to_string()
+        return ret
+
+
 class Report:
     def __init__(self,
                  transaction_id,
@@ -41,122 +126,95 @@ class Report:
         self.fast_instrument_id = fast_instrument_id
         self.fast_open_order_id = None
         self.fast_close_order_id = None
+        # Additional fast open orders from incremental hedging.
+        self.fast_open_hedge_order_ids = []
 
         self.slow_open_prices = []
         self.fast_open_prices = []
         self.slow_close_prices = []
         self.fast_close_prices = []
 
-        # Result table
-        self.table = pd.DataFrame()
+        # Result orders, OrderRecord by name ('slow_open' etc.)
+        self.records = {}
+
+    def snapshot(self):
+        """Log argument showing the report as of now, rendered later."""
+        return ReportSnapshot(self)
 
     def __str__(self):
-        if self.table.empty:
-            return '[no orders]'
-        ret = ''
-        ret += f'slippage: {self.slippage * 100:.3f}%\n'
-        if self.slow_open_prices:
-            ret += 'slow+ {:6} {} -> {}\n'.format(
-                self.table.loc['slow_open']['direction'],
-                self.slow_open_prices,
-                self.table.loc['slow_open']['price_avg'])
-        if self.slow_close_prices:
-            ret += 'slow- {:6} {} -> {}\n'.format(
-                self.table.loc['slow_close']['direction'],
-                self.slow_close_prices,
-                self.table.loc['slow_close']['price_avg'])
-        if self.fast_open_prices:
-            ret += 'fast+ {:6} {} -> {}\n'.format(
-                self.table.loc['fast_open']['direction'],
-                self.fast_open_prices,
-                self.table.loc['fast_open']['price_avg'])
-        if self.fast_close_prices:
-            ret += 'fast- {:6} {} -> {}\n'.format(
-                self.table.loc['fast_close']['direction'],
-                self.fast_close_prices,
-                self.table.loc['fast_close']['price_avg'])
-        ret += self.table.to_string()
-        return ret
+        return str(self.snapshot())
+
+    @property
+    def table(self):
+        """The orders as a pandas table, only built for humans."""
+        return _orders_table(self.records)
 
     @property
     def slippage(self):
-        if self.table.empty:
-            return 0
-        return self.table['slippage'].sum()
+        return sum(record.slippage for record in self.records.values())
 
     async def report_profit(self):
         """Returns the net profit (in unit of coins)"""
+        lookups = []
         if self.slow_open_order_id:
-            order_info = await self._retrieve_order_info_and_log_to_db(
-                'slow_open',
-                self.slow_open_order_id,
-                self.slow_instrument_id)
-            order_info['original_price'] = self.slow_open_prices[0]
-            self.table = self.table.append(order_info)
+            lookups.append(('slow_open', self.slow_open_order_id,
+                            self.slow_instrument_id, self.slow_open_prices))
         if self.slow_close_order_id:
-            order_info = await self._retrieve_order_info_and_log_to_db(
-                'slow_close',
-                self.slow_close_order_id,
-                self.slow_instrument_id)
-            order_info['original_price'] = self.slow_close_prices[0]
-            self.table = self.table.append(order_info)
+            lookups.append(('slow_close', self.slow_close_order_id,
+                            self.slow_instrument_id, self.slow_close_prices))
         if self.fast_open_order_id:
-            order_info = await self._retrieve_order_info_and_log_to_db(
-                'fast_open',
-                self.fast_open_order_id,
-                self.fast_instrument_id)
-            order_info['original_price'] = self.fast_open_prices[0]
-            self.table = self.table.append(order_info)
+            lookups.append(('fast_open', self.fast_open_order_id,
+                            self.fast_instrument_id, self.fast_open_prices))
+        for i, order_id in enumerate(self.fast_open_hedge_order_ids):
+            lookups.append((f'fast_open_{i + 1}', order_id,
+                            self.fast_instrument_id, self.fast_open_prices))
         if self.fast_close_order_id:
-            order_info = await self._retrieve_order_info_and_log_to_db(
-                'fast_close',
-                self.fast_close_order_id,
-                self.fast_instrument_id)
-            order_info['original_price'] = self.fast_close_prices[0]
-            self.table = self.table.append(order_info)
-
-        if len(self.table) == 0:
+            lookups.append(('fast_close', self.fast_close_order_id,
+                            self.fast_instrument_id, self.fast_close_prices))
+
+        order_infos = await asyncio.gather(*[
+            self._retrieve_order_info_and_log_to_db(order_id, instrument_id)
+            for _, order_id, instrument_id, _ in lookups])
+        self.records = {
+            name: OrderRecord(name, order_info, prices[0])
+            for (name, _, _, prices), order_info in zip(lookups, order_infos)}
+
+        if len(self.records) == 0:
             self.logger.info('[REPORT] empty transaction')
             return 0
 
-        self.table['contract_val'] = self.table['contract_val'].astype('int64')
-        self.table['fee'] = self.table['fee'].astype('float64')
-        self.table['filled_qty'] = self.table['filled_qty'].astype('int64')
-        self.table['leverage'] = self.table['leverage'].astype('int64')
-        self.table['price'] = self.table['price'].astype('float64')
-        self.table['price_avg'] = self.table['price_avg'].astype('float64')
-        self.table['status'] = self.table['status'].astype('int64')
-        self.table['type'] = self.table['type'].astype('int64')
-        self.table['direction'] = self.table.apply(
-            lambda order: ORDER_TYPE_TO_STRING[order['type']], axis=1)
-        self.table['gain'] = self.table.apply(get_order_gain, axis=1)
-        self.table['slippage'] = self.table.apply(get_price_slippage, axis=1)
-
-        all_types = set(self.table['type'])
+        # Hedge orders add up to the same position as a single fast open.
+        num_of_orders = len(self.records) - len(self.fast_open_hedge_order_ids)
+        all_types = set(record.type for record in self.records.values())
 
         two_opposite_orders = (
-            len(self.table) == 2 and (
+            num_of_orders == 2 and (
                 all_types == set([1, 3]) or all_types == set([2, 4])
             )
         )
 
         four_different_orders = (
-            len(self.table) == 4 and all_types == set([1, 2, 3, 4])
+            num_of_orders == 4 and all_types == set([1, 2, 3, 4])
         )
 
         if not two_opposite_orders and not four_different_orders:
             self.logger.critical('[REPORT] ORPHAN ORDERS!')
             raise RuntimeError('[REPORT] ORPHAN ORDERS!')
         else:
-            return self.table['gain'].sum()
+            return sum(record.gain for record in self.records.values())
 
     async def _retrieve_order_info_and_log_to_db(self,
-                                                 index,
                                                  order_id,
                                                  instrument_id):
-        """Returns as a pandas table(row)"""
-        ret = await singleton.rest_api.get_order_info(
-            order_id, instrument_id)
+        """Returns the order info dict.
+
+        Orders that ended while the websocket was listening are served from
+        the order listener, the others are looked up with the REST API.
+        """
+        ret = singleton.order_listener.final_order_info(order_id)
+        if ret is None:
+            ret = await singleton.rest_api.get_order_info(
+                order_id, instrument_id)
         assert int(order_id) == int(ret.get('order_id'))
         singleton.db.async_update_order(
             order_id=ret.get('order_id'),
@@ -171,4 +229,4 @@ class Report:
             type=ret.get('type'),
             timestamp=ret.get('timestamp')
         )
-        return pd.DataFrame(ret, index=[index])
+        return ret
@@ -5,14 +5,27 @@ import re
 import time
 from concurrent.futures import ThreadPoolExecutor
 
-from . import constants, singleton
+import requests
+
+from . import api_v3_key_reader, constants, singleton
+from .api_v3.okex_sdk.exceptions import OkexAPIException
 from .api_v3.okex_sdk.futures_api import FutureAPI
-from .api_v3_key_reader import API_KEY, KEY_SECRET, PASS_PHRASE
+from .price import Price
+
+
+# _order_id_by_client_oid() couldn't tell whether the order exists.
+_UNKNOWN = object()
+
+
+def _order_not_found(ex):
+    """Whether get_order_info failed because there is no such order."""
+    not_exist = constants.REST_API_ERROR_CODE__PENDING_ORDER_NOT_EXIST
+    return ex.status_code == 404 or str(ex.code) == str(not_exist)
 
 
 class RestApiV3:
     def __init__(self):
-        self.future_sdk = FutureAPI(API_KEY, KEY_SECRET, PASS_PHRASE)
+        self.future_sdk = FutureAPI(*api_v3_key_reader.read_keys())
 
         # If max_workers is None or not given, it will default to the number of
         # processors on the machine, multiplied by 5, assuming that
@@ -39,6 +52,11 @@ class RestApiV3:
                 ret.append(instrument['instrument_id'])
         return sorted(ret)
 
+    def get_tick_sizes_blocking(self, instrument_ids):
+        return {product['instrument_id']: float(product['tick_size'])
+                for product in self.future_sdk.get_products()
+                if product['instrument_id'] in instrument_ids}
+
     def _get_depth(self, instrument_id, size):
         size = int(size)
         try:
@@ -59,7 +77,9 @@ class RestApiV3:
         )
 
     def create_order(self, client_oid, instrument_id, order_type, amount, price,
-                     is_market_order=False, leverage=20):
+                     is_market_order=False,
+                     execution_type=constants.ORDER_EXECUTION_TYPE__NORMAL,
+                     leverage=20):
         """
         :param client_oid: the order ID customized by client side
         :param instrument_id: for example: "TC-USD-180213"
@@ -67,6 +87,8 @@ class RestApiV3:
         :param amount:
         :param price:
         :param is_market_order: place market order if True, price will be ignored for market orders
+        :param execution_type: 0:normal 1:post only 2:fill or kill
+                               3:immediate or cancel
         :param leverage: 10 or 20
         :return: Order ID and None if success, None and OKEX error code
                  otherwise(https://www.okex.com/docs/en/#error-Error_Code)
@@ -74,8 +96,15 @@ class RestApiV3:
         Note:
         * Market order is supported by API V3 in match_price parameter
         * price, amount etc can be int or str, they are all converted to string before being used to compose the
-          request URL
+          request URL. price is rounded to the instrument's tick size first
         * Limit: 40 times / 2s
+        * When client_oid is given, placement is retried on transport errors.
+          Before each retry, and when a retry is rejected (OKEX rejects a
+          duplicated client_oid, so the first request may have landed),
+          the order is looked up by client_oid until OKEX says whether it
+          exists. Failure is only returned for an order known not to exist,
+          when the lookup gives up the error code is
+          REST_API_ERROR_CODE__ORDER_STATE_UNKNOWN.
         """
         assert not is_market_order,\
             "Market order in OKEX is always inferior to limit order " \
@@ -83,25 +112,89 @@ class RestApiV3:
         # amount must be integer otherwise OKEX will
         # complain about 'illegal parameter'
         amount = int(amount)
-        try:
-            resp = self.future_sdk.take_order(
-                client_oid,
-                instrument_id,
-                order_type,
-                price,
-                amount,
-                match_price=1 if is_market_order else 0,
-                leverage=leverage)
-            if resp['result'] is True and resp['order_id'] != '-1':
-                return int(resp['order_id']), None
-            else:
+        # Prices stay Price or float until here, OKEX takes them on the tick
+        # grid.
+        price = str(Price.from_real(
+            price, singleton.schema.tick_size(instrument_id)))
+        # Whether an earlier attempt may have placed the order.
+        maybe_placed = False
+        for attempt in range(constants.ORDER_PLACEMENT_MAX_ATTEMPTS):
+            try:
+                resp = self.future_sdk.take_order(
+                    client_oid,
+                    instrument_id,
+                    order_type,
+                    price,
+                    amount,
+                    match_price=1 if is_market_order else 0,
+                    leverage=leverage,
+                    order_type=execution_type)
+                if resp['result'] is True and resp['order_id'] != '-1':
+                    return int(resp['order_id']), None
+                else:
+                    return None, -1
+            except requests.exceptions.RequestException as ex:
+                logging.error(f'Failed to place order (attempt {attempt}): '
+                              f'{ex}')
+                if client_oid is None:
+                    return None, -1
+                maybe_placed = True
+                order_id = self._order_id_by_client_oid(
+                    client_oid, instrument_id)
+                if order_id is _UNKNOWN:
+                    return None, \
+                        constants.REST_API_ERROR_CODE__ORDER_STATE_UNKNOWN
+                if order_id is not None:
+                    logging.info('%s (%s) was placed despite the error',
+                                 order_id, client_oid)
+                    return order_id, None
+            except Exception as ex:
+                logging.error(f'Failed to place order: {ex}')
+                if maybe_placed:
+                    order_id = self._order_id_by_client_oid(
+                        client_oid, instrument_id)
+                    if order_id is _UNKNOWN:
+                        return None, \
+                            constants.REST_API_ERROR_CODE__ORDER_STATE_UNKNOWN
+                    if order_id is not None:
+                        logging.info('%s (%s) was placed by an earlier '
+                                     'attempt', order_id, client_oid)
+                        return order_id, None
                 return None, -1
-        except Exception as ex:
-            logging.error(f'Failed to place order: {ex}')
-            return None, -1
+        return None, -1
+
+    def _order_id_by_client_oid(self, client_oid, instrument_id):
+        """Returns the exchange order id, None once OKEX says there is no
+        such order, or _UNKNOWN.
+
+        Lookups failing for any other reason are retried with a backoff for
+        up to constants.ORDER_LOOKUP_MAX_WAIT_SECOND, this blocks a worker of
+        the shared executor. The first lookup waits too so that a placement
+        request still in flight has landed.
+        """
+        delay = constants.ORDER_LOOKUP_RETRY_INTERVAL_SECOND
+        deadline = time.time() + constants.ORDER_LOOKUP_MAX_WAIT_SECOND
+        while True:
+            if time.time() + delay > deadline:
+                logging.error(f'Gave up looking up {client_oid}')
+                return _UNKNOWN
+            time.sleep(delay)
+            try:
+                resp = self.future_sdk.get_order_info(client_oid,
+                                                      instrument_id)
+                return int(resp['order_id'])
+            except OkexAPIException as ex:
+                if _order_not_found(ex):
+                    return None
+                logging.warning(f'Failed to look up {client_oid}: {ex}')
+            except Exception as ex:
+                logging.warning(f'Failed to look up {client_oid}: {ex}')
+            delay = min(delay * 2,
+                        constants.ORDER_LOOKUP_MAX_RETRY_INTERVAL_SECOND)
 
     def open_long_order(self, instrument_id, amount, price,
-                        custom_order_id=None, is_market_order=False):
+                        custom_order_id=None, is_market_order=False,
+                        execution_type=constants.ORDER_EXECUTION_TYPE__NORMAL):
         return singleton.loop.run_in_executor(
             self._executor,
             self.create_order,
@@ -110,11 +203,13 @@ class RestApiV3:
             constants.ORDER_TYPE_CODE__OPEN_LONG,
             amount,
             price,
-            is_market_order
+            is_market_order,
+            execution_type
         )
 
     def open_short_order(self, instrument_id, amount, price,
-                         custom_order_id=None, is_market_order=False):
+                         custom_order_id=None, is_market_order=False,
+                         execution_type=constants.ORDER_EXECUTION_TYPE__NORMAL):
         return singleton.loop.run_in_executor(
             self._executor,
             self.create_order,
@@ -123,11 +218,13 @@ class RestApiV3:
             constants.ORDER_TYPE_CODE__OPEN_SHORT,
             amount,
             price,
-            is_market_order
+            is_market_order,
+            execution_type
         )
 
     def close_long_order(self, instrument_id, amount, price,
-                         custom_order_id=None, is_market_order=False):
+                         custom_order_id=None, is_market_order=False,
+                         execution_type=constants.ORDER_EXECUTION_TYPE__NORMAL):
         return singleton.loop.run_in_executor(
             self._executor,
             self.create_order,
@@ -136,11 +233,13 @@ class RestApiV3:
             constants.ORDER_TYPE_CODE__CLOSE_LONG,
             amount,
             price,
-            is_market_order
+            is_market_order,
+            execution_type
         )
 
     def close_short_order(self, instrument_id, amount, price,
-                          custom_order_id=None, is_market_order=False):
+                          custom_order_id=None, is_market_order=False,
+                          execution_type=constants.ORDER_EXECUTION_TYPE__NORMAL):
         return singleton.loop.run_in_executor(
             self._executor,
             self.create_order,
@@ -149,7 +248,8 @@ class RestApiV3:
             constants.ORDER_TYPE_CODE__CLOSE_SHORT,
             amount,
             price,
-            is_market_order
+            is_market_order,
+            execution_type
         )
 
     def revoke_order(self, instrument_id, order_id):
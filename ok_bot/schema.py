@@ -12,6 +12,8 @@ class Schema:
         self._instrument_periods = dict(
             zip(self._all_instrument_ids,
                 ['this_week', 'next_week', 'quarter']))
+        self._tick_sizes = singleton.rest_api.get_tick_sizes_blocking(
+            self._all_instrument_ids)
         self._markets_cartesian_product = self._init_markets_cartesian_product()
         self._all_necessary_source_columns =\
             self._init_all_necessary_source_columns()
@@ -44,6 +46,9 @@ class Schema:
         # Crash if instrument_id not in self._instrument_periods
         return self._instrument_periods[instrument_id]
 
+    def tick_size(self, instrument_id):
+        return self._tick_sizes[instrument_id]
+
     def _init_markets_cartesian_product(self):
         """In format ASK_MARKET*BID_MARKET.
 
@@ -92,6 +97,9 @@ def _testing():
     logging.info('\n%s', pprint.pformat(schema.markets_cartesian_product))
     logging.info('\n%s', pprint.pformat(schema.all_necessary_source_columns))
     logging.info('delta: %s', schema.time_diff_sec)
+    logging.info('tick sizes: %s', pprint.pformat(
+        {instrument_id: schema.tick_size(instrument_id)
+         for instrument_id in schema.all_instrument_ids}))
 
 
 if __name__ == '__main__':
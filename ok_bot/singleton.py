@@ -3,11 +3,13 @@ import asyncio
 book_listener = None
 coin_currency = None
 db = None
+journal = None
 loop = None
 order_book = None
 order_listener = None
 rest_api = None
 schema = None
+tick_recorder = None
 trader = None
 websocket = None
 
@@ -16,23 +18,28 @@ def initialize_objects(
         currency,
         simple_strategy=False,
         max_parallel_transaction_num=int(1e9)):
+    from . import constants
     from .book_listener import BookListener
     from .db import ProdDb
+    from .journal import Journal
     from .order_book import OrderBook
     from .order_listener import OrderListener
     from .rest_api_v3 import RestApiV3
     from .schema import Schema
+    from .tick_store import TickRecorder
     from .trader import Trader
     from .websocket_api import WebsocketApi
 
     global book_listener
     global coin_currency
     global db
+    global journal
     global loop
     global order_book
     global order_listener
     global rest_api
     global schema
+    global tick_recorder
     global trader
     global websocket
 
@@ -52,6 +59,15 @@ def initialize_objects(
         max_parallel_transaction_num=max_parallel_transaction_num
     )
     order_book = OrderBook()
+    if constants.TICK_STORE_DIR:
+        tick_recorder = TickRecorder(constants.TICK_STORE_DIR,
+                                     depth=constants.TICK_STORE_DEPTH)
+        for instrument_id in schema.all_instrument_ids:
+            book_listener.subscribe(instrument_id, tick_recorder)
+    if constants.JOURNAL_DIR:
+        journal = Journal(constants.JOURNAL_DIR)
+        for instrument_id in schema.all_instrument_ids:
+            book_listener.subscribe(instrument_id, journal)
     websocket = WebsocketApi(
         schema=schema,
         book_listener=book_listener,
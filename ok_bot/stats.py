@@ -1,52 +1,189 @@
-import numpy as np
-import pandas as pd
+import math
+import time
+from collections import deque
+
+_MIN_POSITIVE = 1e-12
+
+
+class Sketch:
+    """Mergeable summary of a stream of numbers in bounded memory.
+
+    Count, mean, variance, min and max are exact. Quantiles come from
+    logarithmic buckets (DDSketch), so each reported quantile is within
+    relative_accuracy of a real sample.
+    """
+    def __init__(self, relative_accuracy=0.01, max_buckets=2048):
+        self.relative_accuracy = relative_accuracy
+        self.max_buckets = max_buckets
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._inv_log_gamma = 1 / math.log(self._gamma)
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.zero_count = 0
+        self.positive = {}
+        self.negative = {}
+
+    def add(self, x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        if x < self.min:
+            self.min = x
+        if x > self.max:
+            self.max = x
+        if x > _MIN_POSITIVE:
+            self._add_to(self.positive, self._key(x), 1)
+        elif x < -_MIN_POSITIVE:
+            self._add_to(self.negative, self._key(-x), 1)
+        else:
+            self.zero_count += 1
+
+    def merge(self, other):
+        """Adds all samples summarized by other, same accuracy required."""
+        assert other.relative_accuracy == self.relative_accuracy
+        if other.count == 0:
+            return self
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.zero_count += other.zero_count
+        for key, n in other.positive.items():
+            self._add_to(self.positive, key, n)
+        for key, n in other.negative.items():
+            self._add_to(self.negative, key, n)
+        return self
+
+    def var(self):
+        """Sample variance, same as pandas.Series.var()."""
+        if self.count < 2:
+            return math.nan
+        return self.m2 / (self.count - 1)
+
+    def items(self):
+        """(representative value, count) of every bucket in ascending order."""
+        for key in sorted(self.negative, reverse=True):
+            yield -self._value(key), self.negative[key]
+        if self.zero_count:
+            yield 0.0, self.zero_count
+        for key in sorted(self.positive):
+            yield self._value(key), self.positive[key]
+
+    def quantile(self, q):
+        if self.count == 0:
+            return math.nan
+        rank = q * (self.count - 1)
+        seen = 0
+        for value, n in self.items():
+            seen += n
+            if seen > rank:
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def _key(self, x):
+        return math.ceil(math.log(x) * self._inv_log_gamma)
+
+    def _value(self, key):
+        return 2 * self._gamma ** key / (self._gamma + 1)
+
+    def _add_to(self, buckets, key, n):
+        if key in buckets:
+            buckets[key] += n
+            return
+        buckets[key] = n
+        if len(buckets) > self.max_buckets:
+            # Collapse the two buckets closest to zero, which costs accuracy
+            # only for the smallest magnitudes.
+            lowest, second = sorted(buckets)[:2]
+            buckets[second] += buckets.pop(lowest)
 
 
 class Stats:
-    def __init__(self, time_window_sec=5):
-        self.time_window = np.timedelta64(time_window_sec, 's')
-        self.data = pd.Series()
+    """Time windowed streaming statistics.
+
+    The window is kept as `slots` Sketches of time_window_sec / slots each,
+    expired slots are dropped as a whole. add() is O(1) and queries merge at
+    most `slots` sketches no matter how many samples there are.
+    """
+    def __init__(self, time_window_sec=5, slots=20, relative_accuracy=0.01):
+        self.time_window = time_window_sec
+        self._slot_sec = time_window_sec / slots
+        self._num_slots = slots
+        self._relative_accuracy = relative_accuracy
+        self._slots = deque()  # (slot index, Sketch), oldest first
+        self._last = None
 
     def truncate(self):
-        now = pd.Timestamp.now()
-        self.data = self.data.loc[self.data.index >= now - self.time_window]
+        oldest = int(time.time() // self._slot_sec) - self._num_slots
+        while self._slots and self._slots[0][0] <= oldest:
+            self._slots.popleft()
 
     def add(self, x):
-        now = pd.Timestamp.now()
-        self.data = self.data.append(pd.Series(x, index=[now]))
+        x = float(x)
+        index = int(time.time() // self._slot_sec)
+        if not self._slots or self._slots[-1][0] != index:
+            self._slots.append(
+                (index, Sketch(relative_accuracy=self._relative_accuracy)))
+            self.truncate()
+        self._slots[-1][1].add(x)
+        self._last = x
 
-    def var(self):
+    def sketch(self):
+        """All samples in the window merged into one Sketch."""
         self.truncate()
-        return self.data.var()
+        merged = Sketch(relative_accuracy=self._relative_accuracy)
+        for _, slot in self._slots:
+            merged.merge(slot)
+        return merged
 
-    def mean(self):
+    @property
+    def size(self):
         self.truncate()
-        return self.data.mean()
+        return sum(slot.count for _, slot in self._slots)
+
+    def var(self):
+        return self.sketch().var()
+
+    def mean(self):
+        sketch = self.sketch()
+        return sketch.mean if sketch.count else math.nan
+
+    def quantile(self, q):
+        return self.sketch().quantile(q)
 
     def __str__(self):
-        self.truncate()
-        return str(self.data)
+        sketch = self.sketch()
+        if sketch.count == 0:
+            return 'empty'
+        return (f'count: {sketch.count}, mean: {sketch.mean:.6f}, '
+                f'min: {sketch.min:.6f}, p50: {sketch.quantile(0.5):.6f}, '
+                f'p90: {sketch.quantile(0.9):.6f}, '
+                f'p99: {sketch.quantile(0.99):.6f}, max: {sketch.max:.6f}')
 
     def histogram(self, mark_last=True):
-        self.truncate()
-        if self.data.empty:
+        sketch = self.sketch()
+        if sketch.count == 0:
             return ''
 
-        values = sorted(self.data.values)
-        min_v = values[0]
-        max_v = values[-1]
+        min_v = sketch.min
+        max_v = sketch.max
 
-        quantiles = min(self.data.size, 10)
+        quantiles = min(sketch.count, 10)
         step = (max_v - min_v) / quantiles
 
-        bin = 0
         dist = [0] * quantiles
-        for i in values:
-            while (bin + 1 < quantiles) and (i >= min_v + bin * step + step):
-                bin += 1
-            dist[bin] += 1
+        for value, count in sketch.items():
+            bin = int((value - min_v) / step) if step > 0 else 0
+            dist[min(max(bin, 0), quantiles - 1)] += count
         max_dist = max(dist)
-        last_sample = self.data[-1]
+        last_sample = self._last
 
         result_lines = []
         for bin, count in enumerate(dist):
@@ -60,9 +197,40 @@ class Stats:
         return '\n'.join(reversed(result_lines))
 
 
+class HitRate:
+    def __init__(self):
+        self.hits = 0
+        self.lookups = 0
+
+    def add(self, hit):
+        self.lookups += 1
+        if hit:
+            self.hits += 1
+
+    @property
+    def rate(self):
+        return self.hits / self.lookups if self.lookups else 0.0
+
+    def __str__(self):
+        return f'{self.rate:.2%} ({self.hits}/{self.lookups})'
+
+
+def _benchmark():
+    import random
+    import timeit
+    s = Stats(3600)
+    samples = [random.gauss(50, 20) for _ in range(100000)]
+    sec = timeit.timeit(lambda: [s.add(x) for x in samples], number=1)
+    print(f'add: {sec / len(samples) * 1e9:.0f} ns per sample')
+    for name, query in [('mean', s.mean), ('var', s.var),
+                        ('quantile', lambda: s.quantile(0.99)),
+                        ('histogram', s.histogram)]:
+        sec = timeit.timeit(query, number=100) / 100
+        print(f'{name}: {sec * 1e6:.0f} us with {s.size} samples')
+
+
 if __name__ == '__main__':
     import random
-    import time
     from .quant import Quant
     from .slack import send_unblock
 
@@ -73,5 +241,7 @@ if __name__ == '__main__':
         s.add(Quant(100.00))
         s.add(Quant(-100.00))
         print(s.histogram())
+        print(s)
         # send_unblock(s.histogram())
         time.sleep(1)
+    _benchmark()
@@ -0,0 +1,236 @@
+"""Append-only columnar store of depth5 ticks for offline research.
+
+Layout: <root>/<YYYY-MM-DD>/<instrument_id>/<column>.bin, one fixed-width
+little-endian binary file per column, rows in arrival order. A day is the
+UTC day of the local receipt time, which is also the column reads are
+sliced on. The recorder holds it when the wall clock steps back, so it is
+non-decreasing within a store written by one process.
+
+Files are plain numpy arrays without header, so readers get them through
+numpy.memmap with no parsing at all.
+"""
+import os
+import time
+
+import numpy as np
+
+from . import constants
+from .appender import DailyAppender, utc_day
+
+# (column, dtype, values per row)
+TOP_COLUMNS = (
+    ('timestamp_local', '<f8', 1),
+    ('timestamp_server', '<f8', 1),
+    ('best_ask_price', '<f8', 1),
+    ('best_ask_vol', '<i8', 1),
+    ('best_bid_price', '<f8', 1),
+    ('best_bid_vol', '<i8', 1),
+)
+DEPTH = 5
+DEPTH_COLUMNS = (
+    ('ask_prices', '<f8', DEPTH),
+    ('ask_vols', '<i8', DEPTH),
+    ('bid_prices', '<f8', DEPTH),
+    ('bid_vols', '<i8', DEPTH),
+)
+_COLUMN_SPECS = {name: (dtype, width)
+                 for name, dtype, width in TOP_COLUMNS + DEPTH_COLUMNS}
+_INDEX_COLUMN = 'timestamp_local'
+_SECONDS_PER_DAY = 24 * 60 * 60
+
+
+def _column_name(instrument_id, column):
+    return os.path.join(instrument_id, f'{column}.bin')
+
+
+def _column_path(root, day, instrument_id, column):
+    return os.path.join(root, day, _column_name(instrument_id, column))
+
+
+def _padded(values, fill):
+    values = list(values[:DEPTH])
+    return values + [fill] * (DEPTH - len(values))
+
+
+class TickRecorder(DailyAppender):
+    """Book listener responder that appends every tick to the store.
+
+    tick_received() only enqueues, a background thread converts batches of
+    ticks to columns and appends them, at most every
+    constants.TICK_STORE_FLUSH_INTERVAL_SECOND.
+    """
+
+    def __init__(self, root, depth=False):
+        self.depth = depth
+        self._last_time = 0.0
+        self._columns = TOP_COLUMNS + (DEPTH_COLUMNS if depth else ())
+        super().__init__(root, 'tick-recorder')
+
+    @property
+    def num_ticks(self):
+        return self.num_records
+
+    def tick_received(self,
+                      instrument_id,
+                      ask_prices,
+                      ask_vols,
+                      bid_prices,
+                      bid_vols,
+                      timestamp):
+        # time.time() goes back when the clock is stepped, reads binary
+        # search this column so it must stay sorted.
+        self._last_time = max(self._last_time, time.time())
+        self._put((instrument_id, ask_prices, ask_vols, bid_prices,
+                   bid_vols, timestamp, self._last_time))
+
+    def _flush_interval(self):
+        return constants.TICK_STORE_FLUSH_INTERVAL_SECOND
+
+    def _partition(self, ticks):
+        partitions = {}
+        for tick in ticks:
+            instrument_id, timestamp_local = tick[0], tick[6]
+            partitions.setdefault(
+                (utc_day(timestamp_local), instrument_id), []).append(tick)
+        return partitions
+
+    def _encode(self, partition, rows):
+        _, instrument_id = partition
+        columns = self._to_columns(rows)
+        return len(rows), [
+            (_column_name(instrument_id, name),
+             np.ascontiguousarray(columns[name], dtype=dtype).tobytes())
+            for name, dtype, _ in self._columns]
+
+    def _to_columns(self, rows):
+        _, ask_prices, ask_vols, bid_prices, bid_vols, timestamps, local = \
+            zip(*rows)
+        # Depth5 is sorted in book_listener, best first.
+        columns = {
+            'timestamp_local': local,
+            'timestamp_server': np.array(
+                [t.rstrip('Z') for t in timestamps],
+                dtype='datetime64[ms]').astype('int64') / 1e3,
+            'best_ask_price': [float(p[0]) if p else np.nan
+                               for p in ask_prices],
+            'best_ask_vol': [v[0] if v else 0 for v in ask_vols],
+            'best_bid_price': [float(p[0]) if p else np.nan
+                               for p in bid_prices],
+            'best_bid_vol': [v[0] if v else 0 for v in bid_vols],
+        }
+        if self.depth:
+            columns['ask_prices'] = [_padded([float(p) for p in prices],
+                                             np.nan)
+                                     for prices in ask_prices]
+            columns['ask_vols'] = [_padded(vols, 0) for vols in ask_vols]
+            columns['bid_prices'] = [_padded([float(p) for p in prices],
+                                             np.nan)
+                                     for prices in bid_prices]
+            columns['bid_vols'] = [_padded(vols, 0) for vols in bid_vols]
+        return columns
+
+
+def _memmap_day(root, day, instrument_id, columns):
+    """Columns of one day partition, truncated to the rows all have."""
+    arrays = {}
+    for name in columns:
+        dtype, width = _COLUMN_SPECS[name]
+        path = _column_path(root, day, instrument_id, name)
+        if not os.path.exists(path):
+            return None
+        row_size = np.dtype(dtype).itemsize * width
+        num_rows = os.path.getsize(path) // row_size
+        if num_rows == 0:
+            return None
+        shape = (num_rows,) if width == 1 else (num_rows, width)
+        arrays[name] = np.memmap(path, dtype=dtype, mode='r', shape=shape)
+    # A crash may leave some columns of the last batch unwritten.
+    num_rows = min(len(a) for a in arrays.values())
+    return {name: a[:num_rows] for name, a in arrays.items()}
+
+
+def read_ticks(root, instrument_id, start_sec, end_sec, columns=None):
+    """Ticks of instrument_id received within [start_sec, end_sec).
+
+    Returns a dict column -> array, all of the same length and always
+    including timestamp_local. A range within one day returns read-only
+    memmap views, longer ranges are concatenated.
+    """
+    if columns is None:
+        columns = [name for name, _, _ in TOP_COLUMNS]
+    columns = [_INDEX_COLUMN] + [c for c in columns if c != _INDEX_COLUMN]
+
+    parts = []
+    day_start = start_sec - start_sec % _SECONDS_PER_DAY
+    while day_start < end_sec:
+        arrays = _memmap_day(root, utc_day(day_start), instrument_id, columns)
+        day_start += _SECONDS_PER_DAY
+        if arrays is None:
+            continue
+        index = arrays[_INDEX_COLUMN]
+        begin, end = np.searchsorted(index, [start_sec, end_sec])
+        if begin < end:
+            parts.append({name: a[begin:end] for name, a in arrays.items()})
+
+    if len(parts) == 1:
+        return parts[0]
+    result = {}
+    for name in columns:
+        dtype, width = _COLUMN_SPECS[name]
+        empty = np.empty((0,) if width == 1 else (0, width), dtype=dtype)
+        result[name] = np.concatenate([empty] + [p[name] for p in parts])
+    return result
+
+
+def read_aligned(root, instrument_ids, start_sec, end_sec, columns=None):
+    """Ticks of several instruments on their union of receipt times.
+
+    Every value is the last one known at that time (as-of join), NaN before
+    an instrument's first tick in the range. Returns
+    (timestamps, {instrument_id: {column: float64 array}}).
+    """
+    ticks = {instrument_id: read_ticks(root, instrument_id, start_sec,
+                                       end_sec, columns)
+             for instrument_id in instrument_ids}
+    timestamps = np.unique(np.concatenate(
+        [t[_INDEX_COLUMN] for t in ticks.values()]))
+    aligned = {}
+    for instrument_id, arrays in ticks.items():
+        index = np.searchsorted(arrays[_INDEX_COLUMN], timestamps,
+                                side='right') - 1
+        missing = index < 0
+        aligned[instrument_id] = {}
+        for name, values in arrays.items():
+            if name == _INDEX_COLUMN:
+                continue
+            values = np.asarray(values, dtype='float64')
+            if len(values) == 0:
+                values = np.full((1,) + values.shape[1:], np.nan)
+            column = values[np.maximum(index, 0)]
+            column[missing] = np.nan
+            aligned[instrument_id][name] = column
+    return timestamps, aligned
+
+
+def _benchmark():
+    import tempfile
+    import timeit
+    with tempfile.TemporaryDirectory() as root:
+        recorder = TickRecorder(root, depth=True)
+        start = time.time()
+        for i in range(100000):
+            recorder.tick_received('ETH-USD-190329',
+                                   [100 + i % 7 * 0.01] * 5, [5] * 5,
+                                   [99.9] * 5, [7] * 5,
+                                   '2019-03-01T12:14:50.085Z')
+        recorder.flush()
+        print(f'record: {(time.time() - start) / 1e5 * 1e6:.1f} us per tick')
+        recorder.shutdown()
+        sec = timeit.timeit(
+            lambda: read_ticks(root, 'ETH-USD-190329', start - 60,
+                               time.time() + 60), number=100) / 100
+        print(f'read_ticks: {sec * 1e3:.2f} ms for 100000 ticks')
+
+
+if __name__ == '__main__':
+    _benchmark()
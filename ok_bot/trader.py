@@ -1,10 +1,15 @@
 import asyncio
 import logging
+import time
 
 import numpy as np
 
-from . import constants, logger, singleton, trigger_strategy
+from . import constants, journal, logger, singleton, trigger_strategy
 from .arbitrage_execution import ArbitrageLeg, ArbitrageTransaction
+from .schema import Schema
+from .stats import HitRate
+
+strategy_memo_hit_rate = HitRate()
 
 
 class Trader:
@@ -19,6 +24,8 @@ class Trader:
         self.on_going_arbitrage_count = 0
         self.max_parallel_transaction_num = max_parallel_transaction_num
         self.ready = singleton.loop.create_future()
+        # product -> (memo key, ArbitragePlan or None)
+        self._strategy_memo = {}
 
         if simple_strategy:
             self.trigger_strategy = trigger_strategy.SimpleTriggerStrategy()
@@ -49,10 +56,95 @@ class Trader:
 
     def new_tick_received__regular(self, instrument_id, ask_prices, ask_vols,
                                    bid_prices, bid_vols):
-        for long_instrument, short_instrument, product in \
-                singleton.schema.markets_cartesian_product:
-            if instrument_id in [long_instrument, short_instrument]:
-                self.process_pair(long_instrument, short_instrument, product)
+        self.process_pairs([
+            (long_instrument, short_instrument, product)
+            for long_instrument, short_instrument, product in
+            singleton.schema.markets_cartesian_product
+            if instrument_id in [long_instrument, short_instrument]])
+
+    def process_pairs(self, pairs):
+        """process_pair of many pairs with one TriggerStrategy.find_plans.
+
+        Pairs whose memo key is unchanged since their last evaluation reuse
+        that decision, see _strategy_memo_key.
+        """
+        plans = []
+        pairs_to_evaluate = []
+        memo_keys = {}
+        for long_instrument, short_instrument, product in pairs:
+            if not self._is_pair_tradable(long_instrument, short_instrument):
+                continue
+            key = self._strategy_memo_key(long_instrument, short_instrument)
+            memo = self._strategy_memo.get(product)
+            hit = key is not None and memo is not None and memo[0] == key
+            strategy_memo_hit_rate.add(hit)
+            if hit:
+                if memo[1] is not None:
+                    plans.append(memo[1])
+            else:
+                pairs_to_evaluate.append(
+                    (long_instrument, short_instrument, product))
+                memo_keys[product] = key
+
+        if pairs_to_evaluate:
+            snapshot = singleton.order_book.spread_snapshot(pairs_to_evaluate)
+            new_plans = self.trigger_strategy.find_plans(snapshot)
+            plan_of_product = {self._plan_product(plan): plan
+                               for plan in new_plans}
+            if singleton.journal is not None:
+                singleton.journal.record_many('evaluation', {
+                    'long_instrument_id': snapshot.long_instruments,
+                    'short_instrument_id': snapshot.short_instruments,
+                    'long_ask_price': snapshot.long_ask_prices,
+                    'short_bid_price': snapshot.short_bid_prices,
+                    'current_spread': snapshot.current_spreads,
+                    'historical_mean_spread': snapshot.historical_mean_spreads,
+                    'median_spread': snapshot.median_spreads,
+                    'zscore': snapshot.zscores,
+                    'triggered': [product in plan_of_product
+                                  for product in snapshot.products],
+                })
+            for product, key in memo_keys.items():
+                if key is not None:
+                    self._strategy_memo[product] = (
+                        key, plan_of_product.get(product))
+            plans += new_plans
+
+        logging.log_every_n_seconds(logging.INFO,
+                                    '[strategy memo] hit rate: %s',
+                                    60 * 30,
+                                    strategy_memo_hit_rate)
+        for plan in plans:
+            self.kick_off_within_quota(plan)
+
+    @staticmethod
+    def _strategy_memo_key(long_instrument, short_instrument):
+        """Everything the strategies read for a pair, or None without memo.
+
+        Spreads are bid(short) - ask(long) of the best levels, and the amount
+        margin at that spread only involves the best levels too, so best
+        prices and volumes determine a decision except for the rolling
+        statistics and price trends. Those drift slowly and are bucketed into
+        epochs of STRATEGY_MEMO_STATS_EPOCH_SECOND.
+        """
+        if constants.STRATEGY_MEMO_STATS_EPOCH_SECOND <= 0:
+            return None
+        best_ask = singleton.order_book.market_depth(long_instrument).ask()[0]
+        best_bid = singleton.order_book.market_depth(short_instrument).bid()[0]
+        return (best_ask.price, best_ask.volume,
+                best_bid.price, best_bid.volume,
+                int(time.time() // constants.STRATEGY_MEMO_STATS_EPOCH_SECOND))
+
+    @staticmethod
+    def _plan_product(plan):
+        if plan.slow_side == constants.LONG:
+            long_instrument = plan.slow_instrument_id
+            short_instrument = plan.fast_instrument_id
+        else:
+            long_instrument = plan.fast_instrument_id
+            short_instrument = plan.slow_instrument_id
+        return Schema.make_market_cross_product(ask_market=long_instrument,
+                                                bid_market=short_instrument)
 
     def process_pair(self, long_instrument, short_instrument, product):
         """
@@ -65,6 +157,18 @@ class Trader:
         the gap average will break the threshold, which is the arbitrage
         triggering condition.
         """
+        if not self._is_pair_tradable(long_instrument, short_instrument):
+            return
+
+        plan = self.trigger_strategy.is_there_a_plan(
+            long_instrument=long_instrument,
+            short_instrument=short_instrument,
+            product=product)
+        if plan is None:
+            return
+        self.kick_off_within_quota(plan)
+
+    def _is_pair_tradable(self, long_instrument, short_instrument):
         if self.on_going_arbitrage_count >= self.max_parallel_transaction_num:
             logging.log_every_n_seconds(
                 logging.CRITICAL,
@@ -74,7 +178,7 @@ class Trader:
                 self.on_going_arbitrage_count,
                 self.max_parallel_transaction_num
             )
-            return
+            return False
         elif self.is_in_cooldown:
             logging.log_every_n_seconds(
                 logging.WARNING,
@@ -84,7 +188,7 @@ class Trader:
                 long_instrument,
                 short_instrument
             )
-            return
+            return False
 
         long_staleness = singleton.order_book.market_depth(
             long_instrument).staleness()
@@ -103,14 +207,10 @@ class Trader:
                 long_staleness,
                 short_staleness
             )
-            return
+            return False
+        return True
 
-        plan = self.trigger_strategy.is_there_a_plan(
-            long_instrument=long_instrument,
-            short_instrument=short_instrument,
-            product=product)
-        if plan is None:
-            return
+    def kick_off_within_quota(self, plan):
         if plan.slow_side == constants.LONG:
             slow_amount, fast_amount = (
                 singleton.order_book.market_depth(
@@ -158,7 +258,20 @@ class Trader:
             close_price_gap_threshold=arbitrage_plan.close_price_gap,
             estimate_net_profit=arbitrage_plan.estimate_net_profit,
             z_score=arbitrage_plan.z_score,
+            strategy=type(self.trigger_strategy).__name__,
         )
+        journal.record('plan', transaction.id,
+                       strategy=type(self.trigger_strategy).__name__,
+                       slow_instrument_id=arbitrage_plan.slow_instrument_id,
+                       fast_instrument_id=arbitrage_plan.fast_instrument_id,
+                       slow_side=arbitrage_plan.slow_side,
+                       fast_side=arbitrage_plan.fast_side,
+                       volume=arbitrage_plan.volume,
+                       slow_price=arbitrage_plan.slow_price,
+                       fast_price=arbitrage_plan.fast_price,
+                       close_price_gap=arbitrage_plan.close_price_gap,
+                       estimate_net_profit=arbitrage_plan.estimate_net_profit,
+                       z_score=arbitrage_plan.z_score)
         # Run transaction asynchronously. Main tick_received loop doesn't have
         # to await on it.
         self.on_going_arbitrage_count += 1
@@ -1,4 +1,5 @@
 import logging
+import math
 from abc import ABC, abstractmethod
 from collections import defaultdict, namedtuple
 from typing import Callable, List
@@ -8,7 +9,7 @@ import numpy as np
 from . import constants, logger, singleton
 from .constants import (LONG, MOVING_AVERAGE_TIME_WINDOW_IN_SECOND,
                         PRICE_PREDICTION_WINDOW_SECOND, SHORT)
-from .order_book import AvailableOrder
+from .order_book import AvailableOrder, SpreadSnapshot
 from .stats import Stats
 
 ArbitragePlan = namedtuple('ArbitragePlan',
@@ -26,9 +27,55 @@ ArbitragePlan = namedtuple('ArbitragePlan',
                            ])
 
 
+# Prices are on a tick grid far coarser than this. It only absorbs float
+# rounding so that a gap exactly at the threshold is still counted.
+_GAP_EPSILON = 1e-9
+
+
+def _merge_amount_margin_within_gap(ask_stack, bid_stack, max_gap) -> int:
+    """Same as the condition ask - bid <= max_gap, in O(n).
+
+    Asks are ascending and bids are descending, so the bids reachable from
+    each ask form shrinking prefixes and the greedy matching is a single
+    two-pointer merge.
+    """
+    max_gap = max_gap + _GAP_EPSILON
+    available_amount = 0
+    j = 0
+    bid_volume = bid_stack[0].volume if bid_stack else 0
+    for ask_order in ask_stack:
+        ask_volume = ask_order.volume
+        while ask_volume > 0 and j < len(bid_stack):
+            if ask_order.price - bid_stack[j].price > max_gap:
+                # Neither this nor any higher ask can reach the rest of bids.
+                return available_amount
+            if bid_volume > 0:
+                amount = min(ask_volume, bid_volume)
+                ask_volume -= amount
+                bid_volume -= amount
+                available_amount += amount
+            if bid_volume <= 0:
+                # Used up, or an empty (or bad, negative) level in the book
+                # data, which the condition path skips as well.
+                j += 1
+                if j < len(bid_stack):
+                    bid_volume = bid_stack[j].volume
+    return available_amount
+
+
 def calculate_amount_margin(ask_stack: List[AvailableOrder],
                             bid_stack: List[AvailableOrder],
-                            condition: Callable) -> int:
+                            condition: Callable = None,
+                            max_gap=None) -> int:
+    """Amount can be matched between ask_stack and bid_stack.
+
+    Either max_gap (ask_price - bid_price <= max_gap, up to float rounding)
+    or an arbitrary condition(ask_price, bid_price) callable is used for
+    matching. max_gap takes the linear time path and is preferred.
+    """
+    if max_gap is not None:
+        return _merge_amount_margin_within_gap(ask_stack, bid_stack, max_gap)
+
     available_amount = 0
     bid_copy = [AvailableOrder(price=order.price, volume=order.volume)
                 for order in bid_stack]
@@ -68,6 +115,7 @@ def spot_profit(long_begin, long_end, short_begin, short_end):
     Assume bug at price long_begin and close long at long_end. Hedge by short
     at short_begin and close short at short_end. What will be the profit after
     fee.
+    Prices can also be numpy arrays, the profit is then computed element-wise.
     :param long_begin: price to open the long order
     :param long_end: price to close the long order
     :param short_begin: price to open the short order
@@ -76,36 +124,129 @@ def spot_profit(long_begin, long_end, short_begin, short_end):
     """
     usd = constants.TRADING_VOLUME * \
         constants.SINGLE_UNIT_IN_USD[singleton.coin_currency]
-    fee = (usd / long_begin + usd / long_end + usd / short_begin
-           + usd / short_end) * constants.FEE_RATE
-    gain = usd / long_begin - usd / long_end + \
-        usd / short_end - usd / short_begin
-    return gain - fee
-
-
-def estimate_profit(prices, gap_threshold):
+    # gain = usd / long_begin - usd / long_end + usd / short_end
+    #        - usd / short_begin
+    # fee = (usd / long_begin + usd / long_end + usd / short_begin
+    #        + usd / short_end) * FEE_RATE
+    # gain - fee, grouped by price so arrays are touched as little as possible.
+    keep = 1 - constants.FEE_RATE
+    pay = 1 + constants.FEE_RATE
+    return usd * ((keep / long_begin - pay / short_begin)
+                  + (keep / short_end - pay / long_end))
+
+
+def estimate_profit(prices, gap_threshold, samples=None, method=None):
     """
     Estimate the profit assuming open arbitrage at prices and the price gap
-    closed to gap_threshold
+    closed to gap_threshold.
+
+    This is the worst of the drawn scenarios, not their mean, so more
+    samples lower the estimate (towards estimate_profit_lower_bound with
+    more sigmas) rather than tighten it around the expected profit.
     :param prices: dict. For instance, {LONG: 100, SHORT: 120}
     :param gap_threshold: The eventual price gap when converged
+    :param samples: number of scenarios drawn for each side (N of the
+        worst-of-N), defaults to constants.ESTIMATE_PROFIT_SAMPLES
+    :param method: 'monte_carlo' or 'closed_form', defaults to
+        constants.ESTIMATE_PROFIT_METHOD
     :return: the estimated profit in coin currency after fee
     """
+    method = method or constants.ESTIMATE_PROFIT_METHOD
+    if method == 'closed_form':
+        return estimate_profit_lower_bound(prices, gap_threshold)
+    assert method == 'monte_carlo', method
+    samples = samples or constants.ESTIMATE_PROFIT_SAMPLES
+
     # Note low <= high is not necessary
-    low, high = prices[LONG], prices[SHORT]
-
-    ret = 1e10  # Very big number
-    for _ in range(10):
-        # case 1: low side rise to high - gap_threshold
-        high_end = np.random.normal(high, high * 0.01)
-        low_end = high_end - gap_threshold
-        est1 = spot_profit(low, low_end, high, high_end)
-        # case 2: high side drop to low + gap_threshold
-        low_end = np.random.normal(low, low * 0.01)
-        high_end = low_end + gap_threshold
-        est2 = spot_profit(low, low_end, high, high_end)
-        ret = min(ret, est1, est2)
-    return ret
+    low, high = float(prices[LONG]), float(prices[SHORT])
+    std_rate = constants.ESTIMATE_PROFIT_PRICE_STD_RATE
+    # Row 0, case 1: low side rise to high - gap_threshold
+    # Row 1, case 2: high side drop to low + gap_threshold
+    # Both rows are expressed as high_end so one spot_profit call covers all.
+    high_end = np.random.normal([[high], [low + gap_threshold]],
+                                [[high * std_rate], [low * std_rate]],
+                                (2, samples))
+    return float(spot_profit(low, high_end - gap_threshold,
+                             high, high_end).min())
+
+
+def estimate_profit_lower_bound(prices, gap_threshold, sigmas=None):
+    """
+    Worst profit of estimate_profit scenarios within sigmas standard
+    deviations, without sampling.
+
+    Both cases close at low_end = high_end - gap_threshold, where the profit is
+        C + (1 - fee) / high_end - (1 + fee) / (high_end - gap_threshold)
+    (scaled by usd). Its stationary points solve
+        high_end / (high_end - gap_threshold) = +/-sqrt((1 - fee) / (1 + fee))
+    so the minimum over an interval of high_end is either at the interval ends
+    or at one of those points.
+    :param sigmas: defaults to constants.ESTIMATE_PROFIT_CLOSED_FORM_SIGMAS
+    """
+    if sigmas is None:
+        sigmas = constants.ESTIMATE_PROFIT_CLOSED_FORM_SIGMAS
+    low, high = float(prices[LONG]), float(prices[SHORT])
+    deviation = sigmas * constants.ESTIMATE_PROFIT_PRICE_STD_RATE
+    ratio = math.sqrt((1 - constants.FEE_RATE) / (1 + constants.FEE_RATE))
+    stationary_points = (-ratio * gap_threshold / (1 - ratio),
+                         ratio * gap_threshold / (1 + ratio))
+
+    high_ends = []
+    # case 1: high_end is around high; case 2: high_end is low_end + gap.
+    for lower, upper in ((high * (1 - deviation), high * (1 + deviation)),
+                         (low * (1 - deviation) + gap_threshold,
+                          low * (1 + deviation) + gap_threshold)):
+        high_ends += [lower, upper]
+        high_ends += [point for point in stationary_points
+                      if lower < point < upper]
+    return min(spot_profit(low, high_end - gap_threshold, high, high_end)
+               for high_end in high_ends)
+
+
+def estimate_profit_batch(long_prices, short_prices, gap_thresholds,
+                          samples=None, method=None) -> np.ndarray:
+    """estimate_profit of many arbitrages at once, the same worst-of-N.
+
+    :param long_prices: array of prices[LONG]
+    :param short_prices: array of prices[SHORT]
+    :param gap_thresholds: array of gap_threshold
+    :return: array of estimated profits in coin currency after fee
+    """
+    method = method or constants.ESTIMATE_PROFIT_METHOD
+    low = np.asarray(long_prices, dtype='float64')[:, None, None]
+    high = np.asarray(short_prices, dtype='float64')[:, None, None]
+    gap = np.asarray(gap_thresholds, dtype='float64')[:, None, None]
+    if method == 'closed_form':
+        high_ends = _lower_bound_candidates(low, high, gap)
+    else:
+        assert method == 'monte_carlo', method
+        samples = samples or constants.ESTIMATE_PROFIT_SAMPLES
+        std_rate = constants.ESTIMATE_PROFIT_PRICE_STD_RATE
+        # Axis 1 is case 1 / case 2 as in estimate_profit.
+        high_ends = np.random.normal(
+            np.concatenate([high, low + gap], axis=1),
+            np.concatenate([high, low], axis=1) * std_rate,
+            (len(low), 2, samples))
+    return spot_profit(low, high_ends - gap, high, high_ends).min(axis=(1, 2))
+
+
+def _lower_bound_candidates(low, high, gap, sigmas=None):
+    """high_end candidates of estimate_profit_lower_bound, shape (n, 2, 4)."""
+    if sigmas is None:
+        sigmas = constants.ESTIMATE_PROFIT_CLOSED_FORM_SIGMAS
+    deviation = sigmas * constants.ESTIMATE_PROFIT_PRICE_STD_RATE
+    ratio = math.sqrt((1 - constants.FEE_RATE) / (1 + constants.FEE_RATE))
+    lower = np.concatenate([high * (1 - deviation),
+                            low * (1 - deviation) + gap], axis=1)
+    upper = np.concatenate([high * (1 + deviation),
+                            low * (1 + deviation) + gap], axis=1)
+    stationary_points = np.concatenate([-ratio * gap / (1 - ratio),
+                                        ratio * gap / (1 + ratio)], axis=2)
+    # Points out of the band are replaced by the band's lower end.
+    stationary_points = np.where(
+        (lower < stationary_points) & (stationary_points < upper),
+        stationary_points, lower)
+    return np.concatenate([lower, upper, stationary_points], axis=2)
 
 
 def make_arbitrage_plan(slow_instrument_id,
@@ -169,6 +310,24 @@ class TriggerStrategy(ABC):
         """Returns ArbitragePlan or None"""
         raise NotImplemented
 
+    def find_plans(self, snapshot: SpreadSnapshot) -> List[ArbitragePlan]:
+        """Returns ArbitragePlan of every triggered product in snapshot.
+
+        Strategies override it to evaluate all products with array math, this
+        default asks is_there_a_plan one product at a time.
+        """
+        plans = []
+        for long_instrument, short_instrument, product in zip(
+                snapshot.long_instruments,
+                snapshot.short_instruments,
+                snapshot.products):
+            plan = self.is_there_a_plan(long_instrument=long_instrument,
+                                        short_instrument=short_instrument,
+                                        product=product)
+            if plan is not None:
+                plans.append(plan)
+        return plans
+
 
 class PercentageTriggerStrategy(TriggerStrategy):
     def is_there_a_plan(self,
@@ -176,7 +335,10 @@ class PercentageTriggerStrategy(TriggerStrategy):
                         short_instrument,
                         product) -> ArbitragePlan:
         z_score = singleton.order_book.zscore(product)
-        history_gap = singleton.order_book.historical_mean_spread(product)
+        if constants.SPREAD_CENTER == 'median':
+            history_gap = singleton.order_book.median_spread(product)
+        else:
+            history_gap = singleton.order_book.historical_mean_spread(product)
         current_spread = singleton.order_book.current_spread(product)
         deviation = current_spread - history_gap
         close_price_gap = (
@@ -191,20 +353,85 @@ class PercentageTriggerStrategy(TriggerStrategy):
         }, close_price_gap)
         if z_score < constants.SIMPLE_STRATEGY_ZSCORE_THRESHOLD or\
                 profit_est < constants.MIN_ESTIMATE_PROFIT:
-            logging.log_every_n_seconds(
-                logging.CRITICAL,
-                '[heartbeat] %s z-score: %.2f profit est: %f',
-                60 * 30,  # Every 30 min
-                product, z_score, profit_est
-            )
+            self._log_heartbeat(product, z_score, profit_est)
             return None
+        return self._make_plan(long_instrument=long_instrument,
+                               short_instrument=short_instrument,
+                               current_spread=current_spread,
+                               close_price_gap=close_price_gap,
+                               profit_est=profit_est,
+                               z_score=z_score)
+
+    def find_plans(self, snapshot: SpreadSnapshot) -> List[ArbitragePlan]:
+        z_scores = snapshot.zscores
+        if constants.SPREAD_CENTER == 'median':
+            history_gaps = snapshot.median_spreads
+        else:
+            history_gaps = snapshot.historical_mean_spreads
+        current_spreads = snapshot.current_spreads
+        deviations = current_spreads - history_gaps
+        close_price_gaps = (
+            history_gaps + deviations * constants.SIMPLE_STRATEGY_RESILIANCE)
+        profit_ests = estimate_profit_batch(snapshot.long_ask_prices,
+                                            snapshot.short_bid_prices,
+                                            close_price_gaps)
+        triggered = (
+            (z_scores >= constants.SIMPLE_STRATEGY_ZSCORE_THRESHOLD) &
+            (profit_ests >= constants.MIN_ESTIMATE_PROFIT))
+        if not triggered.all():
+            self._log_heartbeat_summary(snapshot.products, z_scores,
+                                        profit_ests, triggered)
+
+        plans = []
+        for i in np.flatnonzero(triggered):
+            plan = self._make_plan(
+                long_instrument=snapshot.long_instruments[i],
+                short_instrument=snapshot.short_instruments[i],
+                current_spread=current_spreads[i],
+                close_price_gap=close_price_gaps[i],
+                profit_est=profit_ests[i],
+                z_score=z_scores[i])
+            if plan is not None:
+                plans.append(plan)
+        return plans
+
+    @staticmethod
+    def _log_heartbeat(product, z_score, profit_est):
+        logging.log_every_n_seconds(
+            logging.CRITICAL,
+            '[heartbeat] %s z-score: %.2f profit est: %f',
+            60 * 30,  # Every 30 min
+            product, z_score, profit_est
+        )
+
+    @staticmethod
+    def _log_heartbeat_summary(products, z_scores, profit_ests, triggered):
+        """The heartbeat of all products not triggered."""
+        not_triggered = np.flatnonzero(~triggered)
+        best = not_triggered[np.argmax(profit_ests[not_triggered])]
+        logging.log_every_n_seconds(
+            logging.CRITICAL,
+            '[heartbeat] %d of %d products not triggered, best %s '
+            'z-score: %.2f profit est: %f, max z-score: %.2f',
+            60 * 30,  # Every 30 min
+            len(not_triggered), len(products), products[best],
+            z_scores[best], profit_ests[best],
+            np.max(z_scores[not_triggered])
+        )
 
+    @staticmethod
+    def _make_plan(long_instrument,
+                   short_instrument,
+                   current_spread,
+                   close_price_gap,
+                   profit_est,
+                   z_score) -> ArbitragePlan:
         available_amount = calculate_amount_margin(
             ask_stack=singleton.order_book.market_depth(long_instrument).ask(),
             bid_stack=singleton.order_book.market_depth(
                 short_instrument).bid(),
-            condition=lambda ask_price,
-            bid_price: bid_price - ask_price >= current_spread)
+            # bid_price - ask_price >= current_spread
+            max_gap=-current_spread)
 
         if available_amount < \
                 constants.MIN_AVAILABLE_AMOUNT_FOR_OPENING_ARBITRAGE:
@@ -249,6 +476,56 @@ class PercentageTriggerStrategy(TriggerStrategy):
             )
 
 
+SimpleEstimate = namedtuple('SimpleEstimate',
+                            [
+                                'total_price_diff_after_resiliance',
+                                'profit_per_transaction',
+                                'fee_per_transaction',
+                                'net_profit',
+                                'return_rate',
+                                'close_price_gap',
+                            ])
+
+
+def estimate_simple_return(current_spread,
+                           historical_mean_spread,
+                           current_price_average) -> SimpleEstimate:
+    """SimpleTriggerStrategy estimates, of one product or arrays of them."""
+    deviation = current_spread - historical_mean_spread
+
+    total_price_diff_after_resiliance = (
+        deviation * constants.SIMPLE_STRATEGY_RESILIANCE)
+
+    # USD per transaction per USD.
+    profit_rate = total_price_diff_after_resiliance / current_price_average
+
+    usd_per_contract = constants.SINGLE_UNIT_IN_USD[singleton.coin_currency]
+
+    # Total 3 splippage in USD per transaction.
+    slippage_per_transaction = (
+        3 * constants.ORDER_EXECUTOR_SAFE_PRICE_RATE * usd_per_contract)
+
+    # Total 4 order fees per transaction.
+    fee_per_transaction = 4 * constants.FEE_RATE * usd_per_contract
+
+    # USD per transaction per contract.
+    profit_per_transaction = (profit_rate * usd_per_contract -
+                              slippage_per_transaction -
+                              fee_per_transaction)
+
+    # If estimate_net_profit > 0, current spread is the minimum profitable
+    # gap. Close price gas is the target resilience point we estimate.
+    return SimpleEstimate(
+        total_price_diff_after_resiliance=total_price_diff_after_resiliance,
+        profit_per_transaction=profit_per_transaction,
+        fee_per_transaction=fee_per_transaction,
+        # Coin per transaction per contract.
+        net_profit=profit_per_transaction / current_price_average,
+        # Investage 2 contracts each side, the return rate.
+        return_rate=profit_per_transaction / usd_per_contract,
+        close_price_gap=current_spread - total_price_diff_after_resiliance)
+
+
 class SimpleTriggerStrategy(TriggerStrategy):
     """Simple short-term mean-reversion strategy.
 
@@ -292,54 +569,15 @@ class SimpleTriggerStrategy(TriggerStrategy):
         # zscore = singleton.order_book.zscore(product)
         zscore = 10
 
-        history_gap = singleton.order_book.historical_mean_spread(product)
-        current_spread = singleton.order_book.current_spread(product)
-
-        deviation = current_spread - history_gap
-
         current_price_average = singleton.order_book.current_price_average(
             product)
-
-        estimate_total_price_diff_after_resiliance = (
-            deviation * constants.SIMPLE_STRATEGY_RESILIANCE)
-
-        # USD per transaction per USD.
-        estimate_profit_rate = (
-            estimate_total_price_diff_after_resiliance /
+        estimate = estimate_simple_return(
+            singleton.order_book.current_spread(product),
+            singleton.order_book.historical_mean_spread(product),
             current_price_average)
 
-        usd_per_contract = constants.SINGLE_UNIT_IN_USD[singleton.coin_currency]
-
-        # Total 3 splippage in USD per transaction.
-        estimate_slippage_per_transaction = (
-            3 * constants.ORDER_EXECUTOR_SAFE_PRICE_RATE * usd_per_contract)
-
-        # Total 4 order fees per transaction.
-        estimate_fee_per_transaction = (
-            4 * constants.FEE_RATE * usd_per_contract)
-
-        # USD per transaction per contract.
-        estimate_profit_per_transaction = (
-            estimate_profit_rate * usd_per_contract - estimate_slippage_per_transaction - estimate_fee_per_transaction)
-
-        # Coin per transaction per contract.
-        estimate_net_profit = (
-            estimate_profit_per_transaction / current_price_average)
-
-        # Investage 2 contracts each side, the return rate.
-        estimate_return_rate = (
-            estimate_profit_per_transaction / usd_per_contract)
-
-        # If estimate_net_profit > 0, current spread is the minimum profitable
-        # gap.
-        min_profitable_gap = current_spread
-
-        # Close price gas is the target resilience point we estimate.
-        close_price_gap = (
-            min_profitable_gap - estimate_total_price_diff_after_resiliance)
-
         # self.stats[long_instrument, short_instrument].add(
-        #     estimate_return_rate * 100)
+        #     estimate.return_rate * 100)
         logging.log_every_n_seconds(
             logging.CRITICAL,
             'long: %s , short: %s\n'
@@ -347,73 +585,194 @@ class SimpleTriggerStrategy(TriggerStrategy):
             60 * 60,  # 60 min
             long_instrument,
             short_instrument,
-            estimate_return_rate * 100
+            estimate.return_rate * 100
         )
 
-        if (estimate_return_rate > constants.SIMPLE_STRATEGY_RETURN_RATE_THRESHOLD and
+        if (estimate.return_rate > constants.SIMPLE_STRATEGY_RETURN_RATE_THRESHOLD and
                 zscore >= constants.SIMPLE_STRATEGY_ZSCORE_THRESHOLD):
-            long_instrument_slope = singleton.order_book.price_linear_fit(
-                long_instrument, 'ask', PRICE_PREDICTION_WINDOW_SECOND)
-            short_instrument_slope = singleton.order_book.price_linear_fit(
-                short_instrument, 'bid', PRICE_PREDICTION_WINDOW_SECOND)
-            avg_slope = long_instrument_slope + short_instrument_slope
-
-            if avg_slope < 0:
-                slow_instrument_id = short_instrument
-                fast_instrument_id = long_instrument
-                slow_side = SHORT
-                fast_side = LONG
-                slow_price = singleton.order_book.bid_price(slow_instrument_id)
-                fast_price = singleton.order_book.ask_price(fast_instrument_id)
-            else:
-                slow_instrument_id = long_instrument
-                fast_instrument_id = short_instrument
-                slow_side = LONG
-                fast_side = SHORT
-                slow_price = singleton.order_book.ask_price(slow_instrument_id)
-                fast_price = singleton.order_book.bid_price(fast_instrument_id)
-
-            logging.critical(
-                '\nTRIGGERED'
-                '\nlong: %s , short: %s'
-                '\nr0: %.6f, r1: %.6f, R: %.6f'
-                '\nprice_avg: %.3f'
-                '\ndiff_after: %.3f'
-                '\nprofit_tran: %.3f'
-                '\nfee_tran: %.3f'
-                '\nest_profit: %.8f'
-                '\nzscore: %.3f'
-                '\nclose_gap: %.3f'
-                '\nrate: %.6f%%',
-                long_instrument,
-                short_instrument,
-                long_instrument_slope,
-                short_instrument_slope,
-                avg_slope,
-                current_price_average,
-                estimate_total_price_diff_after_resiliance,
-                estimate_profit_per_transaction,
-                estimate_fee_per_transaction,
-                estimate_net_profit,
-                zscore,
-                close_price_gap,
-                estimate_return_rate * 100
-            )
-            return ArbitragePlan(
-                volume=constants.TRADING_VOLUME,
-                slow_instrument_id=slow_instrument_id,
-                fast_instrument_id=fast_instrument_id,
-                slow_side=slow_side,
-                fast_side=fast_side,
-                slow_price=slow_price,
-                fast_price=fast_price,
-                close_price_gap=close_price_gap,
-                estimate_net_profit=estimate_net_profit,
-                z_score=zscore
-            )
+            return self._make_plan(
+                long_instrument=long_instrument,
+                short_instrument=short_instrument,
+                current_price_average=current_price_average,
+                estimate_total_price_diff_after_resiliance=(
+                    estimate.total_price_diff_after_resiliance),
+                estimate_profit_per_transaction=(
+                    estimate.profit_per_transaction),
+                estimate_fee_per_transaction=estimate.fee_per_transaction,
+                estimate_net_profit=estimate.net_profit,
+                zscore=zscore,
+                close_price_gap=estimate.close_price_gap,
+                estimate_return_rate=estimate.return_rate)
         else:
             return None
 
+    def find_plans(self, snapshot: SpreadSnapshot) -> List[ArbitragePlan]:
+        """Same estimates as is_there_a_plan, over arrays of all products."""
+        zscore = 10
+        current_price_average = (
+            snapshot.long_ask_prices + snapshot.short_bid_prices) / 2
+        estimate = estimate_simple_return(snapshot.current_spreads,
+                                          snapshot.historical_mean_spreads,
+                                          current_price_average)
+        triggered = (estimate.return_rate >
+                     constants.SIMPLE_STRATEGY_RETURN_RATE_THRESHOLD)
+        if zscore < constants.SIMPLE_STRATEGY_ZSCORE_THRESHOLD:
+            triggered[:] = False
+        self._log_return_rates(snapshot, estimate.return_rate, triggered)
+
+        plans = []
+        for i in np.flatnonzero(triggered):
+            plans.append(self._make_plan(
+                long_instrument=snapshot.long_instruments[i],
+                short_instrument=snapshot.short_instruments[i],
+                current_price_average=current_price_average[i],
+                estimate_total_price_diff_after_resiliance=(
+                    estimate.total_price_diff_after_resiliance[i]),
+                estimate_profit_per_transaction=(
+                    estimate.profit_per_transaction[i]),
+                estimate_fee_per_transaction=estimate.fee_per_transaction,
+                estimate_net_profit=estimate.net_profit[i],
+                zscore=zscore,
+                close_price_gap=estimate.close_price_gap[i],
+                estimate_return_rate=estimate.return_rate[i]))
+        return plans
+
+    @staticmethod
+    def _log_return_rates(snapshot, return_rates, triggered):
+        """The return rate summary of all products in snapshot."""
+        best = int(np.argmax(return_rates))
+        logging.log_every_n_seconds(
+            logging.CRITICAL,
+            '%d of %d products triggered\n'
+            'best long: %s , short: %s\n'
+            'rate: %.6f%%, median rate: %.6f%%\n',
+            60 * 60,  # 60 min
+            np.count_nonzero(triggered),
+            len(return_rates),
+            snapshot.long_instruments[best],
+            snapshot.short_instruments[best],
+            return_rates[best] * 100,
+            np.median(return_rates) * 100
+        )
+
+    @staticmethod
+    def _make_plan(long_instrument,
+                   short_instrument,
+                   current_price_average,
+                   estimate_total_price_diff_after_resiliance,
+                   estimate_profit_per_transaction,
+                   estimate_fee_per_transaction,
+                   estimate_net_profit,
+                   zscore,
+                   close_price_gap,
+                   estimate_return_rate) -> ArbitragePlan:
+        long_instrument_slope = singleton.order_book.price_linear_fit(
+            long_instrument, 'ask', PRICE_PREDICTION_WINDOW_SECOND)
+        short_instrument_slope = singleton.order_book.price_linear_fit(
+            short_instrument, 'bid', PRICE_PREDICTION_WINDOW_SECOND)
+        avg_slope = long_instrument_slope + short_instrument_slope
+
+        if avg_slope < 0:
+            slow_instrument_id = short_instrument
+            fast_instrument_id = long_instrument
+            slow_side = SHORT
+            fast_side = LONG
+            slow_price = singleton.order_book.bid_price(slow_instrument_id)
+            fast_price = singleton.order_book.ask_price(fast_instrument_id)
+        else:
+            slow_instrument_id = long_instrument
+            fast_instrument_id = short_instrument
+            slow_side = LONG
+            fast_side = SHORT
+            slow_price = singleton.order_book.ask_price(slow_instrument_id)
+            fast_price = singleton.order_book.bid_price(fast_instrument_id)
+
+        logging.critical(
+            '\nTRIGGERED'
+            '\nlong: %s , short: %s'
+            '\nr0: %.6f, r1: %.6f, R: %.6f'
+            '\nprice_avg: %.3f'
+            '\ndiff_after: %.3f'
+            '\nprofit_tran: %.3f'
+            '\nfee_tran: %.3f'
+            '\nest_profit: %.8f'
+            '\nzscore: %.3f'
+            '\nclose_gap: %.3f'
+            '\nrate: %.6f%%',
+            long_instrument,
+            short_instrument,
+            long_instrument_slope,
+            short_instrument_slope,
+            avg_slope,
+            current_price_average,
+            estimate_total_price_diff_after_resiliance,
+            estimate_profit_per_transaction,
+            estimate_fee_per_transaction,
+            estimate_net_profit,
+            zscore,
+            close_price_gap,
+            estimate_return_rate * 100
+        )
+        return ArbitragePlan(
+            volume=constants.TRADING_VOLUME,
+            slow_instrument_id=slow_instrument_id,
+            fast_instrument_id=fast_instrument_id,
+            slow_side=slow_side,
+            fast_side=fast_side,
+            slow_price=slow_price,
+            fast_price=fast_price,
+            close_price_gap=close_price_gap,
+            estimate_net_profit=estimate_net_profit,
+            z_score=zscore
+        )
+
+
+def _random_book(depth):
+    ask_prices = 100 + np.cumsum(np.random.randint(1, 5, depth)) * 0.25
+    bid_prices = 101 - np.cumsum(np.random.randint(1, 5, depth)) * 0.25
+    return ([AvailableOrder(price, vol) for price, vol in
+             zip(ask_prices, np.random.randint(1, 100, depth))],
+            [AvailableOrder(price, vol) for price, vol in
+             zip(bid_prices, np.random.randint(1, 100, depth))])
+
+
+def _benchmark_amount_margin():
+    import timeit
+    for depth in [5, 50, 400]:
+        ask_stack, bid_stack = _random_book(depth)
+        number = max(1, 20000 // depth)
+        callable_sec = timeit.timeit(
+            lambda: calculate_amount_margin(
+                ask_stack, bid_stack,
+                lambda ask_price, bid_price: ask_price - bid_price <= 0.5),
+            number=number) / number
+        merge_sec = timeit.timeit(
+            lambda: calculate_amount_margin(
+                ask_stack, bid_stack, max_gap=0.5),
+            number=number) / number
+        print(f'depth {depth:4d}: callable {callable_sec * 1e6:10.1f} us, '
+              f'merge {merge_sec * 1e6:8.1f} us')
+
+
+def _benchmark_estimate_profit():
+    import timeit
+    singleton.coin_currency = singleton.coin_currency or 'ETH'
+    prices = {LONG: 100, SHORT: 101}
+    number = 2000
+    for samples in [10, 100, 1000]:
+        sec = timeit.timeit(
+            lambda: estimate_profit(prices, 0.5, samples=samples),
+            number=number) / number
+        print(f'monte carlo, {samples:4d} samples: {sec * 1e6:8.1f} us, '
+              f'estimate {estimate_profit(prices, 0.5, samples=samples):f}')
+    sec = timeit.timeit(
+        lambda: estimate_profit(prices, 0.5, method='closed_form'),
+        number=number) / number
+    print(f'closed form:               {sec * 1e6:8.1f} us, '
+          f'estimate {estimate_profit(prices, 0.5, method="closed_form"):f}')
+
 
 if __name__ == '__main__':
     logger.init_global_logger(log_level=logging.INFO)
+    _benchmark_amount_margin()
+    _benchmark_estimate_profit()
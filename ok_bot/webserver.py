@@ -1,9 +1,20 @@
+"""Streams the bot log to browsers.
+
+python -m ok_bot.webserver --log log/ok_bot.log
+
+A page may pass ?level=WARNING and ?transaction=<id prefix> to only get the
+lines of that level and above, or of one transaction.
+"""
+import argparse
 import asyncio
-import sys
+import logging
 
 import socketio
 from aiohttp import web
 
+from . import constants
+from .log_stream import LEVELS, LogStream
+
 routes = web.RouteTableDef()
 app = web.Application()
 sio = socketio.AsyncServer()
@@ -17,8 +28,15 @@ async def index(request):
 app.add_routes(routes)
 
 
-async def emit_add_line(line):
-    await sio.emit('add line', line)
+async def emit_add_lines(sid, batch):
+    """Returns once the page acked the batch.
+
+    emit() only queues the packet for the socket, a slow page would let
+    that queue grow without bound instead of its LogStream buffer dropping
+    lines.
+    """
+    await sio.call('add lines', batch, sid=sid,
+                   timeout=constants.LOG_STREAM_ACK_TIMEOUT_SECOND)
 
 
 @sio.on('connect')
@@ -26,34 +44,48 @@ def connect(sid, environ):
     print("connect: {}".format(sid))
 
 
+@sio.on('subscribe')
+def subscribe(sid, data):
+    """Starts streaming to sid, returns the backlog as the ack."""
+    data = data or {}
+    level = LEVELS.get(str(data.get('level', '')).upper(), logging.DEBUG)
+    return app['log_stream'].subscribe(sid,
+                                       level=level,
+                                       transaction_id=data.get('transaction'))
+
+
 @sio.on('disconnect')
 def disconnect(sid):
     print('disconnect: {}'.format(sid))
-
-
-async def watch_log(filename):
-    proc = await asyncio.create_subprocess_exec(
-        'tail', '-f', filename,
-        stdout=asyncio.subprocess.PIPE)
-
-    # Read one line of output.
-    while True:
-        data = await proc.stdout.readline()
-        line = data.decode('ascii').rstrip()
-        await emit_add_line(line)
+    app['log_stream'].unsubscribe(sid)
 
 
 async def start_background_tasks(app):
-    app['log_watcher'] = app.loop.create_task(watch_log('1.log'))
+    app['log_watcher'] = app.loop.create_task(app['log_stream'].run())
 
 
 async def cleanup_background_tasks(app):
     print('cleanup background tasks...')
     app['log_watcher'].cancel()
-    await app['log_watcher']
+    try:
+        await app['log_watcher']
+    except asyncio.CancelledError:
+        pass
 
 
-if __name__ == '__main__':
+def main():
+    args = argparse.ArgumentParser(description='Stream the bot log')
+    args.add_argument('--log', default='log/ok_bot.log',
+                      help='Log file to follow')
+    args.add_argument('--host', default=None)
+    args.add_argument('--port', type=int, default=8080)
+    args = args.parse_args()
+
+    app['log_stream'] = LogStream(args.log, emit_add_lines)
     app.on_startup.append(start_background_tasks)
     app.on_cleanup.append(cleanup_background_tasks)
-    web.run_app(app)
+    web.run_app(app, host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -65,11 +65,12 @@ class WebsocketApi:
 
     async def _create_and_login(self):
         timestamp = str(server_time.get_server_timestamp())
+        api_key, secret_key, pass_phrase = api_v3_key_reader.read_keys()
         login_str = _create_login_params(
             str(timestamp),
-            api_v3_key_reader.API_KEY,
-            api_v3_key_reader.PASS_PHRASE,
-            api_v3_key_reader.KEY_SECRET)
+            api_key,
+            pass_phrase,
+            secret_key)
 
         await self._conn.send(login_str)
 
@@ -199,6 +200,7 @@ class WebsocketApi:
                                 order_id,
                                 timestamp,
                                 status,
+                                client_oid=None,
                                 **kwargs):
         """
             instrument_id	String	合约ID，如BTC-USDT-180213
@@ -213,6 +215,7 @@ class WebsocketApi:
             type	String	订单类型(1:开多 2:开空 3:平多 4:平空)
             instrument_id_val	String	合约面值
             leverage	String	杠杆倍数 value:10/20 默认10
+            client_oid	String	由您设置的订单ID来识别您的订单
         """
         # '**kwargs' is added to skip garbage extra fields like 'order_id'. It's
         # bug from exchange. (already contacted offical support)
@@ -244,7 +247,8 @@ class WebsocketApi:
             instrument_id,
             int(order_id),
             timestamp,
-            int(status))
+            int(status),
+            client_oid=client_oid or None)
 
     def _received_futures_position(self,
                                    long_qty,
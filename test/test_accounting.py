@@ -0,0 +1,144 @@
+import datetime
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+from unittest import TestCase
+from unittest.mock import patch
+
+from ok_bot.accounting import (Accounting, create_indexes, parse_date,
+                               reconcile_day)
+
+
+def _set_time_zone(tz):
+    patcher = patch.dict(os.environ, {'TZ': tz})
+    patcher.start()
+    time.tzset()
+
+    def restore():
+        patcher.stop()
+        time.tzset()
+    return restore
+
+
+class TestAccounting(TestCase):
+    def setUp(self):
+        # The runtime tables below are stamped in local time.
+        self.addCleanup(_set_time_zone('UTC'))
+        self._dir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self._dir.name, 'accounting.db')
+        conn = sqlite3.connect(self.db_file)
+        conn.executescript('''
+            CREATE TABLE runtime_transactions (
+                transaction_id TEXT PRIMARY KEY, last_update_time TEXT);
+            CREATE TABLE runtime_orders (
+                order_id INTEGER PRIMARY KEY, transaction_id TEXT,
+                last_update_time TEXT);
+            CREATE TABLE reported_orders (
+                order_id INTEGER, timestamp TEXT, fee NUMERIC);
+            CREATE TABLE reported_bills (
+                ledger_id INTEGER, order_id INTEGER, timestamp TEXT,
+                type TEXT, amount NUMERIC);
+        ''')
+        conn.executemany(
+            'INSERT INTO runtime_transactions VALUES (?, ?)',
+            [('t1', '2019-01-01 10:00:00'), ('t2', '2019-01-02 10:00:00')])
+        conn.executemany('INSERT INTO runtime_orders VALUES (?, ?, ?)', [
+            (1, 't1', '2019-01-01 10:00:00'),
+            (2, 't1', '2019-01-01 23:59:59'),
+            (3, 't1', '2019-01-01 11:00:00'),
+        ])
+        conn.executemany('INSERT INTO reported_orders VALUES (?, ?, ?)', [
+            (1, '2019-01-01T10:00:00.000Z', -0.01),
+            # Reported the next day, still matched.
+            (2, '2019-01-02T00:00:01.000Z', -0.02),
+            (4, '2019-01-02T12:00:00.000Z', 0),
+        ])
+        conn.executemany('INSERT INTO reported_bills VALUES (?, ?, ?, ?, ?)', [
+            (10, 1, '2019-01-01T10:00:00.000Z', 'fee', -0.01),
+            (11, 1, '2019-01-01T10:00:00.000Z', 'match', 0.5),
+            (12, 2, '2019-01-02T00:00:01.000Z', 'fee', -0.015),
+            (13, 5, '2019-01-02T00:00:01.000Z', 'fee', -0.1),
+        ])
+        conn.commit()
+        conn.close()
+        create_indexes(self.db_file)
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def _ids(self, results, check, column='order_id'):
+        count, examples = results[check]
+        self.assertEqual(count, len(examples))
+        return sorted(row[column] for row in examples)
+
+    def test_reconcile_day(self):
+        _, results = reconcile_day(self.db_file, datetime.date(2019, 1, 1))
+        self.assertEqual([], self._ids(results, 'orphan_orders'))
+        self.assertEqual([3], self._ids(results, 'unreported_orders'))
+        self.assertEqual([], self._ids(results, 'fee_mismatches'))
+
+        _, results = reconcile_day(self.db_file, datetime.date(2019, 1, 2))
+        self.assertEqual([4], self._ids(results, 'orphan_orders'))
+        self.assertEqual(['t2'], self._ids(
+            results, 'transactions_without_orders', 'transaction_id'))
+        self.assertEqual([2], self._ids(results, 'fee_mismatches'))
+        self.assertEqual([5], self._ids(results, 'bills_without_orders'))
+
+    def test_parallel_days_match_serial(self):
+        accounting = Accounting(self.db_file, '2018-12-31', '2019-01-03')
+        serial = list(accounting.reconcile(jobs=1))
+        self.assertEqual(4, len(serial))
+        self.assertEqual(serial, list(accounting.reconcile(jobs=2)))
+
+    def test_max_examples(self):
+        _, results = reconcile_day(self.db_file, datetime.date(2019, 1, 2),
+                                   max_examples=0)
+        self.assertEqual((1, []), results['orphan_orders'])
+
+    def test_runtime_tables_are_in_local_time(self):
+        conn = sqlite3.connect(self.db_file)
+        conn.execute('INSERT INTO runtime_orders VALUES (6, ?, ?)',
+                     ('t1', '2019-01-02 07:00:00'))
+        conn.commit()
+        conn.close()
+        _, results = reconcile_day(self.db_file, datetime.date(2019, 1, 2))
+        self.assertEqual([6], self._ids(results, 'unreported_orders'))
+
+        # 2019-01-02 07:00 in UTC+8 is still 2019-01-01 in UTC.
+        self.addCleanup(_set_time_zone('Asia/Shanghai'))
+        _, results = reconcile_day(self.db_file, datetime.date(2019, 1, 1))
+        self.assertEqual([3, 6], self._ids(results, 'unreported_orders'))
+        _, results = reconcile_day(self.db_file, datetime.date(2019, 1, 2))
+        self.assertEqual([], self._ids(results, 'unreported_orders'))
+
+    def test_parse_date(self):
+        self.assertEqual(datetime.date(2019, 2, 3), parse_date('2019-02-03'))
+        self.assertEqual(datetime.date(2019, 2, 1), parse_date('2019-02'))
+        self.assertEqual(datetime.date(2019, 2, 28),
+                         parse_date('2019-02', end=True))
+        self.assertEqual(datetime.date(2019, 12, 31),
+                         parse_date('2019-12', end=True))
+        self.assertEqual(datetime.date(2019, 1, 1), parse_date('2019'))
+        self.assertEqual(datetime.date(2019, 12, 31),
+                         parse_date('2019', end=True))
+        accounting = Accounting(self.db_file, '2019-01', '2019-01')
+        self.assertEqual(31, len(list(accounting.days())))
+
+    def test_orphan_orders(self):
+        accounting = Accounting(self.db_file, '2019-01', '2019-01')
+        self.assertEqual([4], [row['order_id']
+                               for row in accounting.orphan_orders])
+
+    def test_indexes_are_used(self):
+        conn = sqlite3.connect(self.db_file)
+        plan = ' '.join(row[-1] for row in conn.execute(
+            'EXPLAIN QUERY PLAN SELECT order_id FROM reported_orders '
+            "WHERE timestamp >= '2019-01-01' AND timestamp < '2019-01-02'"))
+        conn.close()
+        self.assertIn('idx_reported_orders__timestamp', plan)
+
+
+if __name__ == '__main__':
+    unittest.main()
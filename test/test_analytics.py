@@ -0,0 +1,82 @@
+import os
+import sqlite3
+import unittest
+from unittest import TestCase
+
+from ok_bot.analytics import refresh
+
+_TRANS_SQL = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                          'analysis', 'trans.sql')
+
+
+class TestAnalytics(TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        self.conn.executescript('''
+            CREATE TABLE runtime_transactions (
+                transaction_id TEXT PRIMARY KEY, status TEXT,
+                last_update_time TEXT);
+            CREATE TABLE runtime_orders (
+                order_id INTEGER PRIMARY KEY, transaction_id TEXT,
+                status INTEGER, filled_qty INTEGER, price_avg NUMERIC,
+                fee NUMERIC, type INTEGER, last_update_time TEXT);
+        ''')
+
+    def tearDown(self):
+        self.conn.close()
+
+    def _transaction(self, transaction_id, status, time):
+        self.conn.execute(
+            'INSERT OR REPLACE INTO runtime_transactions VALUES (?, ?, ?)',
+            (transaction_id, status, time))
+
+    def _order(self, order_id, transaction_id, type, price_avg, fee, time):
+        self.conn.execute(
+            'INSERT OR REPLACE INTO runtime_orders '
+            'VALUES (?, ?, 2, 1, ?, ?, ?, ?)',
+            (order_id, transaction_id, price_avg, fee, type, time))
+
+    def _gains(self):
+        return self.conn.execute(
+            'SELECT * FROM arbitrage_gains ORDER BY transaction_id').fetchall()
+
+    def _rebuilt_gains(self):
+        """arbitrage_gains as analysis/trans.sql computes it."""
+        conn = sqlite3.connect(':memory:')
+        self.conn.backup(conn)
+        with open(_TRANS_SQL) as f:
+            conn.executescript(''.join(
+                line for line in f if not line.startswith('.')))
+        gains = conn.execute(
+            'SELECT * FROM arbitrage_gains ORDER BY transaction_id').fetchall()
+        conn.close()
+        return gains
+
+    def test_incremental_matches_rebuild(self):
+        self._transaction('t1', 'ended_normally', '2019-01-01 10:00:00')
+        self._order(1, 't1', 1, 100.0, -0.001, '2019-01-01 10:00:00')
+        self._order(2, 't1', 3, 101.0, -0.001, '2019-01-01 10:00:00')
+        self._transaction('t2', 'opening', '2019-01-01 11:00:00')
+        self._order(3, 't2', 1, 100.0, -0.001, '2019-01-01 11:00:00')
+        self.assertEqual(2, refresh(self.conn))
+        self.assertEqual(self._rebuilt_gains(), self._gains())
+        self.assertEqual(['t1'], [row[0] for row in self._gains()])
+
+        # Only the boundary second and t2 are processed again.
+        self._transaction('t2', 'ended_normally', '2019-01-01 12:00:00')
+        self._order(4, 't2', 4, 99.0, -0.001, '2019-01-01 12:00:00')
+        self.assertEqual(1, refresh(self.conn))
+        self.assertEqual(self._rebuilt_gains(), self._gains())
+        self.assertEqual(['t1', 't2'], [row[0] for row in self._gains()])
+
+        self.assertEqual(1, refresh(self.conn))
+        self.assertEqual(2, refresh(self.conn, rebuild=True))
+        self.assertEqual(self._rebuilt_gains(), self._gains())
+
+    def test_empty_database(self):
+        self.assertEqual(0, refresh(self.conn))
+        self.assertEqual([], self._gains())
+
+
+if __name__ == '__main__':
+    unittest.main()
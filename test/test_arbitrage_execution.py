@@ -3,12 +3,19 @@ import unittest
 from unittest.mock import MagicMock, call, patch
 
 from ok_bot import logger, order_book, singleton
-from ok_bot.arbitrage_execution import ArbitrageLeg, ArbitrageTransaction
+from ok_bot.arbitrage_execution import (ArbitrageLeg, ArbitrageTransaction,
+                                        ConvergenceMonitor,
+                                        _add_to_convergence_monitor,
+                                        _convergence_monitors,
+                                        _remove_from_convergence_monitor)
 from ok_bot.constants import (CLOSE_POSITION_ORDER_TIMEOUT_SECOND,
+                              FAST_LEG_ORDER_EXECUTION_TYPE,
                               FAST_LEG_ORDER_FULFILLMENT_TIMEOUT_SECOND, LONG,
                               MIN_AVAILABLE_AMOUNT_FOR_CLOSING_ARBITRAGE,
-                              SHORT, SLOW_LEG_ORDER_FULFILLMENT_TIMEOUT_SECOND)
+                              SHORT, SLOW_LEG_ORDER_EXECUTION_TYPE,
+                              SLOW_LEG_ORDER_FULFILLMENT_TIMEOUT_SECOND)
 from ok_bot.mock import AsyncMock, MockBookListerner_constantPriceGenerator
+from ok_bot.order_book import MarketDepth
 from ok_bot.order_executor import OrderExecutionResult, OrderExecutor
 
 _FAKE_MARKET_PRICE = 100.0
@@ -107,7 +114,9 @@ class TestArbitrageExecution(unittest.TestCase):
                      is_market_order=False,
                      logger=transaction.logger,
                      transaction_id=transaction.id,
-                     safe_price=False),
+                     safe_price=False,
+                     execution_type=SLOW_LEG_ORDER_EXECUTION_TYPE,
+                     fill_callback=None),
                 call().open_short_position(),
                 call(instrument_id=self.week_instrument,
                      amount=1,
@@ -116,7 +125,9 @@ class TestArbitrageExecution(unittest.TestCase):
                      is_market_order=False,
                      logger=transaction.logger,
                      transaction_id=transaction.id,
-                     safe_price=True),
+                     safe_price=True,
+                     execution_type=FAST_LEG_ORDER_EXECUTION_TYPE,
+                     fill_callback=None),
                 call().open_long_position(),
                 call(instrument_id=self.week_instrument,
                      amount=1,
@@ -141,5 +152,87 @@ class TestArbitrageExecution(unittest.TestCase):
         singleton.loop.run_until_complete(_testing_coroutine())
 
 
+class TestConvergenceMonitor(unittest.TestCase):
+    def setUp(self):
+        singleton.book_listener = MagicMock()
+        singleton.order_book = MagicMock()
+        depth = {
+            'ask_instrument': MarketDepth(
+                'ask_instrument',
+                ask_prices=[100.0, 100.5], ask_vols=[3, 10],
+                bid_prices=[99.0], bid_vols=[1],
+                timestamp='2019-03-01T00:00:00.000Z'),
+            'bid_instrument': MarketDepth(
+                'bid_instrument',
+                ask_prices=[100.0], ask_vols=[1],
+                bid_prices=[98.9, 98.8], bid_vols=[2, 10],
+                timestamp='2019-03-01T00:00:00.000Z'),
+        }
+        singleton.order_book.market_depth.side_effect = depth.get
+
+    def _waiter(self, threshold):
+        waiter = MagicMock()
+        waiter.threshold = threshold
+        return waiter
+
+    def test_resolves_waiters_above_min_converged_gap(self):
+        monitor = ConvergenceMonitor('ask_instrument', 'bid_instrument')
+        tight, middle, loose = (self._waiter(0.5), self._waiter(1.2),
+                               self._waiter(3))
+        for waiter in [loose, tight, middle]:
+            monitor.add(waiter)
+        singleton.book_listener.subscribe.assert_has_calls([
+            call('ask_instrument', monitor),
+            call('bid_instrument', monitor),
+        ])
+
+        # 3@100.0 crosses 2@98.9 (gap 1.1) and 1@98.8 (gap 1.2), the
+        # remaining 9@98.8 is only reachable from 100.5 (gap 1.7).
+        self.assertAlmostEqual(float(monitor.min_converged_gap()), 1.7)
+        monitor.tick_received('ask_instrument', [], [], [], [], None)
+        tight.converged.assert_not_called()
+        middle.converged.assert_not_called()
+        loose.converged.assert_called_once()
+        # Progress goes to every pending waiter's transaction log.
+        for waiter in [tight, middle, loose]:
+            waiter.waiting.assert_called_once()
+        monitor.tick_received('bid_instrument', [], [], [], [], None)
+        tight.waiting.assert_called_once()
+        loose.converged.assert_called_once()
+
+        # Resolved waiters keep the monitor subscribed until they leave.
+        self.assertEqual(len(monitor), 3)
+        monitor.remove(tight)
+        monitor.remove(middle)
+        singleton.book_listener.unsubscribe.assert_not_called()
+        monitor.remove(loose)
+        monitor.remove(loose)
+        self.assertEqual(len(monitor), 0)
+        self.assertEqual(singleton.book_listener.unsubscribe.mock_calls, [
+            call('ask_instrument', monitor),
+            call('bid_instrument', monitor),
+        ])
+
+    def test_one_monitor_per_pair(self):
+        first, second, third = (self._waiter(3), self._waiter(3),
+                                self._waiter(3))
+        monitor = _add_to_convergence_monitor(first, 'ask_instrument',
+                                              'bid_instrument')
+        self.assertIs(monitor, _add_to_convergence_monitor(
+            second, 'ask_instrument', 'bid_instrument'))
+        monitor.tick_received('ask_instrument', [], [], [], [], None)
+        first.converged.assert_called_once()
+        second.converged.assert_called_once()
+
+        _remove_from_convergence_monitor(first, monitor)
+        self.assertIs(monitor, _add_to_convergence_monitor(
+            third, 'ask_instrument', 'bid_instrument'))
+        _remove_from_convergence_monitor(second, monitor)
+        _remove_from_convergence_monitor(third, monitor)
+        self.assertNotIn(monitor.key, _convergence_monitors)
+        self.assertEqual(2, singleton.book_listener.subscribe.call_count)
+        self.assertEqual(2, singleton.book_listener.unsubscribe.call_count)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,198 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from unittest import TestCase
+from unittest.mock import patch
+
+from ok_bot import constants
+from ok_bot import db
+from ok_bot.db import _BaseDb
+
+
+class TestDbWriter(TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self._dir.name, 'test.db')
+        self.db = _BaseDb(db_path=self.db_path)
+        self.db.create_tables_if_not_exist()
+
+    def tearDown(self):
+        self.db.shutdown(wait=True)
+        self._dir.cleanup()
+
+    def _update_order(self, order_id, status):
+        self.db.async_update_order(order_id=order_id,
+                                   transaction_id='transaction-id',
+                                   comment='comment',
+                                   status=status,
+                                   size=2,
+                                   filled_qty=0,
+                                   price=100.1,
+                                   price_avg=None,
+                                   fee=None,
+                                   type=1,
+                                   timestamp=None)
+
+    def _order_statuses(self):
+        with sqlite3.connect(self.db_path) as conn:
+            return dict(conn.execute(
+                'SELECT order_id, status FROM runtime_orders'))
+
+    def test_flush_commits_in_batches(self):
+        for order_id in range(1200):
+            self._update_order(order_id, 0)
+        self._update_order(7, 2)
+        self.assertTrue(self.db.flush(timeout=10))
+        statuses = self._order_statuses()
+        self.assertEqual(1200, len(statuses))
+        self.assertEqual(2, statuses[7])
+        self.assertEqual(1201, self.db.writer.num_submitted)
+        self.assertGreaterEqual(self.db.writer.num_commits,
+                                1200 / constants.DB_MAX_BATCH_SIZE)
+        self.assertLess(self.db.writer.num_commits, 1200)
+        self.assertEqual(0, self.db.writer.queue_depth)
+
+    def test_shutdown_is_durable(self):
+        for order_id in range(10):
+            self._update_order(order_id, 1)
+        self.db.shutdown(wait=True)
+        self.assertEqual({i: 1 for i in range(10)}, self._order_statuses())
+
+    def test_bad_update_does_not_stop_writer(self):
+        self.db.async_update_transaction(transaction_id='transaction-id')
+        self._update_order(2, 0)
+        self.assertTrue(self.db.flush(timeout=10))
+        self.assertEqual({2: 0}, self._order_statuses())
+
+    def _order_lifecycle(self, order_id):
+        self.db.async_update_order(order_id=order_id,
+                                   transaction_id='transaction-id',
+                                   comment='request_sent',
+                                   status=None,
+                                   size=2,
+                                   filled_qty=None,
+                                   price='100.1',
+                                   price_avg=None,
+                                   fee=None,
+                                   type=None,
+                                   timestamp=None)
+        self.db.async_update_order(order_id=order_id,
+                                   transaction_id='transaction-id',
+                                   comment='websocket_partially_filled',
+                                   status=1,
+                                   size=2,
+                                   filled_qty=1,
+                                   price_avg='100.1',
+                                   type=None,
+                                   timestamp=None)
+        self.db.async_update_order(order_id=order_id,
+                                   transaction_id='transaction-id',
+                                   comment='websocket_fulfilled',
+                                   status=2,
+                                   size=2,
+                                   filled_qty=2,
+                                   price='100.1',
+                                   price_avg='100.05',
+                                   fee='-0.001',
+                                   type=None,
+                                   timestamp=None)
+
+    def _order_rows(self):
+        with sqlite3.connect(self.db_path) as conn:
+            return conn.execute(
+                'SELECT order_id, comment, status, filled_qty, price, '
+                'price_avg, fee FROM runtime_orders ORDER BY order_id'
+            ).fetchall()
+
+    @patch('ok_bot.constants.DB_FLUSH_INTERVAL_SECOND', 60)
+    def test_updates_are_coalesced_per_order(self):
+        for order_id in range(3):
+            self._order_lifecycle(order_id)
+        self.assertTrue(self.db.flush(timeout=10))
+        self.assertEqual(
+            [(i, 'websocket_fulfilled', 2, 2, 100.1, 100.05, -0.001)
+             for i in range(3)],
+            self._order_rows())
+        self.assertEqual(9, self.db.writer.num_submitted)
+        self.assertEqual(3, self.db.writer.num_writes)
+
+    def test_later_flush_keeps_known_fields(self):
+        self._order_lifecycle(1)
+        self.assertTrue(self.db.flush(timeout=10))
+        self.db.async_update_order(order_id=1,
+                                   comment='final',
+                                   status=2,
+                                   type=1)
+        self.assertTrue(self.db.flush(timeout=10))
+        self.assertEqual([(1, 'final', 2, 2, 100.1, 100.05, -0.001)],
+                         self._order_rows())
+
+    @patch('ok_bot.constants.DB_KEEP_ORDER_HISTORY', True)
+    def test_order_history(self):
+        self._order_lifecycle(1)
+        self.assertTrue(self.db.flush(timeout=10))
+        with sqlite3.connect(self.db_path) as conn:
+            self.assertEqual(
+                [('request_sent',), ('websocket_partially_filled',),
+                 ('websocket_fulfilled',)],
+                conn.execute('SELECT comment FROM runtime_order_history '
+                             'ORDER BY rowid').fetchall())
+        self.assertEqual(1, len(self._order_rows()))
+
+    @patch('ok_bot.constants.DB_FLUSH_INTERVAL_SECOND', 60)
+    def test_exception_in_write_does_not_stop_writer(self):
+        def broken_write(cursor):
+            raise TypeError('unexpected type')
+
+        self.db.writer.submit(broken_write, {})
+        self._update_order(1, 0)
+        self.assertTrue(self.db.flush(timeout=10))
+        self._update_order(2, 1)
+        self.assertTrue(self.db.flush(timeout=10))
+        self.assertEqual({1: 0, 2: 1}, self._order_statuses())
+
+    @patch('ok_bot.constants.DB_FLUSH_INTERVAL_SECOND', 60)
+    def test_coalesced_write_keeps_submit_order(self):
+        executed = []
+
+        def write(cursor, name):
+            executed.append(name)
+
+        self.db.writer.submit(write, {'name': 'a1'}, coalesce_key='a')
+        self.db.writer.submit(write, {'name': 'b'})
+        self.db.writer.submit(write, {'name': 'a2'}, coalesce_key='a')
+        self.db.writer.submit(write, {'name': 'c'})
+        self.assertTrue(self.db.flush(timeout=10))
+        self.assertEqual(['b', 'a2', 'c'], executed)
+
+    def test_shut_down_writer_is_released(self):
+        self.assertIn(self.db.writer, db._writers)
+        self.db.shutdown(wait=True)
+        self.assertNotIn(self.db.writer, db._writers)
+
+    def test_shutdown_gives_up_on_a_stuck_write(self):
+        release = threading.Event()
+
+        def stuck_write(cursor):
+            release.wait(10)
+
+        self.db.writer.submit(stuck_write, {})
+        self.assertFalse(self.db.flush(timeout=0.1))
+        for order_id in range(3):
+            self._update_order(order_id, 1)
+        start = time.time()
+        with self.assertLogs(level='ERROR') as logs:
+            self.assertFalse(self.db.shutdown(wait=True, timeout=0.2))
+        self.assertLess(time.time() - start, 5)
+        self.assertIn('4 writes dropped', logs.output[0])
+        self.assertIn(self.db.writer, db._writers)
+        release.set()
+        self.assertTrue(self.db.shutdown(wait=True))
+        self.assertNotIn(self.db.writer, db._writers)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import TestCase
+from unittest.mock import patch
+
+import numpy as np
+
+from ok_bot import constants
+from ok_bot.journal import (DTYPES, Journal, read_events, read_transaction,
+                            to_frame)
+from ok_bot.price import Price
+
+DAY = 1551398400.0  # 2019-03-01 00:00:00 UTC
+
+
+class TestJournal(TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.root = self._dir.name
+        self.journal = Journal(self.root)
+
+    def tearDown(self):
+        self.journal.shutdown(wait=True)
+        self._dir.cleanup()
+
+    @patch('ok_bot.journal.time.time')
+    def _record_transaction(self, now):
+        now.return_value = DAY - 1
+        self.journal.tick_received('ETH-USD-190329',
+                                   [Price(10005, 100)], [3],
+                                   [Price(10001, 100)], [5],
+                                   '2019-03-01T12:14:50.085Z')
+        now.return_value = DAY + 1
+        self.journal.record('plan', 'T-1',
+                            strategy='PercentageTriggerStrategy',
+                            slow_instrument_id='ETH-USD-190329',
+                            fast_instrument_id='ETH-USD-190308',
+                            slow_side=constants.LONG,
+                            fast_side=constants.SHORT,
+                            volume=2,
+                            slow_price=100.05,
+                            fast_price=100.5,
+                            close_price_gap=0.1,
+                            estimate_net_profit=1e-5,
+                            z_score=2.5)
+        self.journal.record('order_sent', 'T-1',
+                            instrument_id='ETH-USD-190329',
+                            client_oid='okb1',
+                            type=constants.ORDER_TYPE_CODE__OPEN_LONG,
+                            execution_type=0,
+                            size=2,
+                            price=Price(10005, 100))
+        self.journal.record('order_ack', 'T-1',
+                            instrument_id='ETH-USD-190329',
+                            client_oid='okb1',
+                            order_id=123,
+                            error_code=0,
+                            latency_sec=0.05)
+        self.journal.record('order_fill', 'T-1',
+                            order_id=123,
+                            status=constants.ORDER_STATUS_CODE__FULFILLED,
+                            filled_qty=2,
+                            price_avg='100.04',
+                            fee='-0.0001')
+        self.journal.record('order_sent', 'T-2',
+                            instrument_id='ETH-USD-190329',
+                            client_oid='okb2')
+        self.assertTrue(self.journal.flush(timeout=10))
+
+    def test_round_trip(self):
+        self._record_transaction()
+        self.assertEqual({'2019-02-28', '2019-03-01'},
+                         set(os.listdir(self.root)))
+        self.assertEqual(6, self.journal.num_events)
+
+        ticks = read_events(self.root, 'tick', DAY - 10, DAY + 10)
+        self.assertEqual(DTYPES['tick'], ticks.dtype)
+        self.assertEqual(1, len(ticks))
+        self.assertEqual(b'', ticks['transaction_id'][0])
+        self.assertEqual(100.05, ticks['best_ask_price'][0])
+        self.assertEqual(5, ticks['best_bid_vol'][0])
+        self.assertAlmostEqual(DAY + 12 * 3600 + 14 * 60 + 50.085,
+                               ticks['timestamp_server'][0], places=3)
+
+        sent = to_frame(read_events(self.root, 'order_sent', DAY, DAY + 10))
+        self.assertEqual(['T-1', 'T-2'], sent['transaction_id'].tolist())
+        self.assertEqual(['okb1', 'okb2'], sent['client_oid'].tolist())
+        self.assertEqual(100.05, sent['price'][0])
+        # Missing fields.
+        self.assertTrue(np.isnan(sent['price'][1]))
+        self.assertEqual(-1, sent['size'][1])
+
+        self.assertEqual(
+            0, len(read_events(self.root, 'order_sent', DAY + 10, DAY + 20)))
+        self.assertEqual(
+            0, len(read_events(self.root, 'order_revoke', DAY, DAY + 10)))
+
+    def test_read_transaction(self):
+        self._record_transaction()
+        events = read_transaction(self.root, 'T-1', DAY - 10, DAY + 10)
+        self.assertEqual(['plan', 'order_sent', 'order_ack', 'order_fill'],
+                         events['event'].tolist())
+        self.assertTrue((np.diff(events['monotonic']) >= 0).all())
+        self.assertEqual('LONG', events['slow_side'][0])
+        self.assertEqual(123, events['order_id'][3])
+        self.assertAlmostEqual(-0.0001, events['fee'][3])
+        self.assertEqual(
+            0, len(read_transaction(self.root, 'T-3', DAY - 10, DAY + 10)))
+
+    def test_record_many(self):
+        self.journal.record_many('evaluation', {
+            'long_instrument_id': ['A', 'B'],
+            'short_instrument_id': ['B', 'A'],
+            'zscore': np.array([2.5, -2.5]),
+            'triggered': [True, False],
+        })
+        self.journal.record('evaluation', long_instrument_id='C')
+        self.assertTrue(self.journal.flush(timeout=10))
+        now = time.time()
+        events = to_frame(read_events(self.root, 'evaluation',
+                                      now - 60, now + 60))
+        self.assertEqual(['A', 'B', 'C'],
+                         events['long_instrument_id'].tolist())
+        self.assertEqual([2.5, -2.5], events['zscore'][:2].tolist())
+        self.assertEqual([True, False, False], events['triggered'].tolist())
+        self.assertTrue(np.isnan(events['median_spread']).all())
+
+    def test_bad_event_only_drops_itself(self):
+        self.journal.record('order_ack', 'T-1', order_id=1)
+        self.journal.record('order_ack', 'T-1', order_id='not a number')
+        self.journal.record('no such event', 'T-1')
+        self.journal.record('order_ack', 'T-1', order_id=3)
+        self.journal.record('order_revoke', 'T-1', order_id=4)
+        self.assertTrue(self.journal.flush(timeout=10))
+        self.assertEqual(3, self.journal.num_events)
+        now = time.time()
+        self.assertEqual(
+            [1, 3], read_events(self.root, 'order_ack', now - 60,
+                                now + 60)['order_id'].tolist())
+        self.assertEqual(
+            [4], read_events(self.root, 'order_revoke', now - 60,
+                             now + 60)['order_id'].tolist())
+
+        # The writer is still running.
+        self.journal.record('order_ack', 'T-1', order_id=5)
+        self.assertTrue(self.journal.flush(timeout=10))
+        self.assertEqual(4, self.journal.num_events)
+
+    def test_partial_record_is_ignored(self):
+        self._record_transaction()
+        path = os.path.join(self.root, '2019-03-01', 'order_sent.bin')
+        with open(path, 'ab') as f:
+            f.write(b'\0' * (DTYPES['order_sent'].itemsize // 2))
+        self.assertEqual(
+            2, len(read_events(self.root, 'order_sent', DAY, DAY + 10)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,246 @@
+import asyncio
+import logging
+import os
+import tempfile
+import unittest
+from unittest import TestCase
+from unittest.mock import patch
+
+import socketio
+from aiohttp import web
+
+from ok_bot import logger, webserver
+from ok_bot.log_stream import LogFollower, LogParser, LogStream
+
+TRANSACTION_ID = '0f8fad5b-d9cb-469f-a165-70867728950e'
+
+
+class TestLogFollower(TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._dir.name, 'ok_bot.log')
+        self._write('before\n')
+        self.follower = LogFollower(self.path)
+
+    def tearDown(self):
+        self.follower.close()
+        self._dir.cleanup()
+
+    def _write(self, text, mode='a'):
+        with open(self.path, mode, encoding='utf-8') as f:
+            f.write(text)
+
+    def test_only_complete_new_lines(self):
+        self.assertEqual([], self.follower.read())
+        self._write('a\nb')
+        self.assertEqual(['a'], self.follower.read())
+        self._write('c\n')
+        self.assertEqual(['bc'], self.follower.read())
+
+    def test_non_ascii(self):
+        self._write('价格 ✓\n')
+        with open(self.path, 'ab') as f:
+            f.write(b'\xff\n')
+        self.assertEqual(['价格 ✓', '�'], self.follower.read())
+
+    def test_rotation(self):
+        self._write('old 1\n')
+        os.rename(self.path, self.path + '.1')
+        self._write('new 1\n')
+        self.assertEqual(['old 1'], self.follower.read())
+        self.assertEqual(['new 1'], self.follower.read())
+        self._write('new 2\n')
+        self.assertEqual(['new 2'], self.follower.read())
+
+    def test_truncation(self):
+        self._write('a long line before truncation\n')
+        self.assertEqual(1, len(self.follower.read()))
+        self._write('short\n', mode='w')
+        self.assertEqual(['short'], self.follower.read())
+
+    def test_file_created_later(self):
+        follower = LogFollower(self.path + '.missing')
+        self.addCleanup(follower.close)
+        self.assertEqual([], follower.read())
+        with open(self.path + '.missing', 'w') as f:
+            f.write('first\n')
+        self.assertEqual(['first'], follower.read())
+
+
+class TestLogParser(TestCase):
+    def test_levels_and_transactions(self):
+        root = logging.makeLogRecord({
+            'levelname': 'WARNING', 'filename': 'trader.py', 'lineno': 12,
+            'msg': 'root\ncontinued'})
+        transaction = logging.makeLogRecord({
+            'levelname': 'DEBUG', 'filename': 'arbitrage_execution.py',
+            'lineno': 345, 'msg': 'transaction',
+            'transaction_id': TRANSACTION_ID})
+        formatter = logger._RootFormatter()
+        lines = (formatter.format(root) + '\n' +
+                 formatter.format(transaction)).split('\n')
+        self.assertIn(f'345] {TRANSACTION_ID} transaction', lines[2])
+
+        parsed = LogParser().parse(lines)
+        self.assertEqual([logging.WARNING, logging.WARNING, logging.DEBUG],
+                         [line.level for line in parsed])
+        self.assertEqual([None, None, TRANSACTION_ID],
+                         [line.transaction_id for line in parsed])
+
+
+class TestLogStream(TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._dir.name, 'ok_bot.log')
+        open(self.path, 'w').close()
+        self.loop = asyncio.new_event_loop()
+        self.sent = {}
+
+    def tearDown(self):
+        tasks = asyncio.all_tasks(self.loop)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            self.loop.run_until_complete(
+                asyncio.gather(*tasks, return_exceptions=True))
+        self.loop.close()
+        self._dir.cleanup()
+
+    async def _send(self, client_id, batch):
+        self.sent.setdefault(client_id, []).append(batch)
+
+    def _log(self, level, message, transaction_id=None):
+        prefix = f'{transaction_id} ' if transaction_id else ''
+        with open(self.path, 'a') as f:
+            f.write(f'{level:7s} 2019-03-01 12:14:50,085 trader.py:  12] '
+                    f'{prefix}{message}\n')
+
+    def _run(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def test_filters_and_backlog(self):
+        async def _test():
+            stream = LogStream(self.path, self._send)
+            self._log('INFO', 'info')
+            self._log('ERROR', 'error', TRANSACTION_ID)
+            self.assertEqual(2, await stream.poll())
+
+            self.assertEqual(
+                ['error'],
+                [line[-5:] for line in stream.subscribe(
+                    'errors', level=logging.ERROR)])
+            self.assertEqual(
+                2, len(stream.subscribe('all')))
+            self.assertEqual(
+                1, len(stream.subscribe('transaction',
+                                        transaction_id=TRANSACTION_ID[:8])))
+
+            self._log('WARNING', 'warning')
+            self._log('CRITICAL', 'critical', TRANSACTION_ID)
+            await stream.poll()
+            await asyncio.sleep(0)
+            for client_id in list(stream.clients):
+                stream.unsubscribe(client_id)
+            return stream
+
+        stream = self._run(_test())
+        self.assertEqual({}, stream.clients)
+        self.assertEqual(
+            {'errors': [['critical']],
+             'all': [['warning', 'critical']],
+             'transaction': [['critical']]},
+            {client_id: [[line.split(' ')[-1] for line in batch['lines']]
+                         for batch in batches]
+             for client_id, batches in self.sent.items()})
+
+    @patch('ok_bot.constants.LOG_STREAM_BACKLOG_LINES', 3)
+    @patch('ok_bot.constants.LOG_STREAM_CLIENT_BUFFER_LINES', 4)
+    def test_slow_client_drops_oldest(self):
+        unblocked = None
+
+        async def _slow_send(client_id, batch):
+            await unblocked.wait()
+            await self._send(client_id, batch)
+
+        async def _test():
+            nonlocal unblocked
+            unblocked = asyncio.Event()
+            stream = LogStream(self.path, _slow_send)
+            stream.subscribe('slow')
+            self._log('INFO', 'first')
+            await stream.poll()
+            # The sender is now waiting in _slow_send with the first line.
+            await asyncio.sleep(0)
+            for i in range(10):
+                self._log('INFO', f'line-{i}')
+            await stream.poll()
+            self.assertEqual(3, len(stream.backlog))
+            unblocked.set()
+            for _ in range(5):
+                await asyncio.sleep(0)
+            stream.unsubscribe('slow')
+
+        self._run(_test())
+        batches = self.sent['slow']
+        self.assertEqual(2, len(batches))
+        self.assertEqual(0, batches[0]['dropped'])
+        self.assertEqual(6, batches[1]['dropped'])
+        self.assertEqual([f'line-{i}' for i in range(6, 10)],
+                         [line.split(' ')[-1] for line in batches[1]['lines']])
+
+    @patch('ok_bot.constants.LOG_STREAM_CLIENT_BUFFER_LINES', 4)
+    def test_slow_page_drops_oldest_through_socketio(self):
+        page_batches = []
+
+        async def _test():
+            received = asyncio.Event()
+            unblocked = asyncio.Event()
+            stream = LogStream(self.path, webserver.emit_add_lines)
+            webserver.app['log_stream'] = stream
+            runner = web.AppRunner(webserver.app)
+            await runner.setup()
+            site = web.TCPSite(runner, '127.0.0.1', 0)
+            await site.start()
+            port = site._server.sockets[0].getsockname()[1]
+
+            page = socketio.AsyncClient()
+
+            @page.on('add lines')
+            async def add_lines(batch):
+                page_batches.append(batch)
+                received.set()
+                # Acked when the handler returns.
+                await unblocked.wait()
+
+            try:
+                await page.connect(f'http://127.0.0.1:{port}',
+                                   transports=['websocket'])
+                self.assertEqual([], await page.call('subscribe', {}))
+                self._log('INFO', 'first')
+                await stream.poll()
+                await asyncio.wait_for(received.wait(), 10)
+                for i in range(10):
+                    self._log('INFO', f'line-{i}')
+                await stream.poll()
+                await asyncio.sleep(0.2)
+                # The unacked first batch holds the others back.
+                self.assertEqual(1, len(page_batches))
+                (client,) = stream.clients.values()
+                self.assertEqual(4, len(client.buffer))
+                received.clear()
+                unblocked.set()
+                await asyncio.wait_for(received.wait(), 10)
+            finally:
+                await page.disconnect()
+                await runner.cleanup()
+
+        self._run(_test())
+        self.assertEqual(2, len(page_batches))
+        self.assertEqual(6, page_batches[1]['dropped'])
+        self.assertEqual([f'line-{i}' for i in range(6, 10)],
+                         [line.split(' ')[-1]
+                          for line in page_batches[1]['lines']])
+
+
+if __name__ == '__main__':
+    unittest.main()
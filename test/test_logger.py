@@ -1,9 +1,13 @@
 import unittest
+import gzip
 import logging
 import os
 import re
 import contextlib
+import tempfile
+import threading
 import time
+from unittest.mock import patch
 
 from ok_bot import logger
 
@@ -75,6 +79,153 @@ class TestLogger(unittest.TestCase):
                 time.sleep(1)  # sleep 1 second
         self.assertEqual(len(context.output), 3)
 
+    def test_log_every_n_seconds_per_call_site(self):
+        with self.assertLogs(logging.getLogger(), level='INFO') as context:
+            for i in range(3):
+                logging.log_every_n_seconds(logging.INFO, 'a %d', 60, i)
+                logging.log_every_n_seconds(logging.INFO, 'b %d', 60, i)
+        self.assertEqual(['INFO:root:a 0', 'INFO:root:b 0'], context.output)
+
+    def test_log_every_n_seconds_shared_token(self):
+        token = object()
+        with self.assertLogs(logging.getLogger(), level='INFO') as context:
+            logging.log_every_n_seconds(logging.INFO, 'a', 60, token=token)
+            logging.log_every_n_seconds(logging.INFO, 'b', 60, token=token)
+        self.assertEqual(['INFO:root:a'], context.output)
+
+    def test_suppressed_log_is_not_formatted(self):
+        class Arg:
+            num_formatted = 0
+
+            def __str__(self):
+                Arg.num_formatted += 1
+                return 'arg'
+
+        with self.assertLogs(logging.getLogger(), level='INFO'):
+            for _ in range(5):
+                logging.log_every_n_seconds(logging.INFO, '%s', 60, Arg())
+        self.assertEqual(1, Arg.num_formatted)
+
+
+class TestTransactionLogWriter(unittest.TestCase):
+    def setUp(self):
+        logger.init_global_logger(log_level=logging.INFO)
+        self._dir = tempfile.TemporaryDirectory()
+        self.writer = logger.TransactionLogWriter(directory=self._dir.name)
+        patcher = patch('ok_bot.logger._writer', self.writer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.writer.stop()
+        self._dir.cleanup()
+
+    def _read(self, name):
+        with open(os.path.join(self._dir.name, name)) as f:
+            return f.read()
+
+    def test_records_go_to_their_file(self):
+        logger_1 = logger.create_transaction_logger('T-1')
+        logger_2 = logger.create_transaction_logger('T-2')
+        logger_1.info('first %s', 1)
+        logger_2.warning('second')
+        logger_1.info('third')
+        self.assertTrue(self.writer.flush(timeout=10))
+        log_1 = self._read('T-1.log').splitlines()
+        self.assertEqual(2, len(log_1))
+        self.assertTrue(log_1[0].startswith('INFO'))
+        self.assertTrue(log_1[0].endswith('first 1'))
+        self.assertIn('test_logger.py', log_1[0])
+        self.assertTrue(self._read('T-2.log').startswith('WARNING'))
+        self.assertEqual(3, logger.transaction_log_metrics()['num_records'])
+
+    @patch('ok_bot.constants.TRANSACTION_LOG_MAX_OPEN_FILES', 2)
+    def test_lru_of_open_files(self):
+        for i in range(5):
+            logger.create_transaction_logger(f'T-{i}').info('a')
+        logger.create_transaction_logger('T-0').info('b')
+        self.assertTrue(self.writer.flush(timeout=10))
+        self.assertEqual(2, self.writer.num_open_files)
+        self.assertEqual(2, len(self._read('T-0.log').splitlines()))
+
+    @patch('ok_bot.constants.TRANSACTION_LOG_COMPRESS', True)
+    def test_close_compresses(self):
+        transaction_logger = logger.create_transaction_logger('T-1')
+        transaction_logger.info('done')
+        transaction_logger.close()
+        self.assertTrue(self.writer.flush(timeout=10))
+        self.assertEqual(0, self.writer.num_open_files)
+        self.assertEqual(['T-1.log.gz'], os.listdir(self._dir.name))
+        with gzip.open(os.path.join(self._dir.name, 'T-1.log.gz'), 'rt') as f:
+            self.assertTrue(f.read().endswith('done\n'))
+
+    def test_full_queue_drops(self):
+        self.writer.stop()
+        writer = logger.TransactionLogWriter(directory=self._dir.name)
+        writer.stop()  # Nothing consumes the queue any more.
+        writer.queue.maxsize = 2
+        with patch('ok_bot.logger._writer', writer):
+            transaction_logger = logger.create_transaction_logger('T-1')
+            for _ in range(5):
+                transaction_logger.info('a')
+        self.assertEqual(2, writer.queue_depth)
+        self.assertEqual(3, writer.dropped)
+
+    def test_bad_record_does_not_stop_the_writer(self):
+        class Text(logger.Deferred):
+            def render(self):
+                return 'text'
+
+        transaction_logger = logger.create_transaction_logger('T-1')
+        # Formatted by the writer, which raises a TypeError.
+        transaction_logger.info('two args %s %s', Text())
+        transaction_logger.info('after')
+        self.assertTrue(self.writer.flush(timeout=10))
+        self.assertTrue(self._read('T-1.log').endswith('after\n'))
+
+    def test_full_queue_does_not_block(self):
+        self.writer.stop()
+        writer = logger.TransactionLogWriter(directory=self._dir.name)
+        writer.stop()
+        writer.queue.maxsize = 1
+        writer.queue.put_nowait(None)
+        writer.close('T-1')
+        self.assertEqual(1, writer.dropped)
+        self.assertFalse(writer.flush(timeout=0.1))
+        # Returns although the thread is gone and the queue full.
+        writer.stop(timeout=0.1)
+
+    def test_deferred_render_error_is_a_placeholder(self):
+        class Broken(logger.Deferred):
+            def render(self):
+                raise ValueError('no data')
+
+        transaction_logger = logger.create_transaction_logger('T-1')
+        transaction_logger.info('depth: %s', Broken())
+        transaction_logger.info('after')
+        self.assertTrue(self.writer.flush(timeout=10))
+        self.assertEqual(
+            ["depth: <Broken failed to render: ValueError('no data')>",
+             'after'],
+            [line.split('] ')[-1]
+             for line in self._read('T-1.log').splitlines()])
+
+    def test_deferred_is_rendered_once_by_logging_threads(self):
+        class Depth(logger.Deferred):
+            render_threads = []
+
+            def render(self):
+                Depth.render_threads.append(threading.current_thread())
+                return 'rendered depth'
+
+        transaction_logger = logger.create_transaction_logger('T-1')
+        transaction_logger.info('depth:\n%s', Depth())
+        self.assertTrue(self.writer.flush(timeout=10))
+        logger._stop_background_logging()
+        self.assertTrue(self._read('T-1.log').endswith('rendered depth\n'))
+        self.assertEqual(1, len(Depth.render_threads))
+        self.assertIsNot(threading.main_thread(), Depth.render_threads[0])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,10 +1,17 @@
 import asyncio
 import unittest
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
+
+import numpy as np
+import pandas as pd
 
 from ok_bot import singleton
+from ok_bot.constants import PRICE_PREDICTION_WINDOW_SECOND
 from ok_bot.logger import init_global_logger
 from ok_bot.mock import AsyncMock
+from ok_bot.order_book import MarketDepth, OrderBook
+from ok_bot.order_statistics import RollingOrderStatistics
+from ok_bot.schema import Schema
 
 
 class TestOrderBook(unittest.TestCase):
@@ -33,5 +40,80 @@ class TestOrderBook(unittest.TestCase):
         singleton.loop.run_until_complete(_test())
 
 
+class TestSpreadSnapshot(unittest.TestCase):
+    def test_matches_scalar_statistics(self):
+        order_book = OrderBook.__new__(OrderBook)
+        order_book._schema = Mock()
+        order_book.table = {}
+        order_book.last_record = {}
+        pairs = [('A', 'B', 'B*A'), ('B', 'A', 'A*B')]
+        index = pd.date_range('2019-01-01', periods=20, freq='S')
+        np.random.seed(0)
+        for instrument_id in ['A', 'B']:
+            for side in ['ask', 'bid']:
+                order_book.last_record[Schema.make_column_name(
+                    instrument_id, side, 'price')] = np.random.normal(100)
+        order_book.spread_order_statistics = {}
+        for _, _, product in pairs:
+            order_book.table[product] = pd.Series(
+                np.random.normal(0, 1, len(index)), index=index)
+            order_book.spread_order_statistics[product] = \
+                RollingOrderStatistics(60)
+            for timestamp, value in enumerate(order_book.table[product]):
+                order_book.spread_order_statistics[product].add(timestamp,
+                                                                value)
+
+        snapshot = order_book.spread_snapshot(pairs)
+        self.assertEqual(['B*A', 'A*B'], snapshot.products)
+        for i, (long_instrument, short_instrument, product) in \
+                enumerate(pairs):
+            self.assertAlmostEqual(float(order_book.zscore(product)),
+                                   snapshot.zscores[i], places=6)
+            self.assertAlmostEqual(
+                float(order_book.historical_mean_spread(product)),
+                snapshot.historical_mean_spreads[i], places=6)
+            self.assertAlmostEqual(
+                float(order_book.current_spread(product)),
+                snapshot.current_spreads[i], places=6)
+            self.assertAlmostEqual(
+                np.median(order_book.table[product].values),
+                snapshot.median_spreads[i])
+            self.assertAlmostEqual(
+                float(order_book.ask_price(long_instrument)),
+                snapshot.long_ask_prices[i], places=4)
+            self.assertAlmostEqual(
+                float(order_book.bid_price(short_instrument)),
+                snapshot.short_bid_prices[i], places=4)
+
+
+class TestMarketDepthSnapshot(unittest.TestCase):
+    def test_renders_prices_as_of_log_time(self):
+        order_book = OrderBook.__new__(OrderBook)
+        order_book.table = {}
+        index = pd.date_range('2019-01-01', periods=10, freq='S')
+        for side, slope in [('ask', 2.0), ('bid', 1.0)]:
+            order_book.table[Schema.make_column_name('A', side, 'price')] = \
+                pd.Series(100 + slope * np.arange(len(index)), index=index)
+        schema = Mock(time_diff_sec=0.0)
+        with patch.object(singleton, 'order_book', order_book), \
+                patch.object(singleton, 'schema', schema):
+            market_depth = MarketDepth('A', [101.0], [10], [100.0], [20],
+                                       '2019-03-01T12:14:50.085Z')
+            snapshot = market_depth.snapshot()
+            expected = 'ask_slope: {:.6f}, bid_slope: {:.6f}'.format(
+                order_book.price_linear_fit(
+                    'A', 'ask', PRICE_PREDICTION_WINDOW_SECOND),
+                order_book.price_linear_fit(
+                    'A', 'bid', PRICE_PREDICTION_WINDOW_SECOND))
+            # New ticks replace the tables after the log call.
+            for column in list(order_book.table):
+                order_book.table[column] = order_book.table[column] * 0
+            text = str(snapshot)
+        self.assertIn(expected, text)
+        self.assertNotIn('ask_slope: 0.000000', text)
+        self.assertIn('101.0', text)
+        self.assertIs(text, str(snapshot))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,8 +1,10 @@
+import asyncio
 import logging
 import unittest
-from unittest.mock import Mock
+from unittest.mock import MagicMock, Mock, patch
 
 from ok_bot import constants, db, logger, order_book, order_executor, singleton
+from ok_bot.api_v3.okex_sdk.exceptions import OkexAPIException
 from ok_bot.constants import MIN_AVAILABLE_AMOUNT_FOR_CLOSING_ARBITRAGE
 from ok_bot.mock import AsyncMock, MockBookListerner_constantPriceGenerator
 
@@ -17,12 +19,27 @@ class MockOrderListerner_cancelImmediately:
     def __init__(self):
         self.last_subscribed_order_id = None
 
-    def subscribe(self, order_id, subscriber):
+    def subscribe(self, order_id, subscriber, client_oid=None):
+        if order_id is None:
+            # Pre-registration by client_oid, order_id is not known yet.
+            return
         self.last_subscribed_order_id = order_id
         singleton.loop.call_later(
-            1, lambda: subscriber.order_cancelled(order_id))
+            1, lambda: subscriber.order_cancelled(order_id, 0))
 
-    def unsubscribe(self, order_id, subscriber):
+    def unsubscribe(self, order_id, subscriber, client_oid=None):
+        pass
+
+
+class MockOrderListerner_fulfillImmediately:
+    def subscribe(self, order_id, subscriber, client_oid=None):
+        if order_id is None:
+            return
+        singleton.loop.call_later(
+            1, lambda: subscriber.order_fulfilled(
+                order_id, _SIZE, _SIZE, 0, _PRICE, _PRICE))
+
+    def unsubscribe(self, order_id, subscriber, client_oid=None):
         pass
 
 
@@ -88,6 +105,180 @@ class TestOrderExecutor(unittest.TestCase):
         self.assertEqual(
             singleton.order_listener.last_subscribed_order_id, _FAKE_ORDER_ID)
 
+    def test_chase_executor_closes_at_touch(self):
+        singleton.rest_api.close_long_order.__name__ = Mock(
+            return_value='close_long_order')
+        singleton.rest_api.close_long_order.return_value = (
+            _FAKE_ORDER_ID, None)
+        singleton.order_listener = MockOrderListerner_fulfillImmediately()
+
+        async def _testing_coroutine():
+            await singleton.order_book.ready
+            prices = []
+            executor = order_executor.ChaseExecutor(
+                instrument_id=singleton.schema.all_instrument_ids[0],
+                amount=_SIZE,
+                logger=logging,
+                prices=prices)
+            order_status = await executor.close_long_order()
+            self.assertTrue(order_status.succeeded)
+            self.assertEqual(len(prices), 1)
+            self.assertLessEqual(prices[0], _FAKE_MARKET_PRICE)
+
+        singleton.loop.run_until_complete(_testing_coroutine())
+
+    def test_chase_executor_requotes_when_touch_moves_away(self):
+        executor = order_executor.ChaseExecutor(
+            instrument_id='ETH-USD-190329',
+            amount=_SIZE,
+            logger=logging,
+            max_slippage_rate=0.01)
+        executor._side = 'bid'
+        executor._limit_price = 99.0
+        executor._order_price = executor._quote(100.0)
+        executor._executor = Mock()
+
+        # Touch moved towards us, the order is still marketable.
+        executor.tick_received('ETH-USD-190329', [100.2], [1], [100.1], [1],
+                               timestamp=None)
+        executor._executor.expire.assert_not_called()
+
+        executor.tick_received('ETH-USD-190329', [99.9], [1], [99.8], [1],
+                               timestamp=None)
+        executor._executor.expire.assert_called_once()
+
+
+@patch('ok_bot.constants.CHASE_RETRY_INTERVAL_SECOND', 0.01)
+@patch('ok_bot.constants.CHASE_MAX_RETRY_INTERVAL_SECOND', 0.02)
+@patch('ok_bot.constants.CHASE_MAX_FAILED_ORDERS', 3)
+class TestChaseExecutorOffline(unittest.TestCase):
+    """ChaseExecutor with a fake close_functor, no OKEX connection."""
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        order_book = MagicMock()
+        order_book.market_depth.return_value.best_bid_price.return_value = \
+            _FAKE_MARKET_PRICE
+        for name, value in [('order_book', order_book),
+                            ('book_listener', MagicMock())]:
+            patcher = patch.object(singleton, name, value, create=True)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def _chase(self, results, amount=3):
+        """results: OrderExecutionResult of each order the chase places."""
+        results = iter(results)
+        amounts = []
+
+        async def _close_functor(executor):
+            amounts.append(executor._amount)
+            return next(results)
+
+        chase = order_executor.ChaseExecutor(
+            instrument_id='ETH-USD-190329', amount=amount, logger=logging)
+        chase._side = 'bid'
+        result = self.loop.run_until_complete(chase._chase(_close_functor))
+        return result, amounts
+
+    @staticmethod
+    def _failed(amount):
+        return order_executor.OrderExecutionResult(
+            order_id=None, amount=amount, fulfilled_quantity=0)
+
+    def test_partial_fills(self):
+        result, amounts = self._chase([
+            order_executor.OrderExecutionResult(1, 3, 1),
+            self._failed(2),
+            order_executor.OrderExecutionResult(2, 2, 0),
+            order_executor.OrderExecutionResult(3, 2, 2),
+        ])
+        self.assertEqual([3, 2, 2, 2], amounts)
+        self.assertTrue(result.succeeded)
+        self.assertEqual(3, result.fulfilled_quantity)
+        self.assertEqual(3, result.order_id)
+        self.assertEqual([1, 2, 3], result.order_ids)
+
+    def test_gives_up_after_failed_orders(self):
+        result, amounts = self._chase([
+            order_executor.OrderExecutionResult(1, 3, 1),
+        ] + [self._failed(2)] * 3)
+        self.assertEqual([3, 2, 2, 2], amounts)
+        self.assertFalse(result.succeeded)
+        self.assertEqual(3, result.amount)
+        self.assertEqual(1, result.fulfilled_quantity)
+        self.assertEqual([1], result.order_ids)
+
+    def test_nothing_placed(self):
+        result, _ = self._chase([self._failed(3)] * 3)
+        self.assertFalse(result.succeeded)
+        self.assertIsNone(result.order_id)
+        self.assertEqual(0, result.fulfilled_quantity)
+        self.assertEqual([], result.order_ids)
+
+
+class TestOrderStateUnknown(unittest.TestCase):
+    """Placement that failed without telling whether the order exists."""
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.rest_api = AsyncMock()
+        self.rest_api.close_long_order.__name__ = 'close_long_order'
+        self.rest_api.close_long_order.return_value = (
+            None, constants.REST_API_ERROR_CODE__ORDER_STATE_UNKNOWN)
+        # Nothing comes through the websocket.
+        for name, value in [('loop', self.loop),
+                            ('rest_api', self.rest_api),
+                            ('order_book', MagicMock()),
+                            ('order_listener', MagicMock())]:
+            patcher = patch.object(singleton, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def _close_long_order(self):
+        executor = order_executor.OrderExecutor(
+            instrument_id='ETH-USD-190329',
+            amount=2,
+            price=_PRICE,
+            timeout_sec=0.01,
+            is_market_order=False,
+            logger=logging)
+        return self.loop.run_until_complete(executor.close_long_order())
+
+    def test_revoked_by_client_oid(self):
+        self.rest_api.get_order_info.side_effect = [
+            {'order_id': str(_FAKE_ORDER_ID)},
+            {'status': str(constants.ORDER_STATUS_CODE__PARTIALLY_FILLED),
+             'filled_qty': '1'},
+        ]
+        self.rest_api.revoke_order.return_value = {
+            'result': True, 'order_id': str(_FAKE_ORDER_ID)}
+        result = self._close_long_order()
+        self.assertEqual(_FAKE_ORDER_ID, result.order_id)
+        self.assertEqual(1, result.fulfilled_quantity)
+        client_oid = self.rest_api.close_long_order.call_args[1][
+            'custom_order_id']
+        self.assertEqual(client_oid,
+                         self.rest_api.get_order_info.call_args_list[0][0][0])
+        self.rest_api.revoke_order.assert_called_once_with(
+            'ETH-USD-190329', _FAKE_ORDER_ID)
+
+    def test_not_placed(self):
+        response = Mock(status_code=400)
+        response.json.return_value = {
+            'code': constants.REST_API_ERROR_CODE__PENDING_ORDER_NOT_EXIST,
+            'message': 'order not exist'}
+        self.rest_api.get_order_info.side_effect = OkexAPIException(response)
+        result = self._close_long_order()
+        self.assertIsNone(result.order_id)
+        self.assertEqual(0, result.fulfilled_quantity)
+        self.rest_api.revoke_order.assert_not_called()
+
 
 if __name__ == '__main__':
     unittest.main()
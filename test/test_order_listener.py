@@ -0,0 +1,91 @@
+import unittest
+from unittest.mock import Mock
+
+from ok_bot import constants
+from ok_bot.order_listener import OrderListener
+
+_ORDER_ID = 12345
+_CLIENT_OID = 'okbtestclientoid'
+
+
+def _send_cancelled(listener, order_id, client_oid=None):
+    listener.received_futures_order(
+        leverage=20,
+        size=1,
+        filled_qty=0,
+        price=100,
+        fee=0,
+        contract_val=10,
+        price_avg=0,
+        type=constants.ORDER_TYPE_CODE__OPEN_LONG,
+        instrument_id='ETH-USD-190329',
+        order_id=order_id,
+        timestamp='2019-03-01T00:00:00.000Z',
+        status=constants.ORDER_STATUS_CODE__CANCELLED,
+        client_oid=client_oid)
+
+
+class TestOrderListener(unittest.TestCase):
+    def setUp(self):
+        self.listener = OrderListener()
+        self.responder = Mock()
+
+    def test_route_by_client_oid_before_order_id_is_known(self):
+        self.listener.subscribe(None, self.responder, client_oid=_CLIENT_OID)
+        _send_cancelled(self.listener, _ORDER_ID, client_oid=_CLIENT_OID)
+        self.responder.order_cancelled.assert_called_once_with(_ORDER_ID, 0)
+
+        # Binding the order id later must not replay the update.
+        self.listener.subscribe(
+            _ORDER_ID, self.responder, client_oid=_CLIENT_OID)
+        self.responder.order_cancelled.assert_called_once_with(_ORDER_ID, 0)
+
+    def test_route_by_order_id_after_binding(self):
+        self.listener.subscribe(None, self.responder, client_oid=_CLIENT_OID)
+        self.listener.subscribe(
+            _ORDER_ID, self.responder, client_oid=_CLIENT_OID)
+        # Update without client_oid is still delivered exactly once.
+        _send_cancelled(self.listener, _ORDER_ID)
+        self.responder.order_cancelled.assert_called_once_with(_ORDER_ID, 0)
+
+    def test_buffer_when_subscribed_after_update(self):
+        _send_cancelled(self.listener, _ORDER_ID)
+        self.responder.order_cancelled.assert_not_called()
+        self.listener.subscribe(_ORDER_ID, self.responder)
+        self.responder.order_cancelled.assert_called_once_with(_ORDER_ID, 0)
+
+    def test_unsubscribe_releases_client_oid(self):
+        self.listener.subscribe(
+            _ORDER_ID, self.responder, client_oid=_CLIENT_OID)
+        self.listener.unsubscribe(
+            _ORDER_ID, self.responder, client_oid=_CLIENT_OID)
+        _send_cancelled(self.listener, _ORDER_ID, client_oid=_CLIENT_OID)
+        self.responder.order_cancelled.assert_not_called()
+
+    def test_update_after_unsubscribe_is_not_bound(self):
+        self.listener.subscribe(
+            _ORDER_ID, self.responder, client_oid=_CLIENT_OID)
+        self.listener.unsubscribe(
+            _ORDER_ID, self.responder, client_oid=_CLIENT_OID)
+        _send_cancelled(self.listener, _ORDER_ID, client_oid=_CLIENT_OID)
+        self.assertEqual({}, self.listener._client_oid_to_order_id)
+        self.assertEqual({}, self.listener._order_id_to_client_oid)
+
+    def test_final_order_info(self):
+        self.assertIsNone(self.listener.final_order_info(_ORDER_ID))
+        _send_cancelled(self.listener, _ORDER_ID)
+        info = self.listener.final_order_info(str(_ORDER_ID))
+        self.assertEqual(_ORDER_ID, info['order_id'])
+        self.assertEqual(constants.ORDER_STATUS_CODE__CANCELLED,
+                         info['status'])
+        self.assertEqual('ETH-USD-190329', info['instrument_id'])
+
+    def test_final_order_info_is_bounded(self):
+        for order_id in range(constants.ORDER_INFO_CACHE_SIZE + 10):
+            _send_cancelled(self.listener, order_id)
+        self.assertIsNone(self.listener.final_order_info(9))
+        self.assertIsNotNone(self.listener.final_order_info(10))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import bisect
+import random
+import unittest
+from unittest import TestCase
+
+import numpy as np
+
+from ok_bot.order_statistics import IndexableSkipList, RollingOrderStatistics
+
+
+class TestIndexableSkipList(TestCase):
+    def test_matches_sorted_list(self):
+        random.seed(0)
+        skip_list = IndexableSkipList()
+        expected = []
+        for step in range(5000):
+            if expected and random.random() < 0.4:
+                value = random.choice(expected)
+                expected.remove(value)
+                skip_list.remove(value)
+            else:
+                value = random.randint(0, 100)
+                bisect.insort(expected, value)
+                skip_list.insert(value)
+            if step % 250 == 0:
+                self.assertEqual(expected, list(skip_list))
+                self.assertEqual(len(expected), len(skip_list))
+                for i in range(0, len(expected), 3):
+                    self.assertEqual(expected[i], skip_list[i])
+                for value in range(-1, 102, 4):
+                    self.assertEqual(bisect.bisect_left(expected, value),
+                                     skip_list.rank(value))
+
+    def test_remove_missing(self):
+        skip_list = IndexableSkipList()
+        skip_list.insert(1)
+        with self.assertRaises(ValueError):
+            skip_list.remove(2)
+        with self.assertRaises(IndexError):
+            skip_list[1]
+
+
+class TestRollingOrderStatistics(TestCase):
+    def test_matches_numpy_over_window(self):
+        np.random.seed(0)
+        window = 50
+        stats = RollingOrderStatistics(time_window_sec=window)
+        values = np.random.standard_cauchy(500)
+        for t, value in enumerate(values):
+            stats.add(t * 0.5, value)
+            in_window = values[max(0, t - 2 * window):t + 1]
+            self.assertEqual(len(in_window), len(stats))
+            self.assertAlmostEqual(np.median(in_window), stats.median())
+            self.assertAlmostEqual(np.quantile(in_window, 0.9),
+                                   stats.quantile(0.9))
+            self.assertEqual(in_window.min(), stats.min())
+            self.assertEqual(in_window.max(), stats.max())
+            self.assertAlmostEqual((in_window < value).mean(),
+                                   stats.rank(value))
+
+    def test_empty(self):
+        stats = RollingOrderStatistics(time_window_sec=10)
+        self.assertTrue(np.isnan(stats.median()))
+        stats.add(0, 1.0)
+        stats.evict(100)
+        self.assertEqual(0, len(stats))
+        self.assertTrue(np.isnan(stats.min()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+import os
+import sqlite3
+import time
+import unittest
+from unittest import TestCase
+from unittest.mock import patch
+
+import numpy as np
+
+from ok_bot import constants
+from ok_bot.pnl import (date_range_sec, load, order_metrics, summarize,
+                        transaction_metrics)
+from ok_bot.report import get_order_gain, get_price_slippage
+
+START = 1551398400.0  # 2019-03-01 00:00:00 UTC
+
+
+class TestPnl(TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        self.conn.executescript('''
+            CREATE TABLE runtime_transactions (
+                transaction_id TEXT PRIMARY KEY, status TEXT,
+                start_time_sec NUMERIC, end_time_sec NUMERIC,
+                estimate_net_profit NUMERIC, slow_instrument_id TEXT,
+                fast_instrument_id TEXT, strategy TEXT);
+            CREATE TABLE runtime_orders (
+                order_id INTEGER PRIMARY KEY, transaction_id TEXT,
+                type INTEGER, filled_qty INTEGER, price NUMERIC,
+                price_avg NUMERIC, fee NUMERIC);
+        ''')
+        self.orders = {
+            # Slow leg shorts the quarter, fast leg longs the week.
+            't1': [(11, constants.ORDER_TYPE_CODE__OPEN_SHORT, 103.0, 103.333),
+                   (12, constants.ORDER_TYPE_CODE__OPEN_LONG, 101.0, 101.111),
+                   (13, constants.ORDER_TYPE_CODE__CLOSE_LONG, 102.0, 102.222),
+                   (14, constants.ORDER_TYPE_CODE__CLOSE_SHORT, 104.0,
+                    104.444)],
+            't2': [(21, constants.ORDER_TYPE_CODE__OPEN_LONG, 100.0, 100.1),
+                   (22, constants.ORDER_TYPE_CODE__OPEN_SHORT, 100.5, 100.4),
+                   (23, constants.ORDER_TYPE_CODE__CLOSE_SHORT, 100.2, 100.2),
+                   (24, constants.ORDER_TYPE_CODE__CLOSE_LONG, 100.3, 100.3)],
+        }
+        self.conn.executemany(
+            'INSERT INTO runtime_transactions VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            [('t1', 'ended_normally', START + 60, START + 90, 0.001,
+              'ETH-USD-190329', 'ETH-USD-190301', 'PercentageTriggerStrategy'),
+             ('t2', 'ended_normally', START + 3700, START + 3800, None,
+              'ETH-USD-190329', 'ETH-USD-190301', 'SimpleTriggerStrategy'),
+             ('t3', 'ended_normally', START - 10, START, 0, '', '', '')])
+        self.conn.executemany(
+            'INSERT INTO runtime_orders VALUES (?, ?, ?, 1, ?, ?, -0.01)',
+            [(order_id, transaction_id, type, price, price_avg)
+             for transaction_id, orders in self.orders.items()
+             for order_id, type, price, price_avg in orders])
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_matches_report(self):
+        transactions, orders = load(self.conn, START, START + 86400)
+        self.assertEqual(['t1', 't2'], transactions['transaction_id'].tolist())
+        orders = order_metrics(transactions, orders)
+        transactions = transaction_metrics(transactions, orders)
+
+        expected_gain = {}
+        for i, order_id in enumerate(orders['order_id']):
+            transaction_id = orders['transaction_id'][i]
+            row = {'filled_qty': 1, 'contract_val': 10, 'fee': -0.01,
+                   'type': orders['type'][i],
+                   'price_avg': orders['price_avg'][i],
+                   'original_price': orders['price'][i]}
+            self.assertAlmostEqual(get_order_gain(row), orders['gain'][i])
+            self.assertAlmostEqual(get_price_slippage(row),
+                                   orders['slippage'][i])
+            expected_gain[transaction_id] = \
+                expected_gain.get(transaction_id, 0) + get_order_gain(row)
+        for i, transaction_id in enumerate(transactions['transaction_id']):
+            self.assertAlmostEqual(expected_gain[transaction_id],
+                                   transactions['gain'][i])
+        self.assertAlmostEqual(expected_gain['t1'] - 0.001,
+                               transactions['estimate_error'][0])
+        self.assertTrue(np.isnan(transactions['estimate_error'][1]))
+        self.assertEqual([30, 100], transactions['hold_time_sec'].tolist())
+        self.assertEqual(['2019-03-01T00', '2019-03-01T01'],
+                         transactions['hour'].tolist())
+
+        legs = dict(zip(orders['order_id'].tolist(), orders['leg']))
+        self.assertEqual({11: 'slow', 12: 'fast', 13: 'fast', 14: 'slow',
+                          21: 'slow', 22: 'fast', 23: 'fast', 24: 'slow'},
+                         legs)
+
+    def test_summarize(self):
+        tables = summarize(self.conn, START, START + 86400)
+        by_pair = tables['by pair']
+        self.assertEqual(['ETH-USD-190329/ETH-USD-190301'],
+                         by_pair['pair'].tolist())
+        self.assertEqual([2], by_pair['count'].tolist())
+        self.assertEqual(2, len(tables['by hour']))
+        self.assertEqual(['PercentageTriggerStrategy',
+                          'SimpleTriggerStrategy'],
+                         tables['by strategy']['strategy'].tolist())
+        by_leg = tables['slippage by leg and order type']
+        # Slow leg is short in t1 and long in t2.
+        self.assertEqual([1] * 8, by_leg['count'].tolist())
+        self.assertEqual(8, by_leg['filled_qty'].sum())
+
+    def test_empty(self):
+        tables = summarize(self.conn, START + 86400, START + 2 * 86400)
+        self.assertTrue(all(table.empty for table in tables.values()))
+
+
+class TestDateRange(TestCase):
+    def test_utc_days(self):
+        # Not the local days.
+        patcher = patch.dict(os.environ, {'TZ': 'Asia/Shanghai'})
+        patcher.start()
+        time.tzset()
+        self.addCleanup(time.tzset)
+        self.addCleanup(patcher.stop)
+        self.assertEqual((START, START + 24 * 3600),
+                         date_range_sec('2019-03-01', '2019-03-01'))
+
+    def test_whole_month_and_year(self):
+        april = START + 31 * 24 * 3600
+        self.assertEqual((START, april), date_range_sec('2019-03', '2019-03'))
+        start, end = date_range_sec('2019', '2019')
+        self.assertEqual(365 * 24 * 3600, end - start)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+from unittest import TestCase
+
+import numpy as np
+
+from ok_bot.order_book import AvailableOrder
+from ok_bot.price import Price
+from ok_bot.trigger_strategy import calculate_amount_margin
+
+
+class TestPrice(TestCase):
+    def test_exact_arithmetic(self):
+        a = Price.from_real('0.3', 0.001)
+        b = Price.from_real(0.1, 0.001)
+        self.assertEqual(Price(200, 1000), a - b)
+        self.assertEqual(Price(400, 1000), a + b)
+        self.assertEqual(0.2, float(a - b))
+        self.assertNotEqual(0.2, 0.3 - 0.1)
+        self.assertEqual('0.2', str(a - b))
+
+    def test_tick_difference(self):
+        a = Price.from_real('3635.11', 0.01)
+        b = Price.from_real(3634.87, 0.01)
+        self.assertEqual(24, (a - b).ticks)
+        self.assertEqual(Price(24, 100), a - b)
+        self.assertEqual('3635.11', str(a))
+        self.assertEqual(3635.11, float(a))
+        self.assertTrue(b < a and a > 3635 and 3635 < a)
+
+    def test_invalid_tick_size(self):
+        for tick_size in [5, 2.5, 0.003, 0, -0.01]:
+            with self.assertRaises(ValueError):
+                Price.from_real(5, tick_size)
+        self.assertEqual('5.0', str(Price.from_real(5, 1)))
+        self.assertEqual(Price(20, 4), Price.from_real('5.01', 0.25))
+
+    def test_same_float_as_decimal_string(self):
+        for raw in ['3635.11', '3634.87', '0.01', '181.113', '7.5']:
+            price = Price.from_real(raw, 0.001)
+            self.assertEqual(float(raw), float(price))
+            self.assertEqual(float(raw), float(str(price)))
+
+    def test_mixed_with_float(self):
+        price = Price.from_real('100.5', 0.01)
+        self.assertEqual(101.0, price + 0.5)
+        self.assertEqual(101.0, 0.5 + price)
+        self.assertEqual(100.0, price - 0.5)
+        self.assertEqual(0.5, 101 - price)
+        self.assertEqual(201.0, price * 2)
+        self.assertEqual(2.0, 201 / price)
+        self.assertTrue(100 < price < 101)
+        self.assertTrue(price == 100.5)
+        self.assertEqual('100.500', f'{price:.3f}')
+        self.assertEqual('100.500', '%.3f' % price)
+
+    def test_ordering(self):
+        prices = [Price.from_real(x, 0.01) for x in [3.5, 1.25, 2.0]]
+        self.assertEqual([1.25, 2.0, 3.5], [float(x) for x in sorted(prices)])
+        self.assertEqual(sorted([AvailableOrder(prices[0], 1),
+                                 AvailableOrder(prices[0], 0)])[0].volume, 0)
+
+    def test_numpy(self):
+        prices = [Price.from_real(x, 0.01) for x in [3.5, 1.25]]
+        self.assertEqual([350, 125], Price.ticks_array(prices).tolist())
+        self.assertEqual(np.int64, Price.ticks_array(prices).dtype)
+        self.assertEqual([3.5, 1.25],
+                         np.asarray(prices, dtype='float64').tolist())
+
+    def test_amount_margin_on_price_stacks(self):
+        ask_stack = [AvailableOrder(Price.from_real(p, 0.01), v)
+                     for p, v in [(100.1, 3), (100.2, 5), (100.3, 7)]]
+        bid_stack = [AvailableOrder(Price.from_real(p, 0.01), v)
+                     for p, v in [(100.2, 4), (100.1, 4), (100.0, 9)]]
+        for gap in [-0.1, 0, 0.1, 0.2, 0.3]:
+            expected = calculate_amount_margin(
+                ask_stack, bid_stack, lambda ask, bid: ask - bid <= gap)
+            self.assertEqual(
+                expected,
+                calculate_amount_margin(ask_stack, bid_stack, max_gap=gap))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,11 @@
+import asyncio
 import logging
 import unittest
-from unittest.mock import call
+from unittest.mock import Mock, call, patch
 
 from ok_bot import constants, logger, singleton
 from ok_bot.mock import AsyncMock
-from ok_bot.report import Report
+from ok_bot.report import OrderRecord, Report
 
 
 def expected_net_profit_way_1():
@@ -133,5 +134,58 @@ class TestArbitrageExecution(unittest.TestCase):
         singleton.loop.run_until_complete(_testing_coroutine())
 
 
+class TestReportFromOrderCache(unittest.TestCase):
+    def _order_info(self, order_id, type, price_avg):
+        return {'contract_val': '10', 'fee': '-0.01', 'filled_qty': '1',
+                'instrument_id': 'ETH-USD-190201', 'leverage': '10',
+                'order_id': str(order_id), 'price': '100.0',
+                'price_avg': str(price_avg), 'size': '1',
+                'status': str(constants.ORDER_STATUS_CODE__FULFILLED),
+                'timestamp': '2019-02-06T03:44:01.000Z', 'type': str(type)}
+
+    def test_order_record(self):
+        record = OrderRecord(
+            'slow_open',
+            self._order_info(1, constants.ORDER_TYPE_CODE__OPEN_SHORT, 99.0),
+            100.0)
+        self.assertEqual('short+', record.direction)
+        self.assertAlmostEqual(-10 / 99.0 - 0.01, record.gain)
+        self.assertAlmostEqual(0.01, record.slippage)
+        with self.assertRaises(AttributeError):
+            record.unknown = 1
+
+    def test_cached_orders_skip_rest_api(self):
+        cached = {
+            1: self._order_info(1, constants.ORDER_TYPE_CODE__OPEN_LONG,
+                                101.111),
+            2: self._order_info(2, constants.ORDER_TYPE_CODE__CLOSE_LONG,
+                                102.222),
+        }
+        order_listener = Mock()
+        order_listener.final_order_info.side_effect = cached.get
+        rest_api = AsyncMock()
+        with patch.object(singleton, 'order_listener', order_listener), \
+                patch.object(singleton, 'rest_api', rest_api), \
+                patch.object(singleton, 'db', Mock()):
+            report = Report(transaction_id='transaction-id',
+                            slow_instrument_id='ETH-USD-190201',
+                            fast_instrument_id='ETH-USD-190329',
+                            logger=logging)
+            report.slow_open_order_id = 1
+            report.slow_close_order_id = 2
+            report.slow_open_prices = [101.0]
+            report.slow_close_prices = [102.0]
+            loop = asyncio.new_event_loop()
+            net_profit = loop.run_until_complete(report.report_profit())
+            loop.close()
+
+        rest_api.get_order_info.assert_not_called()
+        self.assertAlmostEqual(10 / 101.111 - 10 / 102.222 - 0.02,
+                               net_profit)
+        self.assertEqual(['slow_open', 'slow_close'],
+                         list(report.table.index))
+        self.assertIn('slow- long-  [102.0] -> 102.222', str(report))
+
+
 if __name__ == '__main__':
     unittest.main()
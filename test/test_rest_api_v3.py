@@ -0,0 +1,100 @@
+import unittest
+from unittest.mock import Mock, patch
+
+import requests
+
+from ok_bot import constants, singleton
+from ok_bot.api_v3.okex_sdk.exceptions import OkexAPIException
+from ok_bot.rest_api_v3 import RestApiV3
+
+_CLIENT_OID = 'okbtestclientoid'
+_INSTRUMENT_ID = 'ETH-USD-190329'
+
+
+def _api_exception(status_code, code):
+    response = Mock(status_code=status_code)
+    response.json.return_value = {'code': code, 'message': 'error'}
+    return OkexAPIException(response)
+
+
+_NOT_FOUND = _api_exception(
+    400, constants.REST_API_ERROR_CODE__PENDING_ORDER_NOT_EXIST)
+
+
+class TestCreateOrder(unittest.TestCase):
+    def setUp(self):
+        singleton.schema = Mock()
+        singleton.schema.tick_size.return_value = 0.001
+        # No key files nor OKEX connection, sleeps advance a fake clock.
+        self.now = 0.0
+        clock = self._patch('ok_bot.rest_api_v3.time')
+        clock.time.side_effect = lambda: self.now
+        clock.sleep.side_effect = self._sleep
+        self._patch('ok_bot.api_v3_key_reader.read_keys',
+                    return_value=('key', 'secret', 'pass phrase'))
+        self._patch('ok_bot.rest_api_v3.FutureAPI')
+        self.rest_api = RestApiV3()
+        self.take_order = self.rest_api.future_sdk.take_order
+        self.get_order_info = self.rest_api.future_sdk.get_order_info
+
+    def _patch(self, target, **kwargs):
+        patcher = patch(target, **kwargs)
+        self.addCleanup(patcher.stop)
+        return patcher.start()
+
+    def _sleep(self, seconds):
+        self.now += seconds
+
+    def _create_order(self):
+        return self.rest_api.create_order(
+            _CLIENT_OID, _INSTRUMENT_ID,
+            constants.ORDER_TYPE_CODE__OPEN_LONG, 1, 100.0)
+
+    def test_placed(self):
+        self.take_order.return_value = {'result': True, 'order_id': '123'}
+        self.assertEqual((123, None), self._create_order())
+        self.get_order_info.assert_not_called()
+
+    def test_rejected(self):
+        self.take_order.side_effect = _api_exception(400, 32016)
+        self.assertEqual((None, -1), self._create_order())
+        self.get_order_info.assert_not_called()
+
+    def test_landed_despite_transport_error(self):
+        self.take_order.side_effect = requests.exceptions.ConnectionError()
+        self.get_order_info.return_value = {'order_id': '123'}
+        self.assertEqual((123, None), self._create_order())
+        self.assertEqual(1, self.take_order.call_count)
+
+    def test_retry_rejected_as_duplicate(self):
+        # The first request landed after the lookup said it didn't.
+        self.take_order.side_effect = [requests.exceptions.ConnectionError(),
+                                       _api_exception(400, 32000)]
+        self.get_order_info.side_effect = [_NOT_FOUND, {'order_id': '123'}]
+        self.assertEqual((123, None), self._create_order())
+
+    def test_lookup_until_definite(self):
+        self.take_order.side_effect = requests.exceptions.ConnectionError()
+        self.get_order_info.side_effect = (
+            [requests.exceptions.ConnectionError(),
+             _api_exception(500, 'None')] +
+            [_NOT_FOUND] * constants.ORDER_PLACEMENT_MAX_ATTEMPTS)
+        self.assertEqual((None, -1), self._create_order())
+        self.assertEqual(constants.ORDER_PLACEMENT_MAX_ATTEMPTS,
+                         self.take_order.call_count)
+        self.assertEqual(constants.ORDER_PLACEMENT_MAX_ATTEMPTS + 2,
+                         self.get_order_info.call_count)
+
+    def test_lookup_gives_up(self):
+        self.take_order.side_effect = requests.exceptions.ConnectionError()
+        self.get_order_info.side_effect = requests.exceptions.ConnectionError()
+        self.assertEqual(
+            (None, constants.REST_API_ERROR_CODE__ORDER_STATE_UNKNOWN),
+            self._create_order())
+        self.assertEqual(1, self.take_order.call_count)
+        self.assertLessEqual(self.now, constants.ORDER_LOOKUP_MAX_WAIT_SECOND)
+        self.assertGreater(self.get_order_info.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+import json
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest import TestCase
+from unittest.mock import patch
+from urllib.parse import parse_qs
+
+from ok_bot.slack import SlackNotifier
+
+
+class _FakeSlack(HTTPServer):
+    """Stand-in for the Slack Web API recording the posted texts."""
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _FakeSlackHandler)
+        self.posts = []  # (time, path, form)
+        self.responses = []  # (status, headers) to reply before 200s
+        self.unblocked = threading.Event()
+        self.unblocked.set()
+        self._thread = threading.Thread(target=self.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+
+    @property
+    def api_url(self):
+        return f'http://127.0.0.1:{self.server_port}/api/'
+
+    @property
+    def texts(self):
+        return [form['text'][0] for _, _, form in self.posts]
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _FakeSlackHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.posts.append(
+            (time.time(), self.path, parse_qs(body.decode())))
+        self.server.unblocked.wait()
+        status, headers = (self.server.responses.pop(0)
+                           if self.server.responses else (200, {}))
+        payload = json.dumps({'ok': status == 200}).encode()
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@patch('ok_bot.constants.SLACK_BATCH_WINDOW_SECOND', 0.2)
+@patch('ok_bot.constants.SLACK_MIN_POST_INTERVAL_SECOND', 0.3)
+class TestSlackNotifier(TestCase):
+    def setUp(self):
+        self.slack = _FakeSlack()
+        self.notifier = SlackNotifier(api_url=self.slack.api_url,
+                                      token='token', channel='channel')
+
+    def tearDown(self):
+        self.notifier.stop()
+        self.slack.close()
+
+    def test_burst_is_one_post(self):
+        for i in range(5):
+            self.notifier.send(f'message {i}')
+        self.notifier.send({'not': 'a string'})
+        self.assertTrue(self.notifier.flush(timeout=10))
+        self.assertEqual(1, len(self.slack.posts))
+        _, path, form = self.slack.posts[0]
+        self.assertEqual('/api/chat.postMessage', path)
+        self.assertEqual(['token'], form['token'])
+        self.assertEqual(['channel'], form['channel'])
+        self.assertEqual(
+            '\n'.join([f'message {i}' for i in range(5)] +
+                      ["{'not': 'a string'}"]),
+            self.slack.texts[0])
+        self.assertEqual(6, self.notifier.num_messages)
+        self.assertEqual(1, self.notifier.num_posts)
+
+    def test_rate_limited(self):
+        for i in range(3):
+            self.notifier.send(f'message {i}')
+            self.assertTrue(self.notifier.flush(timeout=10))
+        self.assertEqual(3, len(self.slack.posts))
+        times = [t for t, _, _ in self.slack.posts]
+        for earlier, later in zip(times, times[1:]):
+            self.assertGreaterEqual(later - earlier, 0.25)
+
+    @patch('ok_bot.constants.SLACK_MAX_POST_CHARS', 25)
+    def test_long_burst_is_split(self):
+        for i in range(4):
+            self.notifier.send(f'message {i}')
+        self.notifier.send('x' * 100)
+        self.assertTrue(self.notifier.flush(timeout=10))
+        self.assertEqual(['message 0\nmessage 1', 'message 2\nmessage 3',
+                          'x' * 25], self.slack.texts)
+
+    @patch('ok_bot.constants.SLACK_QUEUE_SIZE', 2)
+    def test_overflow_is_summarized(self):
+        self.notifier.stop()
+        notifier = SlackNotifier(api_url=self.slack.api_url)
+        self.addCleanup(notifier.stop)
+        # Keeps the worker busy in the first post.
+        self.slack.unblocked.clear()
+        notifier.send('first')
+        while not self.slack.posts:
+            time.sleep(0.01)
+
+        results = [notifier.send(f'message {i}') for i in range(5)]
+        self.assertEqual([True, True, False, False, False], results)
+        self.assertEqual(3, notifier.dropped)
+        self.slack.unblocked.set()
+        self.assertTrue(notifier.flush(timeout=10))
+        self.assertEqual(
+            ['first', 'message 0\nmessage 1\n(3 messages dropped)'],
+            self.slack.texts)
+
+    @patch('ok_bot.constants.SLACK_QUEUE_SIZE', 2)
+    @patch('ok_bot.constants.SLACK_MAX_POST_CHARS', 30)
+    def test_overflow_summary_fits_in_post(self):
+        self.notifier.stop()
+        notifier = SlackNotifier(api_url=self.slack.api_url)
+        self.addCleanup(notifier.stop)
+        self.slack.unblocked.clear()
+        notifier.send('first')
+        while not self.slack.posts:
+            time.sleep(0.01)
+        for i in range(5):
+            notifier.send(f'message {i}')
+        self.slack.unblocked.set()
+        self.assertTrue(notifier.flush(timeout=10))
+        self.assertEqual(
+            ['first', 'message 0\n(3 messages dropped)', 'message 1'],
+            self.slack.texts)
+
+    @patch('ok_bot.constants.SLACK_QUEUE_SIZE', 2)
+    def test_full_queue_does_not_block(self):
+        self.notifier.stop()
+        notifier = SlackNotifier(api_url=self.slack.api_url)
+        self.slack.unblocked.clear()
+        notifier.send('first')
+        while not self.slack.posts:
+            time.sleep(0.01)
+        notifier.send('message 0')
+        notifier.send('message 1')
+
+        start = time.time()
+        self.assertFalse(notifier.flush(timeout=0.1))
+        notifier.stop(timeout=0.1)
+        self.assertLess(time.time() - start, 1)
+        self.slack.unblocked.set()
+        notifier.stop()
+        self.assertEqual(['first', 'message 0\nmessage 1'], self.slack.texts)
+
+    def test_retry_after_429(self):
+        self.slack.responses.append((429, {'Retry-After': '0.5'}))
+        self.notifier.send('message')
+        self.assertTrue(self.notifier.flush(timeout=10))
+        self.assertEqual(['message', 'message'], self.slack.texts)
+        self.assertGreaterEqual(
+            self.slack.posts[1][0] - self.slack.posts[0][0], 0.45)
+        self.assertEqual(1, self.notifier.num_posts)
+
+
+if __name__ == '__main__':
+    unittest.main()
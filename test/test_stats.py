@@ -0,0 +1,92 @@
+import unittest
+from unittest import TestCase
+from unittest.mock import patch
+
+import numpy as np
+
+from ok_bot.stats import Sketch, Stats
+
+
+class TestSketch(TestCase):
+    def setUp(self):
+        np.random.seed(0)
+        self.samples = np.concatenate([np.random.lognormal(0, 2, 5000),
+                                       -np.random.lognormal(0, 1, 1000),
+                                       np.zeros(10)])
+
+    def test_moments_are_exact(self):
+        sketch = Sketch()
+        for x in self.samples:
+            sketch.add(x)
+        self.assertEqual(len(self.samples), sketch.count)
+        self.assertAlmostEqual(self.samples.mean(), sketch.mean)
+        self.assertAlmostEqual(self.samples.var(ddof=1), sketch.var(),
+                               places=6)
+        self.assertEqual(self.samples.min(), sketch.min)
+        self.assertEqual(self.samples.max(), sketch.max)
+
+    def test_quantile_relative_accuracy(self):
+        sketch = Sketch(relative_accuracy=0.01)
+        for x in self.samples:
+            sketch.add(x)
+        ordered = np.sort(self.samples)
+        for q in [0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99]:
+            expected = ordered[int(q * (len(ordered) - 1))]
+            self.assertLessEqual(abs(sketch.quantile(q) - expected),
+                                 0.01 * abs(expected) + 1e-12)
+
+    def test_merge(self):
+        merged, left, right = Sketch(), Sketch(), Sketch()
+        for i, x in enumerate(self.samples):
+            merged.add(x)
+            (left if i % 3 else right).add(x)
+        left.merge(right)
+        self.assertEqual(merged.count, left.count)
+        self.assertAlmostEqual(merged.mean, left.mean)
+        self.assertAlmostEqual(merged.var(), left.var(), places=6)
+        self.assertEqual(list(merged.items()), list(left.items()))
+
+    def test_bounded_buckets(self):
+        sketch = Sketch(max_buckets=64)
+        for x in self.samples:
+            sketch.add(x)
+        self.assertLessEqual(len(sketch.positive), 64)
+        self.assertEqual(len(self.samples),
+                         sum(count for _, count in sketch.items()))
+
+
+class TestStats(TestCase):
+    @patch('ok_bot.stats.time.time')
+    def test_window(self, now):
+        now.return_value = 1000.0
+        stats = Stats(time_window_sec=10, slots=10)
+        for x in range(5):
+            stats.add(x)
+        now.return_value = 1005.0
+        for x in range(5, 10):
+            stats.add(x)
+        self.assertEqual(10, stats.size)
+        self.assertAlmostEqual(4.5, stats.mean())
+        now.return_value = 1012.0
+        self.assertEqual(5, stats.size)
+        self.assertAlmostEqual(7, stats.mean())
+        now.return_value = 1020.0
+        self.assertEqual(0, stats.size)
+        self.assertEqual('', stats.histogram())
+
+    def test_histogram(self):
+        stats = Stats(time_window_sec=60)
+        for x in range(100):
+            stats.add(x)
+        stats.add(50)
+        lines = stats.histogram().split('\n')
+        self.assertEqual(10, len(lines))
+        self.assertEqual(101, sum(int(line.split('[')[1].split(']')[0])
+                                  for line in lines))
+        self.assertEqual(1, sum(line.endswith('<--') for line in lines))
+        self.assertTrue(lines[4].endswith('<--'))
+        self.assertFalse(stats.histogram(mark_last=False).endswith('<--'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+import os
+import tempfile
+import unittest
+from unittest import TestCase
+from unittest.mock import patch
+
+import numpy as np
+
+from ok_bot.tick_store import TickRecorder, read_aligned, read_ticks
+
+DAY = 1551398400.0  # 2019-03-01 00:00:00 UTC
+
+
+class TestTickStore(TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.root = self._dir.name
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    @patch('ok_bot.tick_store.time.time')
+    def _record(self, ticks, now, depth=False):
+        """ticks: [(local time, instrument_id, best ask, best bid)]"""
+        recorder = TickRecorder(self.root, depth=depth)
+        for local_time, instrument_id, ask, bid in ticks:
+            now.return_value = local_time
+            recorder.tick_received(instrument_id,
+                                   [ask, ask + 0.01], [3, 4],
+                                   [bid], [5],
+                                   '2019-03-01T12:14:50.085Z')
+        now.side_effect = lambda: DAY
+        recorder.shutdown(wait=True)
+
+    def test_round_trip_across_days(self):
+        ticks = [(DAY - 10 + i * 5.0, 'ETH-USD-190329', 100 + i, 99 + i)
+                 for i in range(6)]
+        self._record(ticks)
+        self.assertEqual(
+            {'2019-02-28', '2019-03-01'}, set(os.listdir(self.root)))
+
+        result = read_ticks(self.root, 'ETH-USD-190329', DAY - 5, DAY + 10)
+        self.assertEqual([DAY - 5, DAY, DAY + 5],
+                         result['timestamp_local'].tolist())
+        self.assertEqual([101, 102, 103], result['best_ask_price'].tolist())
+        self.assertEqual([3, 3, 3], result['best_ask_vol'].tolist())
+        self.assertEqual([100, 101, 102], result['best_bid_price'].tolist())
+        self.assertAlmostEqual(DAY + 12 * 3600 + 14 * 60 + 50.085,
+                               result['timestamp_server'][0], places=3)
+
+        one_day = read_ticks(self.root, 'ETH-USD-190329', DAY, DAY + 100,
+                             columns=['best_bid_vol'])
+        self.assertIsInstance(one_day['best_bid_vol'], np.memmap)
+        self.assertEqual([5, 5, 5, 5], one_day['best_bid_vol'].tolist())
+
+        empty = read_ticks(self.root, 'ETH-USD-190329', DAY + 100, DAY + 200)
+        self.assertEqual(0, len(empty['best_ask_price']))
+
+    def test_depth(self):
+        self._record([(DAY, 'ETH-USD-190329', 100, 99)], depth=True)
+        result = read_ticks(self.root, 'ETH-USD-190329', DAY, DAY + 1,
+                            columns=['ask_prices', 'bid_vols'])
+        np.testing.assert_equal([[100, 100.01, np.nan, np.nan, np.nan]],
+                                result['ask_prices'])
+        self.assertEqual([[5, 0, 0, 0, 0]], result['bid_vols'].tolist())
+
+    def test_truncated_column(self):
+        self._record([(DAY + i, 'ETH-USD-190329', 100, 99) for i in range(3)])
+        path = os.path.join(self.root, '2019-03-01', 'ETH-USD-190329',
+                            'best_ask_price.bin')
+        with open(path, 'r+b') as f:
+            f.truncate(8 * 2 + 3)
+        result = read_ticks(self.root, 'ETH-USD-190329', DAY, DAY + 10)
+        self.assertEqual(2, len(result['timestamp_local']))
+        self.assertEqual(2, len(result['best_bid_price']))
+
+    def test_clock_stepped_back(self):
+        self._record([(DAY + 5, 'ETH-USD-190329', 100, 99),
+                      (DAY + 3, 'ETH-USD-190329', 101, 100),
+                      (DAY + 6, 'ETH-USD-190329', 102, 101)])
+        result = read_ticks(self.root, 'ETH-USD-190329', DAY + 5, DAY + 6)
+        self.assertEqual([DAY + 5, DAY + 5],
+                         result['timestamp_local'].tolist())
+        self.assertEqual([100, 101], result['best_ask_price'].tolist())
+
+    @patch('ok_bot.tick_store.time.time')
+    def test_failed_write_keeps_columns_aligned(self, now):
+        recorder = TickRecorder(self.root)
+        original_file = recorder._file
+        fail = []
+
+        class _FullDisk:
+            def __init__(self, f):
+                self._f = f
+
+            def write(self, data):
+                raise OSError('No space left on device')
+
+            def __getattr__(self, name):
+                return getattr(self._f, name)
+
+        def _file(day, name):
+            f = original_file(day, name)
+            if name.endswith('best_bid_price.bin') and fail:
+                return _FullDisk(f)
+            return f
+
+        recorder._file = _file
+        for i in range(3):
+            now.return_value = DAY + i
+            del fail[:]
+            if i == 1:
+                fail.append(True)
+            recorder.tick_received('ETH-USD-190329', [100 + i], [3],
+                                   [99 + i], [5], '2019-03-01T12:14:50.085Z')
+            recorder.flush()
+        now.side_effect = lambda: DAY
+        recorder.shutdown(wait=True)
+
+        self.assertEqual(2, recorder.num_ticks)
+        result = read_ticks(self.root, 'ETH-USD-190329', DAY, DAY + 10)
+        self.assertEqual([DAY, DAY + 2], result['timestamp_local'].tolist())
+        self.assertEqual([100, 102], result['best_ask_price'].tolist())
+        self.assertEqual([99, 101], result['best_bid_price'].tolist())
+
+    def test_read_aligned(self):
+        self._record([(DAY + 1, 'A', 100, 99),
+                      (DAY + 2, 'B', 200, 199),
+                      (DAY + 3, 'A', 101, 100)])
+        timestamps, aligned = read_aligned(self.root, ['A', 'B'],
+                                           DAY, DAY + 10,
+                                           columns=['best_ask_price'])
+        self.assertEqual([DAY + 1, DAY + 2, DAY + 3], timestamps.tolist())
+        self.assertEqual([100, 100, 101],
+                         aligned['A']['best_ask_price'].tolist())
+        np.testing.assert_equal([np.nan, 200, 200],
+                                aligned['B']['best_ask_price'])
+
+
+if __name__ == '__main__':
+    unittest.main()
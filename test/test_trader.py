@@ -2,13 +2,14 @@ import asyncio
 import logging
 import unittest
 from unittest import TestCase
-from unittest.mock import Mock
+from unittest.mock import Mock, call, patch
 
 from ok_bot import constants, logger, singleton
 from ok_bot.mock import AsyncMock
 
-from ok_bot.order_book import AvailableOrder
+from ok_bot.order_book import AvailableOrder, MarketDepth
 from ok_bot.order_executor import OrderExecutor
+from ok_bot.trader import Trader, strategy_memo_hit_rate
 from ok_bot.trigger_strategy import ArbitragePlan
 
 
@@ -111,5 +112,70 @@ class TestTrader(TestCase):
             int(10 * constants.AMOUNT_SHRINK))
 
 
+class TestStrategyMemo(TestCase):
+    def setUp(self):
+        logger.init_global_logger(log_level=logging.INFO, log_to_stderr=False)
+        self._loop, self._order_book = singleton.loop, singleton.order_book
+        singleton.loop = asyncio.new_event_loop()
+        self.depth = {
+            'A': MarketDepth('A', [100.0], [10], [99.0], [10],
+                             '2019-01-01T00:00:00.000Z'),
+            'B': MarketDepth('B', [101.0], [10], [100.5], [10],
+                             '2019-01-01T00:00:00.000Z'),
+        }
+        singleton.order_book = Mock()
+        singleton.order_book.market_depth = lambda instrument_id: \
+            self.depth[instrument_id]
+        self.trader = Trader()
+        self.trader.trigger_strategy = Mock()
+        self.trader.trigger_strategy.find_plans = Mock(return_value=[])
+        self.trader.kick_off_within_quota = Mock()
+        self.trader._is_pair_tradable = Mock(return_value=True)
+        self.pairs = [('A', 'B', 'A*B'), ('B', 'A', 'B*A')]
+
+    def tearDown(self):
+        singleton.loop.close()
+        singleton.loop, singleton.order_book = self._loop, self._order_book
+
+    @patch.object(constants, 'STRATEGY_MEMO_STATS_EPOCH_SECOND', 3600)
+    def test_unchanged_top_of_book_reuses_decision(self):
+        plan = ArbitragePlan(
+            volume=1,
+            slow_instrument_id='A',
+            fast_instrument_id='B',
+            slow_side=constants.LONG,
+            fast_side=constants.SHORT,
+            slow_price=100,
+            fast_price=100.5,
+            close_price_gap=0,
+            estimate_net_profit=1,
+            z_score=3.0)
+        self.trader.trigger_strategy.find_plans.return_value = [plan]
+        hits = strategy_memo_hit_rate.hits
+        self.trader.process_pairs(self.pairs)
+        self.trader.process_pairs(self.pairs)
+        self.assertEqual(1, self.trader.trigger_strategy.find_plans.call_count)
+        self.assertEqual(hits + 2, strategy_memo_hit_rate.hits)
+        self.assertEqual([call(plan), call(plan)],
+                         self.trader.kick_off_within_quota.call_args_list)
+
+        # Deeper levels don't matter, the best volume does.
+        self.depth['A'].update([100.0, 100.5], [10, 3], [99.0], [10])
+        self.trader.process_pairs(self.pairs)
+        self.assertEqual(1, self.trader.trigger_strategy.find_plans.call_count)
+        self.depth['A'].update([100.0], [9], [99.0], [10])
+        self.trader.process_pairs(self.pairs)
+        self.assertEqual(2, self.trader.trigger_strategy.find_plans.call_count)
+        # Only A*B uses the ask of A.
+        snapshot = singleton.order_book.spread_snapshot.call_args[0][0]
+        self.assertEqual([('A', 'B', 'A*B')], snapshot)
+
+    @patch.object(constants, 'STRATEGY_MEMO_STATS_EPOCH_SECOND', 0)
+    def test_disabled(self):
+        self.trader.process_pairs(self.pairs)
+        self.trader.process_pairs(self.pairs)
+        self.assertEqual(2, self.trader.trigger_strategy.find_plans.call_count)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -9,8 +9,9 @@ import numpy as np
 from ok_bot import constants, logger, server_time, singleton, trigger_strategy
 from ok_bot.arbitrage_execution import LONG, SHORT
 from ok_bot.mock import AsyncMock
-from ok_bot.order_book import MarketDepth
+from ok_bot.order_book import AvailableOrder, MarketDepth, SpreadSnapshot
 from ok_bot.trigger_strategy import (PercentageTriggerStrategy,
+                                     SimpleTriggerStrategy,
                                      calculate_amount_margin,
                                      make_arbitrage_plan)
 
@@ -31,6 +32,38 @@ class TestPercentageTriggerStrategy(TestCase):
                            trigger_strategy.spot_profit(100, 100.01, 200, 200))
 
     def test_estimate_profit(self):
+        for method in ['monte_carlo', 'closed_form']:
+            with patch.object(constants, 'ESTIMATE_PROFIT_METHOD', method):
+                self._test_estimate_profit()
+
+    def test_estimate_profit_closed_form_is_worst_case_in_band(self):
+        std_rate = constants.ESTIMATE_PROFIT_PRICE_STD_RATE
+        for low, high, gap in [(100, 101, 0.5), (100, 150, 10),
+                               (100, 101, 20), (200, 199, -0.5)]:
+            prices = {LONG: low, SHORT: high}
+            bound = trigger_strategy.estimate_profit_lower_bound(
+                prices, gap, sigmas=2)
+            high_ends = np.concatenate([
+                np.linspace(high * (1 - 2 * std_rate),
+                            high * (1 + 2 * std_rate), 10001),
+                np.linspace(low * (1 - 2 * std_rate),
+                            low * (1 + 2 * std_rate), 10001) + gap])
+            brute_force = trigger_strategy.spot_profit(
+                low, high_ends - gap, high, high_ends).min()
+            self.assertAlmostEqual(bound, brute_force, places=9)
+
+    def test_estimate_profit_more_samples_is_more_conservative(self):
+        np.random.seed(0)
+        prices = {LONG: 100, SHORT: 101}
+        few = np.mean([trigger_strategy.estimate_profit(prices, 0.5,
+                                                        samples=10)
+                       for _ in range(100)])
+        many = np.mean([trigger_strategy.estimate_profit(prices, 0.5,
+                                                         samples=1000)
+                        for _ in range(100)])
+        self.assertLess(many, few)
+
+    def _test_estimate_profit(self):
         self.assertLess(
             trigger_strategy.estimate_profit(
                 {
@@ -65,6 +98,188 @@ class TestPercentageTriggerStrategy(TestCase):
         )
 
 
+class TestFindPlans(TestCase):
+    def setUp(self):
+        logger.init_global_logger(log_level=logging.INFO, log_to_stderr=False)
+        singleton.coin_currency = 'ETH'
+        np.random.seed(0)
+        pairs = [('A', 'B', 'B*A'), ('B', 'A', 'A*B'),
+                 ('A', 'C', 'C*A'), ('C', 'A', 'A*C'),
+                 ('B', 'C', 'C*B'), ('C', 'B', 'B*C')]
+        ask = {'A': 100.0, 'B': 100.5, 'C': 101.5}
+        bid = {'A': 99.9, 'B': 100.4, 'C': 101.3}
+        n = len(pairs)
+        self.snapshot = SpreadSnapshot(
+            long_instruments=[long for long, _, _ in pairs],
+            short_instruments=[short for _, short, _ in pairs],
+            products=[product for _, _, product in pairs],
+            long_ask_prices=np.array([ask[long] for long, _, _ in pairs]),
+            short_bid_prices=np.array([bid[short] for _, short, _ in pairs]),
+            current_spreads=np.array(
+                [bid[short] - ask[long] for long, short, _ in pairs]),
+            historical_mean_spreads=np.random.normal(0, 1, n),
+            median_spreads=np.random.normal(0, 1, n),
+            zscores=np.array([0.5, 3, 3, 0.1, 2, 1.5]),
+        )
+        index = {product: i
+                 for i, product in enumerate(self.snapshot.products)}
+        order_book = Mock()
+        order_book.zscore = lambda product: \
+            self.snapshot.zscores[index[product]]
+        order_book.historical_mean_spread = lambda product: \
+            self.snapshot.historical_mean_spreads[index[product]]
+        order_book.median_spread = lambda product: \
+            self.snapshot.median_spreads[index[product]]
+        order_book.current_spread = lambda product: \
+            self.snapshot.current_spreads[index[product]]
+        order_book.current_price_average = lambda product: (
+            self.snapshot.long_ask_prices[index[product]] +
+            self.snapshot.short_bid_prices[index[product]]) / 2
+        order_book.market_depth = lambda instrument_id: Mock(
+            best_ask_price=Mock(return_value=ask[instrument_id]),
+            best_bid_price=Mock(return_value=bid[instrument_id]))
+        self._order_book = singleton.order_book
+        singleton.order_book = order_book
+
+    def tearDown(self):
+        singleton.order_book = self._order_book
+
+    def _assert_same_plans(self, strategy):
+        strategy._make_plan = Mock(side_effect=lambda **kwargs: kwargs)
+        scalar_plans = []
+        for long_instrument, short_instrument, product in zip(
+                self.snapshot.long_instruments,
+                self.snapshot.short_instruments,
+                self.snapshot.products):
+            plan = strategy.is_there_a_plan(long_instrument,
+                                            short_instrument,
+                                            product)
+            if plan is not None:
+                scalar_plans.append(plan)
+        batch_plans = strategy.find_plans(self.snapshot)
+        self.assertGreater(len(batch_plans), 0)
+        self.assertLess(len(batch_plans), len(self.snapshot.products))
+        self.assertEqual(len(scalar_plans), len(batch_plans))
+        for scalar_plan, batch_plan in zip(scalar_plans, batch_plans):
+            self.assertEqual(scalar_plan.keys(), batch_plan.keys())
+            for key in scalar_plan:
+                if isinstance(scalar_plan[key], str):
+                    self.assertEqual(scalar_plan[key], batch_plan[key])
+                else:
+                    self.assertAlmostEqual(float(scalar_plan[key]),
+                                           float(batch_plan[key]))
+
+    @patch.object(constants, 'ESTIMATE_PROFIT_METHOD', 'closed_form')
+    @patch.object(constants, 'MIN_ESTIMATE_PROFIT', -1e-3)
+    def test_percentage_strategy(self):
+        self._assert_same_plans(PercentageTriggerStrategy())
+
+    @patch.object(constants, 'ESTIMATE_PROFIT_METHOD', 'closed_form')
+    @patch.object(constants, 'MIN_ESTIMATE_PROFIT', -1e-3)
+    @patch.object(constants, 'SPREAD_CENTER', 'median')
+    def test_percentage_strategy_median_center(self):
+        self._assert_same_plans(PercentageTriggerStrategy())
+
+    @patch.object(constants, 'SIMPLE_STRATEGY_RETURN_RATE_THRESHOLD', -1e-3)
+    def test_simple_strategy(self):
+        self._assert_same_plans(SimpleTriggerStrategy())
+
+    @patch.object(constants, 'ESTIMATE_PROFIT_METHOD', 'closed_form')
+    @patch.object(constants, 'MIN_ESTIMATE_PROFIT', -1e-3)
+    @patch.object(logging, 'log_every_n_seconds')
+    def test_percentage_heartbeat_summarizes_all_products(self, log):
+        strategy = PercentageTriggerStrategy()
+        strategy._make_plan = Mock(side_effect=lambda **kwargs: kwargs)
+        plans = strategy.find_plans(self.snapshot)
+        log.assert_called_once()
+        args = log.call_args[0]
+        num_not_triggered, num_products, product = args[3:6]
+        self.assertEqual(len(self.snapshot.products), num_products)
+        self.assertEqual(num_products - len(plans), num_not_triggered)
+        triggered = {(plan['long_instrument'], plan['short_instrument'])
+                     for plan in plans}
+        not_triggered = [
+            i for i, pair in enumerate(zip(self.snapshot.long_instruments,
+                                           self.snapshot.short_instruments))
+            if pair not in triggered]
+        self.assertIn(product,
+                      [self.snapshot.products[i] for i in not_triggered])
+        # Over all products not triggered, not only the first one.
+        self.assertEqual(max(self.snapshot.zscores[not_triggered]),
+                         args[-1])
+
+    @patch.object(constants, 'SIMPLE_STRATEGY_RETURN_RATE_THRESHOLD', -1e-3)
+    @patch.object(logging, 'log_every_n_seconds')
+    def test_simple_return_rates_summarize_all_products(self, log):
+        strategy = SimpleTriggerStrategy()
+        strategy._make_plan = Mock(side_effect=lambda **kwargs: kwargs)
+        plans = strategy.find_plans(self.snapshot)
+        log.assert_called_once()
+        num_triggered, num_products, long_instrument, short_instrument = \
+            log.call_args[0][3:7]
+        self.assertEqual(len(plans), num_triggered)
+        self.assertEqual(len(self.snapshot.products), num_products)
+        best = max(plans, key=lambda plan: plan['estimate_return_rate'])
+        self.assertEqual(best['long_instrument'], long_instrument)
+        self.assertEqual(best['short_instrument'], short_instrument)
+        # Only computed when logged, as before the batch path.
+        self.assertEqual({}, dict(strategy.stats))
+
+    def test_estimate_profit_batch(self):
+        long_prices = np.array([100, 100, 100, 200])
+        short_prices = np.array([101, 150, 101, 199])
+        gaps = np.array([0.5, 10, 20, -0.5])
+        lower_bounds = trigger_strategy.estimate_profit_batch(
+            long_prices, short_prices, gaps, method='closed_form')
+        for i in range(len(gaps)):
+            self.assertAlmostEqual(
+                lower_bounds[i],
+                trigger_strategy.estimate_profit_lower_bound(
+                    {LONG: long_prices[i], SHORT: short_prices[i]}, gaps[i]))
+        with patch.object(constants, 'ESTIMATE_PROFIT_CLOSED_FORM_SIGMAS', 8):
+            wide_bounds = trigger_strategy.estimate_profit_batch(
+                long_prices, short_prices, gaps, method='closed_form')
+        estimates = trigger_strategy.estimate_profit_batch(
+            long_prices, short_prices, gaps, samples=100)
+        self.assertTrue((wide_bounds <= estimates).all())
+
+
+class TestAmountMargin(TestCase):
+    def test_max_gap_matches_callable_on_random_books(self):
+        np.random.seed(0)
+        for _ in range(500):
+            ask_stack, bid_stack = trigger_strategy._random_book(
+                np.random.randint(1, 12))
+            # Multiples of 0.25 hit price gaps exactly.
+            for gap in [-3, -0.5, 0, 0.25, 0.5, 1, 2.75, 5]:
+                expected = calculate_amount_margin(
+                    ask_stack, bid_stack,
+                    lambda ask, bid: ask - bid <= gap)
+                self.assertEqual(
+                    expected,
+                    calculate_amount_margin(ask_stack, bid_stack,
+                                            max_gap=gap))
+
+    def test_empty_stack(self):
+        ask_stack, _ = trigger_strategy._random_book(5)
+        self.assertEqual(
+            0, calculate_amount_margin(ask_stack, [], max_gap=100))
+        self.assertEqual(
+            0, calculate_amount_margin([], ask_stack, max_gap=100))
+
+    def test_gap_at_threshold_after_float_rounding(self):
+        # 1.1 - 0.8 is 0.30000000000000004.
+        self.assertEqual(1, calculate_amount_margin(
+            [AvailableOrder(1.1, 1)], [AvailableOrder(0.8, 1)], max_gap=0.3))
+
+    def test_empty_bid_levels_are_skipped(self):
+        ask_stack = [AvailableOrder(100, 3), AvailableOrder(101, 2)]
+        bid_stack = [AvailableOrder(101, 0), AvailableOrder(100.5, -1),
+                     AvailableOrder(100, 4)]
+        self.assertEqual(4, calculate_amount_margin(ask_stack, bid_stack,
+                                                    max_gap=1))
+
+
 class FeatTestPercentageTriggerStrategy(TestCase):
     def setUp(self):
         logger.init_global_logger(log_level=logging.INFO, log_to_stderr=False)